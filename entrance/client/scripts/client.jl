@@ -22,11 +22,15 @@ args = let s = ArgParseSettings()
         "--write_format"
             arg_type=String
             default="json"
+        "--batch_size"
+            help="number of trips sent in one request to /match_batch"
+            arg_type=Int
+            default=200
     end
     parse_args(s; as_symbols=true)
 end
 
-url =  "http://127.0.0.1:$(args[:port])/match"
+url =  "http://127.0.0.1:$(args[:port])/match_batch"
 
 inputpath  = "../../../trips/input"
 outputpath = "../../../trips/output"
@@ -36,32 +40,21 @@ tripfiles  = readdir(inputpath)
 
 porto_bound = (-8.7015, -8.5302, 40.0990, 41.2082)
 
-readtrips, process = @match args[:city] begin
-    "chengdu" || "xian" => begin
-        readtripsgaia, trip -> begin
-            gcj2wgs!(trip)
-            match!(trip, url)
-            trip.validspeed = validspeed(trip)
-            trip
-        end
-    end
-    "harbin" => begin
-        readtripsharbin, trip -> begin
-            match!(trip, url)
-            trip.validspeed = validspeed(trip)
-            trip
-        end
-    end
-    "porto" => begin
-        readtripsporto, trip -> begin
-            match!(trip, url)
-            trip.validspeed = validspeed(trip)
-            trip
-        end
-    end
+readtrips, prepare! = @match args[:city] begin
+    "chengdu" || "xian" => (readtripsgaia, gcj2wgs!)
+    "harbin" => (readtripsharbin, identity)
+    "porto" => (readtripsporto, identity)
     city => error("unsupported city $city.")
 end
 
+## A batch of trips is matched with a single http request to amortize the request overhead.
+process = batch -> begin
+    foreach(prepare!, batch)
+    match_batch!(batch, url)
+    foreach(trip -> trip.validspeed = validspeed(trip), batch)
+    batch
+end
+
 writetrips, suffix = @match args[:write_format] begin
     "json" => (writetripsjson, ".json")
     "csv" =>  (writetripscsv, ".csv")
@@ -76,7 +69,9 @@ for tripfile in tripfiles
     args[:city] == "porto" && filter!(trip -> inregion(trip, porto_bound), trips)
     #trips = trips[1:1000]
     println("Processing $(length(trips)) trips in $(tripfile)...")
-    @time trips = @showprogress pmap(process, trips)
+    batches = [trips[i:min(i+args[:batch_size]-1, end)] for i in 1:args[:batch_size]:length(trips)]
+    @time batches = @showprogress pmap(process, batches)
+    trips = vcat(Trip[], batches...)
     states = pmap(trip -> trip.state, trips)
     valids = pmap(trip -> !trip.validspeed, trips)
     writetrips(joinpath(outputpath, splitext(tripfile) |> first |> f -> f * suffix), trips)
@@ -5,6 +5,10 @@ headers = ["Content-Type" => "application/json"]
 
 function process_response(response)
     parsed = JSON.parse(response.body |> String)
+    process_parsed(parsed)
+end
+
+function process_parsed(parsed)
     if get(parsed, "state", 0) == 1
         cpath    = get(parsed, "cpath", [])
         index    = get(parsed, "indices", [])
@@ -33,10 +37,7 @@ function process_response(response)
     end
 end
 
-function match!(trip::Trip, url::String)
-    gps_wkt = lonlat2wktlinestring(trip.lon, trip.lat)
-    response = HTTP.post(url, headers, JSON.json(Dict("gps_wkt" => gps_wkt)))
-    processed, state = process_response(response)
+function update_trip!(trip::Trip, processed, state)
     trip.opath = processed.opath 
     trip.cpath = processed.cpath
     trip.index = processed.index
@@ -46,4 +47,77 @@ function match!(trip::Trip, url::String)
     trip.spdist = processed.spdist
     trip.state = state
     trip
-end
\ No newline at end of file
+end
+
+function match!(trip::Trip, url::String)
+    gps_wkt = lonlat2wktlinestring(trip.lon, trip.lat)
+    response = HTTP.post(url, headers, JSON.json(Dict("gps_wkt" => gps_wkt)))
+    processed, state = process_response(response)
+    update_trip!(trip, processed, state)
+end
+
+"""
+    match_coords!(trip::Trip, url::String)
+
+Send the coordinates of `trip` as packed little-endian float64 arrays to the
+`/match_coords` endpoint, which skips the WKT formatting and parsing.
+"""
+function match_coords!(trip::Trip, url::String)
+    hasts = length(trip.tms) == length(trip.lon)
+    body = hasts ? vcat(trip.lon, trip.lat, trip.tms) : vcat(trip.lon, trip.lat)
+    response = HTTP.post(url * (hasts ? "?ts=1" : ""), 
+                         ["Content-Type" => "application/octet-stream"],
+                         collect(reinterpret(UInt8, htol.(body))))
+    processed, state = process_response(response)
+    update_trip!(trip, processed, state)
+end
+
+"""
+    match_batch!(trips::Vector{Trip}, url::String)
+
+Match all `trips` with a single request to the `/match_batch` endpoint, the results
+are returned in the same order as the trips were sent.
+"""
+function match_batch!(trips::Vector{Trip}, url::String)
+    req = [Dict("id" => i, "gps_wkt" => lonlat2wktlinestring(trip.lon, trip.lat)) 
+           for (i, trip) in enumerate(trips)]
+    response = HTTP.post(url, headers, JSON.json(Dict("trips" => req)))
+    results = JSON.parse(response.body |> String)["results"]
+    for (trip, parsed) in zip(trips, results)
+        processed, state = process_parsed(parsed)
+        update_trip!(trip, processed, state)
+    end
+    trips
+end
+
+"""
+    unpack_columns(data::Vector{UInt8}, offset::Int=0)
+
+Decode a record packed by the server for `format=packed`, returning a `Dict` mapping
+the field names to `Vector{Int64}`/`Vector{Float64}` and the offset of the next byte.
+"""
+function unpack_columns(data::Vector{UInt8}, offset::Int=0)
+    io = IOBuffer(data)
+    seek(io, offset)
+    columns = Dict{String, Any}()
+    for _ in 1:ltoh(read(io, UInt32))
+        name = String(read(io, Int(read(io, UInt8))))
+        T = read(io, UInt8) == UInt8('q') ? Int64 : Float64
+        value = ltoh.(reinterpret(T, read(io, sizeof(T) * Int(ltoh(read(io, UInt32))))))
+        columns[name] = name == "state" ? first(value) : collect(value)
+    end
+    columns, position(io)
+end
+
+"""
+    match_columns(trip::Trip, url::String; fields="cpath,ratio")
+
+Match `trip` requesting only `fields` in the packed binary format, the geometries
+`mgeom` and `pgeom` are returned as flat coordinate vectors x1,y1,x2,y2,...
+"""
+function match_columns(trip::Trip, url::String; fields="cpath,ratio")
+    gps_wkt = lonlat2wktlinestring(trip.lon, trip.lat)
+    response = HTTP.post(url * "?format=packed&fields=" * fields, headers,
+                         JSON.json(Dict("gps_wkt" => gps_wkt)))
+    first(unpack_columns(response.body))
+end
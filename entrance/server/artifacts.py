@@ -0,0 +1,210 @@
+"""
+The bookkeeping of the generated UBODT and network snapshot files. A UBODT file
+`ubodt.bin` is keyed on the content hash of the network files together with the
+generation options (delta, the id/source/target fields, the format), which are
+written to `ubodt.bin.meta.json` next to it. `ubodt_gen.py` reuses a file whose
+metadata still matches instead of regenerating it and `MapMatcher` refuses a UBODT
+generated from another network. The network snapshot `edges.snap` and the candidate
+index `candidates.idx` are tracked the same way and `MapMatcher` loads them only while
+they are valid, as is the manifest `tiles/tiles.json` of the tiles written by `tile_gen.py`.
+"""
+import contextlib, hashlib, json, os, time
+
+## The extensions of the files making up a shapefile network.
+SHAPEFILE_PARTS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+## Bumped whenever the UBODT generation changes so that the old files are regenerated.
+GENERATOR_VERSION = 1
+## The same as `Network::SNAPSHOT_VERSION`.
+SNAPSHOT_VERSION = 1
+## The same as `CandidateIndex::VERSION`.
+CANDIDATE_INDEX_VERSION = 1
+## Bumped whenever the tiling by `tile_gen.py` changes.
+TILES_VERSION = 1
+
+
+@contextlib.contextmanager
+def open_atomic(filename: str, mode: str = "w"):
+    """
+    Open a temporary file to be written in place of `filename`, which it replaces only
+    once it is complete, so that a crash never leaves a partial file and a reader never
+    sees one. The temporary file is named after the process, so that several processes
+    can write the same file.
+    """
+    tmp_file = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, mode) as f:
+            yield f
+        os.replace(tmp_file, filename)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def write_atomic(filename: str, text: str) -> None:
+    """
+    Write `text` to `filename` with `open_atomic()`.
+    """
+    with open_atomic(filename) as f:
+        f.write(text)
+
+
+def network_files(network_file: str) -> list:
+    stem, ext = os.path.splitext(network_file)
+    if ext.lower() != ".shp":
+        return [network_file]
+    return [stem + part for part in SHAPEFILE_PARTS if os.path.exists(stem + part)]
+
+
+def file_stat(filename: str) -> dict:
+    st = os.stat(filename)
+    return {"name": os.path.basename(filename), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def hash_files(filenames: list) -> str:
+    h = hashlib.sha256()
+    for filename in filenames:
+        h.update(os.path.basename(filename).encode() + b"\0")
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+
+def meta_file(artifact_file: str) -> str:
+    return artifact_file + ".meta.json"
+
+
+def read_meta(artifact_file: str):
+    try:
+        with open(meta_file(artifact_file), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def network_hash(network_file: str, meta=None) -> str:
+    """
+    The content hash of the network files, the hash recorded in `meta` is reused without
+    reading the files if their sizes and modification times are unchanged.
+    """
+    files = network_files(network_file)
+    stats = [file_stat(f) for f in files]
+    if meta is not None and meta.get("network_stats") == stats:
+        return meta["network_hash"]
+    return hash_files(files)
+
+
+def ubodt_options(network_id: str, network_source: str, network_target: str, delta: float) -> dict:
+    """
+    The options the content of a UBODT depends on besides the network files.
+    """
+    return {"id": network_id, "source": network_source, "target": network_target,
+            "delta": delta, "generator": GENERATOR_VERSION}
+
+
+def snapshot_options(network_id: str, network_source: str, network_target: str) -> dict:
+    """
+    The options the content of a network snapshot depends on besides the network files.
+    """
+    return {"id": network_id, "source": network_source, "target": network_target,
+            "snapshot": SNAPSHOT_VERSION}
+
+
+def candidate_index_options(network_id: str, network_source: str, network_target: str, radius: float,
+                            cell_size: float) -> dict:
+    """
+    The options the content of a candidate index depends on besides the network files.
+    """
+    return {"id": network_id, "source": network_source, "target": network_target,
+            "radius": radius, "cell_size": cell_size, "candidate_index": CANDIDATE_INDEX_VERSION}
+
+
+def tiles_options(network_id: str, network_source: str, network_target: str, tile_size: float,
+                  margin: float, delta: float) -> dict:
+    """
+    The options the tiles of a network depend on besides the network files.
+    """
+    return {"id": network_id, "source": network_source, "target": network_target,
+            "tile_size": tile_size, "margin": margin, "delta": delta, "tiles": TILES_VERSION}
+
+
+def ubodt_fingerprint(network_hash: str, options: dict) -> str:
+    return hashlib.sha256(json.dumps({"network": network_hash, "options": options},
+                                     sort_keys=True).encode()).hexdigest()
+
+
+def remove_meta(artifact_file: str) -> None:
+    """
+    Invalidate `artifact_file` before it is regenerated, so that an interrupted
+    generation is never taken as valid.
+    """
+    if os.path.exists(meta_file(artifact_file)):
+        os.remove(meta_file(artifact_file))
+
+
+def write_meta(artifact_file: str, network_file: str, options: dict, seconds: float = None) -> dict:
+    """
+    Record the fingerprint of a freshly generated `artifact_file`.
+    """
+    digest = network_hash(network_file)
+    meta = {"artifact": file_stat(artifact_file),
+            "network_file": os.path.abspath(network_file),
+            "network_stats": [file_stat(f) for f in network_files(network_file)],
+            "network_hash": digest,
+            "options": options,
+            "fingerprint": ubodt_fingerprint(digest, options),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seconds": seconds}
+    write_atomic(meta_file(artifact_file), json.dumps(meta, indent=2))
+    return meta
+
+
+def is_valid(artifact_file: str, network_file: str, options: dict) -> bool:
+    """
+    Return true if `artifact_file` exists and was generated from the current network
+    files with `options`, the recorded size guards against a truncated file.
+    """
+    meta = read_meta(artifact_file)
+    if meta is None or not os.path.exists(artifact_file):
+        return False
+    if meta["artifact"]["size"] != os.path.getsize(artifact_file):
+        return False
+    return meta["fingerprint"] == ubodt_fingerprint(network_hash(network_file, meta), options)
+
+
+def check_ubodt(ubodt_file: str, network_file: str, network_id: str, network_source: str,
+                network_target: str) -> None:
+    """
+    Raise ValueError if the metadata of `ubodt_file` shows it was generated from another
+    network than `network_file`; a UBODT without metadata is accepted with a warning.
+    """
+    meta = read_meta(ubodt_file)
+    if meta is None:
+        print(f"Warning: {meta_file(ubodt_file)} is missing, {ubodt_file} is not checked against the network.")
+        return
+    options = meta["options"]
+    if (options["id"], options["source"], options["target"]) != (network_id, network_source, network_target):
+        raise ValueError(f"{ubodt_file} was generated with the fields id={options['id']} source={options['source']} "
+                         f"target={options['target']}, regenerate it with ubodt_gen.py.")
+    if meta["network_hash"] != network_hash(network_file, meta):
+        raise ValueError(f"{ubodt_file} is stale, it was generated from another version of {network_file}, "
+                         f"regenerate it with ubodt_gen.py.")
+    if meta["artifact"]["size"] != os.path.getsize(ubodt_file):
+        raise ValueError(f"{ubodt_file} has {os.path.getsize(ubodt_file)} bytes but {meta['artifact']['size']} "
+                         f"bytes were written, regenerate it with ubodt_gen.py.")
+
+
+def valid_candidate_index(index_file: str, network_file: str, network_id: str, network_source: str,
+                          network_target: str) -> bool:
+    """
+    Return true if `index_file` was generated from the current `network_file` with the
+    given fields, whatever its radius and cell size.
+    """
+    meta = read_meta(index_file)
+    if meta is None:
+        return False
+    options = meta["options"]
+    if options.get("candidate_index") != CANDIDATE_INDEX_VERSION:
+        return False
+    return is_valid(index_file, network_file, candidate_index_options(
+        network_id, network_source, network_target, options["radius"], options["cell_size"]))
@@ -0,0 +1,277 @@
+"""
+Benchmark the matching engine on the bundled networks without the server, e.g.,
+
+    python bench_engine.py --networks harbin chengdu example --output bench_engine.jsonl
+
+For each network the loading stages (network, graph, snapshot, UBODT generation and
+loading) are timed, then synthetic trips are generated by chaining the shortest paths
+between random nodes of the `NetworkGraph`, resampling them every `spacing` and adding
+Gaussian noise. The trips are matched one by one with `match_wkt` for every combination
+of the swept model, `k`, `radius`, `gps_error` and trip length (and with the candidate
+index of the radius in place of the rtree for `--candidate_index`), and the throughput, the
+latency percentiles, the match rate and the recall of the true edges are measured. Every
+measurement is appended to `--output` as a JSON line, so that runs on different commits
+or machines can be compared. The trips only depend on `--seed`, the network and its
+parameters.
+"""
+import argparse, json, os, platform, socket, subprocess, tempfile, time
+import numpy as np
+from fmm import (Network, NetworkGraph, UBODTGenAlgorithm, UBODT, FastMapMatch, FastMapMatchConfig,
+                 STMATCH, STMATCHConfig, CandidateIndex)
+
+## The bundled networks with the UBODT delta, the spacing and noise of the synthetic trips
+## and the default sweeps, all in the unit of the network (degrees for the cities).
+NETWORKS = {
+    "harbin": {"file": "../data/cities/harbin/edges.shp", "id": "fid", "source": "u", "target": "v",
+               "delta": 0.03, "spacing": 0.0015, "noise": 0.0002,
+               "k": [8, 16, 32], "radius": [0.003, 0.01], "gps_error": [0.0005, 0.002]},
+    "chengdu": {"file": "../data/cities/chengdu/edges.shp", "id": "fid", "source": "u", "target": "v",
+                "delta": 0.03, "spacing": 0.0015, "noise": 0.0002,
+                "k": [8, 16, 32], "radius": [0.003, 0.01], "gps_error": [0.0005, 0.003]},
+    "example": {"file": "../../fmm/example/data/edges.shp", "id": "id", "source": "source", "target": "target",
+                "delta": 3, "spacing": 0.3, "noise": 0.05,
+                "k": [4, 8], "radius": [0.4, 1], "gps_error": [0.1, 0.5]},
+}
+
+
+def environment() -> dict:
+    """
+    The machine and the commit the benchmark runs on, recorded in every result.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"host": socket.gethostname(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "python": platform.python_version(), "commit": commit,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def timed(f):
+    tic = time.perf_counter()
+    value = f()
+    return value, time.perf_counter() - tic
+
+
+def load_network(spec: dict, workdir: str, name: str, reuse: bool = False) -> tuple:
+    """
+    Load the network and generate its UBODT into `workdir`, return the network, the graph,
+    the UBODT and the seconds taken by each stage. With `reuse` an existing UBODT in
+    `workdir` is loaded instead of being generated again.
+    """
+    timings = {}
+    network, timings["network"] = timed(lambda: Network(spec["file"], spec["id"], spec["source"], spec["target"]))
+    graph, timings["graph"] = timed(lambda: NetworkGraph(network))
+    snapshot_file = os.path.join(workdir, f"{name}.snap")
+    _, timings["snapshot_save"] = timed(lambda: network.save_snapshot(snapshot_file))
+    _, timings["snapshot_load"] = timed(lambda: Network(snapshot_file, spec["id"], spec["source"], spec["target"]))
+    ubodt_file = os.path.join(workdir, f"{name}_ubodt.bin")
+    mmap_file = os.path.join(workdir, f"{name}_ubodt.mmap")
+    if not (reuse and os.path.exists(ubodt_file)):
+        _, timings["ubodt_generate"] = timed(lambda: UBODTGenAlgorithm(network, graph).generate_ubodt(
+            ubodt_file, spec["delta"], binary=True, use_omp=True))
+    ubodt, timings["ubodt_load"] = timed(lambda: UBODT.read_ubodt_file(ubodt_file))
+    _, timings["ubodt_mmap_write"] = timed(lambda: ubodt.write_mmap_file(mmap_file))
+    _, timings["ubodt_mmap_load"] = timed(lambda: UBODT.read_ubodt_file(mmap_file))
+    sizes = {"nodes": network.get_node_count(), "edges": network.get_edge_count(),
+             "ubodt_bytes": os.path.getsize(ubodt_file), "mmap_bytes": os.path.getsize(mmap_file)}
+    return network, graph, ubodt, timings, sizes
+
+
+def synthetic_trips(network, graph, n: int, length: int, spacing: float, noise: float, seed: int = 0) -> list:
+    """
+    Generate `n` trips of `length` points, each of them follows the shortest paths from a
+    random node to random nodes one after another until it is long enough. A trip is
+    returned as the noisy points `(x, y)`, their distances along the route `dist`, the
+    ids of the route edges `edges` and the distance at which each edge starts `starts`.
+    """
+    rng = np.random.default_rng(seed)
+    ## The edges by their index, which is what the graph returns.
+    edges = [network.get_edge(network.get_edge_id(e)) for e in range(network.get_edge_count())]
+    num_nodes = network.get_node_count()
+    route_length = (length - 1) * spacing
+    trips = []
+    attempts = 0
+    while len(trips) < n:
+        attempts += 1
+        if attempts > 100 * n:
+            raise RuntimeError(f"Only {len(trips)} trips are generated, the network may be disconnected.")
+        node = int(rng.integers(num_nodes))
+        route, stalls = [], 0
+        total = 0.0
+        while total < route_length and stalls < 10:
+            path = list(graph.shortest_path_dijkstra(node, int(rng.integers(num_nodes))))
+            if not path:
+                stalls += 1
+                continue
+            route += path
+            total += sum(edges[e].length for e in path)
+            node = edges[path[-1]].target
+        if total < route_length:
+            continue
+        xs, ys, starts = [], [], []
+        for e in route:
+            coords = np.reshape(edges[e].geom.export_coords(), (-1, 2))
+            ## The first point of an edge is the last point of the previous one.
+            skip = 1 if xs else 0
+            starts.append(len(xs) - skip)
+            xs += coords[skip:, 0].tolist()
+            ys += coords[skip:, 1].tolist()
+        xs, ys = np.array(xs), np.array(ys)
+        cumulative = np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(xs), np.diff(ys)))])
+        dist = np.arange(length) * spacing
+        x = np.interp(dist, cumulative, xs) + rng.normal(0, noise, length)
+        y = np.interp(dist, cumulative, ys) + rng.normal(0, noise, length)
+        trips.append({"x": x, "y": y, "dist": dist,
+                      "edges": [edges[e].id for e in route],
+                      "starts": cumulative[starts]})
+    return trips
+
+
+def trip_wkt(trip: dict, length: int) -> str:
+    points = ",".join(f"{x:.8f} {y:.8f}" for x, y in zip(trip["x"][:length], trip["y"][:length]))
+    return f"LINESTRING({points})"
+
+
+def true_edges(trip: dict, length: int) -> set:
+    """
+    The ids of the route edges covered by the first `length` points.
+    """
+    end = trip["dist"][length - 1]
+    return {e for e, start in zip(trip["edges"], trip["starts"]) if start <= end}
+
+
+def bench_match(match, wkts: list, truths: list, warmup: int = 3) -> dict:
+    """
+    Match the trips one by one and summarize the latencies (in milliseconds), the match
+    rate and the mean recall of the true edges by the complete path.
+    """
+    for wkt in wkts[:warmup]:
+        match(wkt)
+    latencies, matched, recalls = [], 0, []
+    tic = time.perf_counter()
+    for wkt, truth in zip(wkts, truths):
+        start = time.perf_counter()
+        result = match(wkt)
+        latencies.append(time.perf_counter() - start)
+        cpath = set(result.cpath)
+        matched += len(cpath) > 0
+        recalls.append(len(cpath & truth) / len(truth))
+    elapsed = time.perf_counter() - tic
+    latencies = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]).tolist()
+    return {"trips": len(wkts), "seconds": elapsed, "trips_per_second": len(wkts) / elapsed,
+            "latency_ms": {"mean": float(latencies.mean()), "p50": p50, "p90": p90, "p99": p99,
+                           "max": float(latencies.max())},
+            "match_rate": matched / len(wkts), "recall": float(np.mean(recalls))}
+
+
+def sweep(network, graph, ubodt, trips: list, args, spec: dict):
+    """
+    Yield the results of every combination of the swept parameters.
+    """
+    fmm_model = FastMapMatch(network, graph, ubodt)
+    stmatch_model = STMATCH(network, graph)
+    ## With --candidate_index each radius is also matched with its index, built once here.
+    indexes = {radius: CandidateIndex.build(network, radius)
+               for radius in args.radius or spec["radius"]} if args.candidate_index else {}
+    for length in args.lengths:
+        wkts = [trip_wkt(t, length) for t in trips]
+        truths = [true_edges(t, length) for t in trips]
+        for model in args.models:
+            for k in args.k or spec["k"]:
+                for radius in args.radius or spec["radius"]:
+                    for index in [None] + ([indexes[radius]] if radius in indexes else []):
+                        network.set_candidate_index(index)
+                        for params, result in sweep_gps_error(fmm_model, stmatch_model, model, k, radius,
+                                                              wkts, truths, args, spec):
+                            yield dict(params, length=length, candidate_index=index is not None), result
+                    network.set_candidate_index(None)
+
+
+def sweep_gps_error(fmm_model, stmatch_model, model: str, k: int, radius: float, wkts: list,
+                    truths: list, args, spec: dict):
+    for gps_error in args.gps_error or spec["gps_error"]:
+        params = {"model": model, "k": k, "radius": radius, "gps_error": gps_error}
+        if model == "stmatch":
+            config = STMATCHConfig(k, radius, gps_error, args.vmax, args.factor)
+            match = lambda wkt: stmatch_model.match_wkt(wkt, config)
+            yield params, bench_match(match, wkts, truths, args.warmup)
+            continue
+        config = FastMapMatchConfig(k, radius, gps_error)
+        match = lambda wkt: fmm_model.match_wkt(wkt, config)
+        ## Each fallback delta starts with an empty cache, 0 is the UBODT alone.
+        for fallback in args.sp_fallback or [0]:
+            fmm_model.set_sp_fallback(fallback)
+            result = bench_match(match, wkts, truths, args.warmup)
+            if fallback > 0:
+                stats = fmm_model.get_sp_fallback_stats()
+                result["sp_fallback"] = {"hits": stats.hits, "misses": stats.misses, "size": stats.size}
+            yield dict(params, sp_fallback=fallback), result
+        fmm_model.set_sp_fallback(0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the matching engine on the bundled networks.")
+    parser.add_argument("--networks", nargs="*", default=["harbin", "chengdu", "example"],
+                        help=f"the networks to benchmark among {list(NETWORKS)}")
+    parser.add_argument("--network_file", help="benchmark this network file (shapefile or snapshot) as well")
+    parser.add_argument("--id", default="fid", help="the id field of --network_file")
+    parser.add_argument("--source", default="u", help="the source field of --network_file")
+    parser.add_argument("--target", default="v", help="the target field of --network_file")
+    parser.add_argument("--delta", type=float, default=0.03, help="the UBODT delta of --network_file")
+    parser.add_argument("--spacing", type=float, help="the distance between the points of the synthetic trips")
+    parser.add_argument("--noise", type=float, help="the standard deviation of the noise added to the points")
+    parser.add_argument("--trips", type=int, default=100, help="the number of trips of each length")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[20, 50, 200], help="the numbers of points")
+    parser.add_argument("--models", nargs="+", default=["fmm", "stmatch"], choices=["fmm", "stmatch"])
+    parser.add_argument("--k", type=int, nargs="+", help="the k swept, the default depends on the network")
+    parser.add_argument("--radius", type=float, nargs="+", help="the radius swept")
+    parser.add_argument("--gps_error", type=float, nargs="+", help="the gps_error swept")
+    parser.add_argument("--vmax", type=float, default=30, help="the vmax of stmatch")
+    parser.add_argument("--factor", type=float, default=1.5, help="the factor of stmatch")
+    parser.add_argument("--sp_fallback", type=float, nargs="*", default=[],
+                        help="the shortest path fallback deltas of fmm swept, 0 for the UBODT alone")
+    parser.add_argument("--candidate_index", action="store_true",
+                        help="match with a candidate index of each radius as well as with the rtree")
+    parser.add_argument("--warmup", type=int, default=3, help="the trips matched before timing")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the synthetic trips")
+    parser.add_argument("--workdir", default=None, help="where the UBODTs are generated, a temporary directory by default")
+    parser.add_argument("--reuse", action="store_true", help="reuse the UBODTs found in --workdir")
+    parser.add_argument("--output", default="bench_engine.jsonl", help="the JSON lines file appended to")
+    args = parser.parse_args()
+
+    networks = {name: NETWORKS[name] for name in args.networks}
+    if args.network_file:
+        name = os.path.splitext(os.path.basename(args.network_file))[0]
+        networks[name] = dict(NETWORKS["harbin"], file=args.network_file, id=args.id, source=args.source,
+                              target=args.target, delta=args.delta)
+    env = environment()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_engine_")
+    os.makedirs(workdir, exist_ok=True)
+    with open(args.output, "a") as out:
+        def write(record):
+            out.write(json.dumps(dict(record, env=env)) + "\n")
+            out.flush()
+        for name, spec in networks.items():
+            if not os.path.exists(spec["file"]):
+                print(f"Skip network {name} as {spec['file']} is not found.")
+                continue
+            spec = dict(spec, spacing=args.spacing or spec["spacing"], noise=args.noise or spec["noise"])
+            network, graph, ubodt, timings, sizes = load_network(spec, workdir, name, args.reuse)
+            write({"kind": "load", "network": name, "delta": spec["delta"], "seconds": timings, **sizes})
+            print(f"{name}: {sizes['nodes']} nodes, {sizes['edges']} edges, " +
+                  ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in timings.items()))
+            (trips, seconds) = timed(lambda: synthetic_trips(network, graph, args.trips, max(args.lengths),
+                                                             spec["spacing"], spec["noise"], args.seed))
+            print(f"{name}: {len(trips)} synthetic trips of {max(args.lengths)} points in {seconds:.1f}s")
+            trip_params = {"trips": args.trips, "spacing": spec["spacing"], "noise": spec["noise"], "seed": args.seed}
+            for params, result in sweep(network, graph, ubodt, trips, args, spec):
+                write({"kind": "match", "network": name, **params, **result, "synthetic": trip_params})
+                print(f"{name} {params['model']:7s} k={params['k']:<3d} r={params['radius']:<8g} "
+                      f"e={params['gps_error']:<8g} n={params['length']:<4d} "
+                      f"fb={params.get('sp_fallback', 0):<6g} ci={int(params['candidate_index'])} "
+                      f"{result['trips_per_second']:8.1f} trips/s p50 {result['latency_ms']['p50']:7.2f}ms "
+                      f"p99 {result['latency_ms']['p99']:7.2f}ms matched {result['match_rate']:.2f} "
+                      f"recall {result['recall']:.2f}")
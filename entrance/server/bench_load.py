@@ -0,0 +1,400 @@
+"""
+Load test a running matching server from the same machine, e.g.,
+
+    python bench_load.py --url http://127.0.0.1:1236 --endpoint match --city harbin \
+        --input ../../trips/input/trips.h5 --concurrency 1 2 4 8 16 --duration 30 --ready_file harbin.ready
+    python bench_load.py --tcp 127.0.0.1:1235 --rate 200 --duration 60 --pid 12345
+
+The trips are replayed from a trip file of `trips/input`, generated with `--synthetic`
+from the network of `--config` (see `bench_engine.py`), or the sample trip is repeated.
+The requests are sent over a pool of persistent connections by `--concurrency` asyncio
+workers, either as fast as possible or at the fixed `--rate`; with a rate the latency is
+measured from the time a request is due, so that a saturated server is not hidden by the
+requests waiting in the client. Each concurrency level is run for `--duration` seconds (or
+`--requests` requests) and reports the throughput, the latency percentiles, the error
+rate and, for the server given by `--pid` or `--ready_file` (the master and its workers),
+the CPU usage and the RSS of each process read from /proc. The reports are printed and
+appended to `--output` as JSON lines, which is what `num_workers` in `start.sh` is tuned
+with: the throughput stops growing with the concurrency once the workers saturate.
+"""
+import argparse, asyncio, itertools, json, os, socket, struct, time
+from collections import Counter
+from urllib.parse import urlsplit
+import numpy as np
+
+HEADER = struct.Struct("<I")
+## The sample trip of `flask_client.py`, used when no trips are given.
+SAMPLE_WKT = "LINESTRING(126.60311000000002 45.742172,126.60328 45.742348,126.60574 45.744152,126.60761 45.746216,126.60878999999998 45.74774,126.60878 45.74777,126.60883 45.747696000000005,126.60884 45.7477,126.60725 45.74565,126.60481 45.74328,126.60404 45.74251,126.60352 45.742764,126.60663 45.740715,126.61026 45.73876,126.61136 45.738293,126.614 45.736755,126.617516 45.73877,126.619125 45.739956,126.62125 45.739075,126.622284 45.73876,126.62337 45.738537,126.62215 45.736294,126.620705 45.73475,126.61933 45.733807,126.614494 45.73659,126.61197 45.738026,126.60894 45.73976,126.6061 45.741264,126.607025 45.74259,126.60714 45.742744,126.60595 45.7412,126.61218999999998 45.73778,126.6141 45.736694)"
+
+
+def load_trips(args) -> list:
+    """
+    The trips replayed, each of them a dict with the numpy arrays `lon`, `lat` and `tms`.
+    """
+    if args.input:
+        from trip_reader import trip_reader
+        read_trips, prepare = trip_reader(args.city)
+        return [prepare(trip) for _, trip in itertools.islice(read_trips(args.input), args.trips)]
+    if args.synthetic:
+        from fmm import Network, NetworkGraph
+        from bench_engine import synthetic_trips
+        with open(args.config, "r") as f:
+            network = json.load(f)["input"]["network"]
+        network = Network(network["file"], network["id"], network["source"], network["target"])
+        trips = synthetic_trips(network, NetworkGraph(network), args.synthetic, args.length,
+                                args.spacing, args.noise, args.seed)
+        return [{"lon": t["x"], "lat": t["y"], "tms": np.arange(args.length) * 15.0} for t in trips]
+    coords = np.array([p.split() for p in SAMPLE_WKT[len("LINESTRING("):-1].split(",")], dtype=np.float64)
+    return [{"lon": coords[:, 0], "lat": coords[:, 1], "tms": np.arange(len(coords)) * 15.0}]
+
+
+def trip_wkt(trip: dict) -> str:
+    return "LINESTRING(" + ",".join(f"{x} {y}" for x, y in zip(trip["lon"].tolist(), trip["lat"].tolist())) + ")"
+
+
+def make_payloads(trips: list, args) -> list:
+    """
+    The requests cycled through, `(path, body, content type, number of trips)` for HTTP
+    and `(request, 1)` for TCP.
+    """
+    query = f"?{args.query}" if args.query else ""
+    city = f"/{args.route_city}" if args.route_city else ""
+    if args.tcp:
+        if args.endpoint == "match_coords":
+            return [({"lon": t["lon"].tolist(), "lat": t["lat"].tolist(), "tms": t["tms"].tolist()}, 1) for t in trips]
+        return [({"gps_wkt": trip_wkt(t)}, 1) for t in trips]
+    if args.endpoint == "match":
+        return [(f"/match{city}{query}", json.dumps({"gps_wkt": trip_wkt(t)}).encode(), "application/json", 1)
+                for t in trips]
+    if args.endpoint == "match_coords":
+        sep = "&" if query else "?"
+        return [(f"/match_coords{city}{query}{sep}ts=1",
+                 np.concatenate([t["lon"], t["lat"], t["tms"]]).astype("<f8").tobytes(), "application/octet-stream", 1)
+                for t in trips]
+    batches = [trips[i:i + args.batch_size] for i in range(0, len(trips), args.batch_size)]
+    return [(f"/match_batch{city}{query}",
+             json.dumps({"trips": [{"id": i, "gps_wkt": trip_wkt(t)} for i, t in enumerate(batch)]}).encode(),
+             "application/json", len(batch)) for batch in batches]
+
+
+class HttpConnection(object):
+    """
+    A persistent HTTP/1.1 connection, which is reopened whenever the server closes it
+    (the sync gunicorn workers close it after each response).
+    """
+    def __init__(self, host: str, port: int) -> None:
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def request(self, path: str, body: bytes, content_type: str) -> tuple:
+        """
+        POST `body` to `path` and return the status and the body of the response.
+        """
+        reused = self.writer is not None
+        if not reused:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"POST {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                          f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        try:
+            return await self.read_response()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            ## A kept alive connection may have been closed by the server meanwhile.
+            if not reused:
+                raise
+            return await self.request(path, body, content_type)
+
+    async def read_response(self) -> tuple:
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunks.append(await self.reader.readexactly(size + 2))
+                if size == 0:
+                    break
+            body = b"".join(c[:-2] for c in chunks)
+        else:
+            body = await self.reader.read()
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, body
+
+
+class TcpConnection(object):
+    """
+    A connection to `server.py`, the requests are pipelined and their responses are
+    matched by the `id`.
+    """
+    def __init__(self, host: str, port: int) -> None:
+        self.host, self.port = host, port
+        self.pending = {}
+        self.ids = itertools.count()
+        self.writer = None
+
+    async def connect(self) -> None:
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.receiver = asyncio.create_task(self.receive(reader))
+
+    async def receive(self, reader) -> None:
+        try:
+            while True:
+                size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+                response = json.loads(await reader.readexactly(size))
+                future = self.pending.pop(response.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"The server closed the connection: {e}"))
+            self.pending.clear()
+
+    async def request(self, request: dict) -> dict:
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        data = json.dumps(dict(request, id=request_id)).encode()
+        self.writer.write(HEADER.pack(len(data)) + data)
+        return await future
+
+    async def close(self) -> None:
+        self.receiver.cancel()
+        self.writer.close()
+
+
+def server_pids(pid: int) -> list:
+    """
+    The process `pid` and its children, e.g., a gunicorn master and its workers.
+    """
+    pids = [pid]
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                pids += [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+    return pids
+
+
+def process_sample(pid: int):
+    """
+    The CPU seconds and the RSS in bytes of a process, None if it is gone.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return cpu, rss_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class ProcessMonitor(object):
+    """
+    Sample the CPU time and the RSS of the server processes every `interval` seconds.
+    """
+    def __init__(self, pid: int, interval: float = 1.0) -> None:
+        self.pid, self.interval = pid, interval
+        self.first, self.last, self.max_rss = {}, {}, Counter()
+
+    def sample(self) -> None:
+        now = time.perf_counter()
+        for pid in server_pids(self.pid):
+            sample = process_sample(pid)
+            if sample is None:
+                continue
+            self.first.setdefault(pid, (now, sample[0]))
+            self.last[pid] = (now, sample[0], sample[1])
+            self.max_rss[pid] = max(self.max_rss[pid], sample[1])
+
+    async def run(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def summary(self) -> dict:
+        self.sample()
+        summary = {}
+        for pid, (start, cpu0) in self.first.items():
+            end, cpu1, rss = self.last[pid]
+            summary[str(pid)] = {"role": "master" if pid == self.pid else "worker",
+                                 "cpu_percent": 100 * (cpu1 - cpu0) / max(end - start, 1e-9),
+                                 "rss_mb": rss / 2**20, "max_rss_mb": self.max_rss[pid] / 2**20}
+        return summary
+
+
+def check_response(status: int, body: bytes, json_format: bool) -> tuple:
+    """
+    Return the error of a HTTP response (None if it succeeded) and the number of trips
+    in it which are not matched (None if unknown).
+    """
+    if status != 200:
+        return f"http_{status}", None
+    if not json_format:
+        return None, None
+    response = json.loads(body)
+    results = response.get("results", [response])
+    return None, sum(r.get("state") == 0 for r in results)
+
+
+async def run_level(args, payloads: list, concurrency: int, pid) -> dict:
+    """
+    Run one concurrency level and summarize it.
+    """
+    json_format = "format=" not in (args.query or "") or "format=json" in args.query
+    latencies, errors, timeline = [], Counter(), Counter()
+    counts = Counter()
+    monitor = ProcessMonitor(pid, args.sample_interval) if pid else None
+    monitor_task = asyncio.create_task(monitor.run()) if monitor else None
+    if args.tcp:
+        host, port = args.tcp.rsplit(":", 1)
+        connections = [TcpConnection(host, int(port)) for _ in range(args.connections or concurrency)]
+        for c in connections:
+            await c.connect()
+    else:
+        url = urlsplit(args.url)
+        connections = [HttpConnection(url.hostname, url.port or 80) for _ in range(concurrency)]
+    queue = asyncio.Queue(maxsize=4 * concurrency)
+    start = time.perf_counter()
+    deadline = start + args.duration
+
+    async def produce():
+        ## The time each request is due, which the latency is measured from.
+        for i, payload in enumerate(itertools.cycle(payloads)):
+            if args.requests and i >= args.requests:
+                break
+            if args.rate > 0:
+                due = start + i / args.rate
+                if due >= deadline:
+                    break
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            else:
+                due = None
+                if time.perf_counter() >= deadline:
+                    break
+            await queue.put((due, payload))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work(w: int):
+        connection = connections[w % len(connections)]
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            due, payload = item
+            sent = time.perf_counter() if due is None else due
+            error, unmatched = None, None
+            try:
+                if args.tcp:
+                    response = await asyncio.wait_for(connection.request(payload[0]), args.timeout)
+                    error = "error" if "error" in response else None
+                    unmatched = int(response.get("state") == 0)
+                else:
+                    status, body = await asyncio.wait_for(connection.request(*payload[:3]), args.timeout)
+                    error, unmatched = check_response(status, body, json_format)
+            except Exception as e:
+                error = type(e).__name__
+                if not args.tcp:
+                    await connection.close()
+            done = time.perf_counter()
+            counts["requests"] += 1
+            timeline[int(done - start)] += 1
+            if error is not None:
+                errors[error] += 1
+                continue
+            latencies.append(done - sent)
+            counts["trips"] += payload[-1]
+            counts["unmatched"] += unmatched or 0
+
+    await asyncio.gather(produce(), *(work(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    for c in connections:
+        await c.close()
+    if monitor_task is not None:
+        monitor_task.cancel()
+    latencies = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+    return {"target": args.tcp or args.url, "endpoint": args.endpoint, "query": args.query,
+            "concurrency": concurrency, "rate": args.rate, "seconds": elapsed,
+            "requests": counts["requests"], "trips": counts["trips"],
+            "requests_per_second": counts["requests"] / elapsed, "trips_per_second": counts["trips"] / elapsed,
+            "errors": dict(errors), "error_rate": sum(errors.values()) / max(counts["requests"], 1),
+            "unmatched": counts["unmatched"] if json_format or args.tcp else None,
+            "latency_ms": {"mean": float(latencies.mean()), "p50": p50, "p95": p95, "p99": p99,
+                           "max": float(latencies.max())},
+            "timeline": [timeline[s] for s in range(int(elapsed) + 1)],
+            "processes": monitor.summary() if monitor else {},
+            "host": socket.gethostname(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a running matching server.")
+    parser.add_argument("--url", default="http://127.0.0.1:1236", help="the flask server")
+    parser.add_argument("--tcp", default=None, help="load the raw TCP server at host:port instead")
+    parser.add_argument("--endpoint", default="match", choices=["match", "match_coords", "match_batch"],
+                        help="the endpoint, with --tcp match sends the WKT and match_coords the coordinates")
+    parser.add_argument("--query", default="", help="the query string of the requests, e.g., format=packed&fields=cpath")
+    parser.add_argument("--route_city", default="", help="send the requests to /<endpoint>/<route_city>")
+    parser.add_argument("--batch_size", type=int, default=100, help="the number of trips of a /match_batch request")
+    parser.add_argument("--city", default="harbin", help="the city of --input, which selects the reader")
+    parser.add_argument("--input", default=None, help="replay the trips of this file of trips/input")
+    parser.add_argument("--trips", type=int, default=1000, help="the number of trips read from --input")
+    parser.add_argument("--synthetic", type=int, default=0, help="generate this many trips from the network of --config")
+    parser.add_argument("--config", default="fmm_config.json", help="the model configuration of --synthetic")
+    parser.add_argument("--length", type=int, default=50, help="the number of points of a synthetic trip")
+    parser.add_argument("--spacing", type=float, default=0.0015, help="the distance between the synthetic points")
+    parser.add_argument("--noise", type=float, default=0.0002, help="the noise of the synthetic points")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the synthetic trips")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8],
+                        help="the numbers of requests in flight, each of them is run in turn")
+    parser.add_argument("--connections", type=int, default=0,
+                        help="the number of TCP connections shared by the requests in flight (default one each)")
+    parser.add_argument("--rate", type=float, default=0, help="the requests per second, 0 for as fast as possible")
+    parser.add_argument("--duration", type=float, default=30, help="the seconds each concurrency level is run")
+    parser.add_argument("--requests", type=int, default=0, help="stop a level after this many requests")
+    parser.add_argument("--timeout", type=float, default=120, help="the timeout of a request in seconds")
+    parser.add_argument("--pid", type=int, default=0, help="the server (master) process to monitor")
+    parser.add_argument("--ready_file", default="", help="read the pid to monitor from the ready file of preload_server.py")
+    parser.add_argument("--sample_interval", type=float, default=1.0, help="the seconds between process samples")
+    parser.add_argument("--output", default="bench_load.jsonl", help="the JSON lines file appended to")
+    args = parser.parse_args()
+
+    pid = args.pid
+    if not pid and args.ready_file:
+        with open(args.ready_file, "r") as f:
+            pid = json.load(f)["pid"]
+    trips = load_trips(args)
+    payloads = make_payloads(trips, args)
+    print(f"{len(trips)} trips in {len(payloads)} requests")
+    with open(args.output, "a") as out:
+        for concurrency in args.concurrency:
+            report = asyncio.run(run_level(args, payloads, concurrency, pid))
+            out.write(json.dumps(report) + "\n")
+            out.flush()
+            workers = [p for p in report["processes"].values() if p["role"] == "worker"] or list(report["processes"].values())
+            usage = (f" workers cpu {sum(p['cpu_percent'] for p in workers):.0f}% "
+                     f"rss {max(p['max_rss_mb'] for p in workers):.0f}MB max") if workers else ""
+            print(f"concurrency {concurrency:3d}: {report['requests_per_second']:8.1f} req/s "
+                  f"{report['trips_per_second']:8.1f} trips/s p50 {report['latency_ms']['p50']:7.1f}ms "
+                  f"p95 {report['latency_ms']['p95']:7.1f}ms p99 {report['latency_ms']['p99']:7.1f}ms "
+                  f"errors {report['error_rate']:.2%}{usage}")
@@ -0,0 +1,132 @@
+import json, os, re, threading, time
+from collections import OrderedDict
+from artifacts import network_files
+
+
+def config_footprint(config_file: str) -> int:
+    """
+    The approximate memory in bytes taken by the model of `config_file`, i.e., the
+    size of its network and UBODT files. A region split into tiles takes at most the
+    memory budget of its tiles, or all of them without a budget.
+    """
+    with open(config_file, "r") as f:
+        params = json.load(f)
+    tiles = params["input"].get("tiles")
+    if tiles is not None:
+        budget = int(float(tiles.get("memory_budget", 0)) * 1024 * 1024)
+        if budget > 0:
+            return budget
+        with open(tiles["file"], "r") as f:
+            return sum(tile["bytes"] for tile in json.load(f)["tiles"].values())
+    files = network_files(params["input"]["network"]["file"])
+    if params["model"] == "fmm":
+        files.append(params["input"]["ubodt"]["file"])
+    return sum(os.path.getsize(f) for f in files if os.path.exists(f))
+
+
+class CityPool(object):
+    """
+    The map matchers of many cities in one process. The matcher of a city is loaded
+    from `{config_dir}/{city}.json` on its first request and the least recently used
+    cities are evicted once the footprints of the loaded cities exceed `memory_budget`
+    bytes (0 for no limit); the pinned cities are never evicted.
+    """
+    def __init__(self, config_dir: str, memory_budget: int = 0, pinned=(), loader=None) -> None:
+        if loader is None:
+            from flask_mapmatcher import MapMatcher
+            loader = MapMatcher
+        self.config_dir = config_dir
+        self.memory_budget = memory_budget
+        self.pinned = set(pinned)
+        self.loader = loader
+        ## city -> {"matcher", "footprint", "seconds"} in the LRU order
+        self.cities = OrderedDict()
+        self.lock = threading.Lock()
+        ## A city is loaded by one thread while the others requesting it wait.
+        self.load_locks = {}
+        self.counters = {"hits": 0, "loads": 0, "evictions": 0}
+
+    def config_file(self, city: str) -> str:
+        config_file = os.path.join(self.config_dir, f"{city}.json")
+        if re.fullmatch(r"[A-Za-z0-9_\-]+", city) is None or not os.path.exists(config_file):
+            raise KeyError(f"Unknown city {city}, its configuration {config_file} is not found.")
+        return config_file
+
+    def available(self) -> list:
+        return sorted(os.path.splitext(f)[0] for f in os.listdir(self.config_dir) if f.endswith(".json"))
+
+    def get(self, city: str):
+        """
+        Return the matcher of `city`, loading it if needed. Raise KeyError for an unknown
+        city and MemoryError if it does not fit in the budget.
+        """
+        with self.lock:
+            entry = self.cities.get(city)
+            if entry is not None:
+                self.cities.move_to_end(city)
+                self.counters["hits"] += 1
+                return entry["matcher"]
+            config_file = self.config_file(city)
+            load_lock = self.load_locks.setdefault(city, threading.Lock())
+        with load_lock:
+            with self.lock:
+                entry = self.cities.get(city)
+                if entry is not None:
+                    self.cities.move_to_end(city)
+                    self.counters["hits"] += 1
+                    return entry["matcher"]
+                footprint = config_footprint(config_file)
+                self.evict(footprint)
+            tic = time.perf_counter()
+            matcher = self.loader(config_file)
+            with self.lock:
+                self.cities[city] = {"matcher": matcher, "footprint": footprint,
+                                     "seconds": time.perf_counter() - tic}
+                self.counters["loads"] += 1
+                ## Other cities may have been loaded meanwhile.
+                self.evict(0)
+            return matcher
+
+    def used(self) -> int:
+        return sum(entry["footprint"] for entry in self.cities.values())
+
+    def evict(self, footprint: int) -> None:
+        """
+        Evict the least recently used unpinned cities to make room for `footprint` bytes,
+        the matchers still used by in-flight requests are freed when they finish.
+        """
+        if self.memory_budget <= 0:
+            return
+        pinned = sum(entry["footprint"] for city, entry in self.cities.items() if city in self.pinned)
+        if footprint > 0 and pinned + footprint > self.memory_budget:
+            raise MemoryError(f"A city of {footprint} bytes does not fit in the memory budget "
+                              f"{self.memory_budget} bytes with {pinned} bytes pinned.")
+        for city in list(self.cities):
+            if self.used() + footprint <= self.memory_budget:
+                break
+            if city not in self.pinned:
+                del self.cities[city]
+                self.counters["evictions"] += 1
+
+    def pin(self, city: str) -> None:
+        with self.lock:
+            self.pinned.add(city)
+
+    def unpin(self, city: str) -> None:
+        with self.lock:
+            self.pinned.discard(city)
+
+    def preload(self, cities) -> None:
+        for city in cities:
+            self.get(city)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"pid": os.getpid(),
+                    "loaded": {city: {"footprint": entry["footprint"], "seconds": entry["seconds"],
+                                      "pinned": city in self.pinned}
+                               for city, entry in self.cities.items()},
+                    "pinned": sorted(self.pinned),
+                    "used": self.used(),
+                    "memory_budget": self.memory_budget,
+                    **self.counters}
@@ -1,15 +1,38 @@
-import socket, json
+import socket, json, struct, sys
 
-HOST, PORT = "localhost", 1236
+HOST, PORT = "localhost", int(sys.argv[1]) if len(sys.argv) > 1 else 1235
+HEADER = struct.Struct("<I")
+
+def send_request(sock, request: dict) -> None:
+    data = json.dumps(request).encode("utf-8")
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+def recv_exactly(sock, n: int) -> bytes:
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError("The server closed the connection.")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+def recv_response(sock) -> dict:
+    size, = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return json.loads(recv_exactly(sock, size))
+
+gps_wkt = "LINESTRING(126.60311000000002 45.742172,126.60328 45.742348,126.60574 45.744152,126.60761 45.746216,126.60878999999998 45.74774,126.60878 45.74777,126.60883 45.747696000000005,126.60884 45.7477,126.60725 45.74565,126.60481 45.74328,126.60404 45.74251,126.60352 45.742764,126.60663 45.740715,126.61026 45.73876,126.61136 45.738293,126.614 45.736755,126.617516 45.73877,126.619125 45.739956,126.62125 45.739075,126.622284 45.73876,126.62337 45.738537,126.62215 45.736294,126.620705 45.73475,126.61933 45.733807,126.614494 45.73659,126.61197 45.738026,126.60894 45.73976,126.6061 45.741264,126.607025 45.74259,126.60714 45.742744,126.60595 45.7412,126.61218999999998 45.73778,126.6141 45.736694)"
 
 # Create a socket (SOCK_STREAM means a TCP socket)
 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-    # Connect to server and send data
     sock.connect((HOST, PORT))
-    sock.sendall(bytes("LINESTRING(126.60311000000002 45.742172,126.60328 45.742348,126.60574 45.744152,126.60761 45.746216,126.60878999999998 45.74774,126.60878 45.74777,126.60883 45.747696000000005,126.60884 45.7477,126.60725 45.74565,126.60481 45.74328,126.60404 45.74251,126.60352 45.742764,126.60663 45.740715,126.61026 45.73876,126.61136 45.738293,126.614 45.736755,126.617516 45.73877,126.619125 45.739956,126.62125 45.739075,126.622284 45.73876,126.62337 45.738537,126.62215 45.736294,126.620705 45.73475,126.61933 45.733807,126.614494 45.73659,126.61197 45.738026,126.60894 45.73976,126.6061 45.741264,126.607025 45.74259,126.60714 45.742744,126.60595 45.7412,126.61218999999998 45.73778,126.6141 45.736694)" + "\n", "utf-8"))
-
-    # Receive data from the server and shut down
-    received = sock.recv(10240).decode("utf-8")
-    parsed = json.loads(received)
+    # Pipeline several requests on the connection before reading any response,
+    # the responses may come back in any order and are matched by their ids
+    for i in range(4):
+        send_request(sock, {"id": i, "gps_wkt": gps_wkt, "fields": "cpath,spdist"})
+    responses = {}
+    while len(responses) < 4:
+        response = recv_response(sock)
+        responses[response["id"]] = response
 
-print(json.dumps(parsed, indent=2, sort_keys=True))
+print(json.dumps(responses[0], indent=2, sort_keys=True))
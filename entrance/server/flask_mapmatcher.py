@@ -1,6 +1,13 @@
 import json
+import os
+import struct
+import threading
+import time
+import numpy as np
 from fmm import (Network, NetworkGraph, FastMapMatch, FastMapMatchConfig, 
-                 UBODT, STMATCH, STMATCHConfig)
+                 FastMapMatchSession, UBODT, STMATCH, STMATCHConfig, SplitConfig, CandidateIndex)
+from artifacts import check_ubodt, is_valid, snapshot_options, valid_candidate_index
+from thinning import thin_trajectory, expand_columns
 
 # def get_mapmatcher(config_file: str):
 #     with open(config_file, "r") as f:
@@ -38,9 +45,13 @@ from fmm import (Network, NetworkGraph, FastMapMatch, FastMapMatchConfig,
 #     return lambda gps_wkt: model.match_wkt(gps_wkt, mm_config)
 
 class MapMatcher(object):
-    def __init__(self, config_file) -> None:
+    def __init__(self, config_file, parameters: dict = None) -> None:
         with open(config_file, "r") as f:
             params = json.load(f)
+        ## The `parameters` given replace those of the configuration, e.g., for the tiles
+        ## of a region, whose configurations written by `tile_gen.py` have none.
+        if parameters is not None:
+            params["parameters"] = parameters
         
         network_file = params["input"]["network"]["file"]
         network_id   = params["input"]["network"]["id"]
@@ -52,53 +63,512 @@ class MapMatcher(object):
         ## It also explains why using function closure as `get_mapmatcher()` does
         ## not work, becasue once `get_mapmatcher()` ends, `network` and `graph`
         ## are no longer valid and it throws segment fault.
-        self.network = Network(network_file, network_id, network_src, network_trg)
+        ## The seconds taken by each loading stage are kept in `self.load_timings`.
+        self.load_timings = {}
+        tic = time.perf_counter()
+        ## The snapshot written by `ubodt_gen.py` is loaded in place of the shapefile if it
+        ## is still valid, which saves the GDAL parsing.
+        snapshot_file = os.path.splitext(network_file)[0] + ".snap"
+        if is_valid(snapshot_file, network_file, snapshot_options(network_id, network_src, network_trg)):
+            self.network = Network(snapshot_file, network_id, network_src, network_trg)
+        else:
+            self.network = Network(network_file, network_id, network_src, network_trg)
+        self.load_timings["network"] = time.perf_counter() - tic
+        ## The candidate index written by `ubodt_gen.py --radius` replaces the rtree query of
+        ## both models for the radius up to its own, the candidates found are the same.
+        index_file = params["input"].get("candidate_index", {}).get(
+            "file", os.path.join(os.path.dirname(network_file), "candidates.idx"))
+        if valid_candidate_index(index_file, network_file, network_id, network_src, network_trg):
+            tic = time.perf_counter()
+            self.network.set_candidate_index(CandidateIndex.read(index_file, self.network))
+            self.load_timings["candidate_index"] = time.perf_counter() - tic
+            if self.network.get_candidate_index().get_radius() < params["parameters"]["r"]:
+                print(f"Warning: {index_file} is built for a radius smaller than {params['parameters']['r']}, "
+                      f"the candidates are searched in the rtree.")
+        tic = time.perf_counter()
         self.graph   = NetworkGraph(self.network)
+        self.load_timings["graph"] = time.perf_counter() - tic
         
         if params["model"] == "stmatch":
-            self.mm_config = STMATCHConfig()
-            self.mm_config.k = params["parameters"]["k"]
-            self.mm_config.radius = params["parameters"]["r"]
-            self.mm_config.gps_error = params["parameters"]["e"]
-            self.mm_config.factor = params["parameters"]["f"]
-            self.mm_config.vmax = params["parameters"]["vmax"]
+            self.mm_config = model_config("stmatch", params["parameters"])
             
             self.model = STMATCH(self.network, self.graph)
         elif params["model"] == "fmm":
-            self.mm_config = FastMapMatchConfig()
-            self.mm_config.k = params["parameters"]["k"]
-            self.mm_config.radius = params["parameters"]["r"]
-            self.mm_config.gps_error = params["parameters"]["e"]
+            self.mm_config = model_config("fmm", params["parameters"])
             
             ubodt_file = params["input"]["ubodt"]["file"]
+            ## Refuse a UBODT generated from another network, which gives wrong paths silently.
+            check_ubodt(ubodt_file, network_file, network_id, network_src, network_trg)
+            tic = time.perf_counter()
             ubodt = UBODT.read_ubodt_file(ubodt_file)
+            self.load_timings["ubodt"] = time.perf_counter() - tic
             self.model = FastMapMatch(self.network, self.graph, ubodt)
         else:
             raise Exception("Unkown model.")
+        
+        ## The identity of the model, results are reusable only among the same identity.
+        files = [network_file] + ([params["input"]["ubodt"]["file"]] if params["model"] == "fmm" else [])
+        identity = {"model": params["model"], "parameters": params["parameters"],
+                    "files": [file_identity(f) for f in files]}
+        if "tiers" in params:
+            identity["tiers"] = params["tiers"]
+        self.identity = json.dumps(identity, sort_keys=True)
+        ## Called with every match result if it is set, e.g., `MatchMetrics.observe_result`.
+        self.observer = None
+        ## Called with the tier, the outcome and the seconds of every tiered attempt if it is set,
+        ## e.g., `MatchMetrics.observe_tier`.
+        self.tier_observer = None
+        self.load_tiers(params)
+
+    def load_tiers(self, params: dict) -> None:
+        """
+        Set up the tiered matching configured by the optional `tiers` of the configuration
+            "tiers": {"configs": [{"k": 4, "r": 0.0015}, {"k": 8, "r": 0.003}],
+                      "max_error": 0.003, "max_spdist_ratio": 3.0,
+                      "stmatch": {"f": 1.5, "vmax": 0.0003}}
+        The cheap `configs`, each overriding some of the `parameters`, are tried first, then
+        the `parameters` and finally stmatch with the `parameters` overridden by `stmatch` if
+        it is given for the fmm model. A trajectory goes to the next tier only if it is not
+        matched, a point is farther than `max_error` (in map unit) from its matched point or
+        the shortest paths are longer than `max_spdist_ratio` times the straight lines between
+        the matched points (0 or missing disables a threshold).
+        """
+        ## [(name, model, config)] in the order they are tried, empty without tiers.
+        self.tiers = []
+        tiers = params.get("tiers")
+        if tiers is None:
+            return
+        for i, overrides in enumerate(tiers.get("configs", [])):
+            config = model_config(params["model"], dict(params["parameters"], **overrides))
+            self.tiers.append((f"tier{i}", self.model, config))
+        self.tiers.append(("base", self.model, self.mm_config))
+        if "stmatch" in tiers and params["model"] == "fmm":
+            self.stmatch = STMATCH(self.network, self.graph)
+            config = model_config("stmatch", dict(params["parameters"], **tiers["stmatch"]))
+            self.tiers.append(("stmatch", self.stmatch, config))
+        self.max_error = tiers.get("max_error", 0)
+        self.max_spdist_ratio = tiers.get("max_spdist_ratio", 0)
+        ## name -> the attempts, the trajectories accepted, the escalations by reason and the seconds
+        self.tier_counters = {name: {"attempts": 0, "accepted": 0, "failed": 0, "error": 0, "spdist": 0,
+                                     "seconds": 0.0}
+                              for name, _, _ in self.tiers}
+        self.tier_lock = threading.Lock()
+
+    def enable_stats(self, observer=None, tier_observer=None) -> None:
+        """
+        Collect the stage timings and counters of the matches in the `stats` of the results
+        and pass every result to `observer` and every tiered attempt to `tier_observer` if
+        they are given.
+        """
+        self.model.set_stats_enabled(True)
+        for _, model, _ in self.tiers:
+            model.set_stats_enabled(True)
+        self.observer = observer
+        self.tier_observer = tier_observer
+
+    def tier_stats(self) -> dict:
+        """
+        The counters of each tier of the tiered matching, None without tiers.
+        """
+        if not self.tiers:
+            return None
+        with self.tier_lock:
+            return {name: dict(self.tier_counters[name], model=type(model).__name__, k=config.k,
+                               radius=config.radius)
+                    for name, model, config in self.tiers}
+
+    def escalation(self, result) -> str:
+        """
+        The reason to match a result again by the next tier, None if it is accepted.
+        """
+        if len(result.cpath) == 0:
+            return "failed"
+        if self.max_error <= 0 and self.max_spdist_ratio <= 0:
+            return None
+        n = len(result.candidates)
+        values = np.fromiter((v for c in result.candidates for v in (c.error, c.spdist)),
+                             dtype=np.float64, count=2*n).reshape(n, 2)
+        if self.max_error > 0 and values[:, 0].max() > self.max_error:
+            return "error"
+        if self.max_spdist_ratio > 0:
+            coords = np.array(result.pgeom.export_coords(), dtype=np.float64)
+            straight = np.hypot(np.diff(coords[0::2]), np.diff(coords[1::2])).sum()
+            if straight > 0 and values[:, 1].sum() > self.max_spdist_ratio * straight:
+                return "spdist"
+        return None
+
+    def count_tier(self, name: str, outcome: str, seconds: float) -> None:
+        with self.tier_lock:
+            counters = self.tier_counters[name]
+            counters["attempts"] += 1
+            counters["seconds"] += seconds
+            counters[outcome] += 1
+        if self.tier_observer is not None:
+            self.tier_observer(name, outcome, seconds)
+
+    def tiered(self, match):
+        """
+        Match a trajectory by `match(model, config)` with the tiers in order until a result is
+        accepted. The last result matched is returned if none is accepted.
+        """
+        if not self.tiers:
+            return match(self.model, self.mm_config)
+        best = None
+        for name, model, config in self.tiers:
+            tic = time.perf_counter()
+            result = match(model, config)
+            outcome = self.escalation(result)
+            self.count_tier(name, outcome or "accepted", time.perf_counter() - tic)
+            if outcome is None:
+                return result
+            if best is None or len(result.cpath) > 0:
+                best = result
+        return best
+
+    def enable_sp_fallback(self, delta: float, capacity: int = 100000) -> None:
+        """
+        Search the OD pairs missing in the UBODT by Dijkstra bounded by `delta` (in map unit,
+        larger than the UBODT delta) instead of failing the match, the paths are kept in an
+        LRU cache of `capacity` pairs in this process. Only the fmm model has a UBODT.
+        """
+        if not isinstance(self.model, FastMapMatch):
+            raise ValueError("The shortest path fallback is only supported by the fmm model.")
+        self.model.set_sp_fallback(delta, capacity)
+        ## The results differ from those without the fallback.
+        self.identity += json.dumps({"sp_fallback": delta})
+
+    def sp_fallback_stats(self) -> dict:
+        """
+        The counters of the shortest path fallback cache, None without the fallback.
+        """
+        if not isinstance(self.model, FastMapMatch):
+            return None
+        stats = self.model.get_sp_fallback_stats()
+        if stats.capacity == 0:
+            return None
+        return {f: getattr(stats, f) for f in ("hits", "misses", "evictions", "size", "capacity", "delta")}
+
+    def tile_stats(self) -> dict:
+        """
+        The counters of the tiles of a region split by `tile_gen.py`, None without tiles.
+        """
+        return None
+
+    def observed(self, result):
+        if self.observer is not None:
+            self.observer(result)
+        return result
     
     def match_wkt(self, gps_wkt: str):
-        return self.model.match_wkt(gps_wkt, self.mm_config)
+        return self.observed(self.tiered(lambda model, config: model.match_wkt(gps_wkt, config)))
+    
+    def match_coords(self, lon, lat, ts=None):
+        """
+        Match a trajectory given by its coordinates directly, which saves the cost of
+        formatting and parsing the WKT. `lon`, `lat` and `ts` can be numpy arrays, 
+        lists or raw bytes of packed little-endian float64 values.
+        """
+        lon, lat = float64_buffer(lon), float64_buffer(lat)
+        ts = b"" if ts is None else float64_buffer(ts)
+        return self.observed(self.tiered(lambda model, config: model.match_coords(lon, lat, ts, config)))
 
+    def match_batch(self, gps_wkts, n_threads: int = 0):
+        """
+        Match a list of WKT trajectories with `n_threads` native threads (all cores if
+        it is 0), the GIL is released meanwhile. The results are in the same order as
+        `gps_wkts` and a trajectory that can not be matched gets an empty result, whose
+        `error` tells why if the WKT is invalid. With tiers,
+        the trajectories not accepted by a tier are matched again in a batch of the next one.
+        """
+        gps_wkts = list(gps_wkts)
+        if not self.tiers:
+            results = self.model.match_batch(gps_wkts, self.mm_config, n_threads)
+        else:
+            results = [None] * len(gps_wkts)
+            pending = list(range(len(gps_wkts)))
+            for name, model, config in self.tiers:
+                if not pending:
+                    break
+                tic = time.perf_counter()
+                matched = model.match_batch([gps_wkts[i] for i in pending], config, n_threads)
+                ## The seconds of the batch are shared by its trajectories.
+                seconds = (time.perf_counter() - tic) / len(pending)
+                escalated = []
+                for i, result in zip(pending, matched):
+                    outcome = self.escalation(result)
+                    self.count_tier(name, outcome or "accepted", seconds)
+                    if results[i] is None or len(result.cpath) > 0:
+                        results[i] = result
+                    if outcome is not None:
+                        escalated.append(i)
+                pending = escalated
+        for result in results:
+            self.observed(result)
+        return results
 
-def parse_match(result) -> dict:
-    mgeom_wkt = result.mgeom.export_wkt() if result.mgeom.get_num_points() > 0 else ""
-    pgeom_wkt = result.pgeom.export_wkt() if result.pgeom.get_num_points() > 0 else ""
-    
-    length = [c.length for c in result.candidates]
-    offset = [c.offset for c in result.candidates]
-    spdist = [c.spdist for c in result.candidates]
-
-    response = {"mgeom_wkt": mgeom_wkt, 
-                "pgeom_wkt": pgeom_wkt, 
-                "opath": list(result.opath), # matched edge for each point
-                "cpath": list(result.cpath), # matched path (has completed edges)
-                "indices": list(result.indices),
-                "offset": offset, 
-                "length": length,
-                "spdist": spdist, 
-                "state": 1} if mgeom_wkt != "" else {"state": 0}
+    def match_split(self, lon, lat, ts=None, max_gap: float = 0, max_gap_time: float = 0,
+                    max_points: int = 0, n_threads: int = 0):
+        """
+        Match a long or gappy trajectory piecewise, it is split before the distance gaps
+        longer than `max_gap` (in map unit, e.g., the UBODT delta), the time gaps longer than
+        `max_gap_time` seconds and into pieces of at most `max_points` points (0 disables a
+        rule). The pieces are matched by `n_threads` native threads and stitched into one
+        result, whose `segments` give the points and `cpath` edges of each piece.
+        """
+        lon, lat = float64_buffer(lon), float64_buffer(lat)
+        ts = b"" if ts is None else float64_buffer(ts)
+        split_config = SplitConfig(max_gap, max_gap_time, max_points)
+        return self.observed(self.tiered(lambda model, config: model.match_split(
+            lon, lat, ts, config, split_config, n_threads)))
+
+    def match_thinned(self, lon, lat, ts=None, min_dist: float = 0, min_interval: float = 0,
+                      tolerance: float = 0, split=None, n_threads: int = 0) -> dict:
+        """
+        Match only the points kept by `thin_trajectory()`, i.e., dropping the points within
+        `min_dist` (in map unit) or `min_interval` seconds of the last kept point and those
+        within the Douglas-Peucker `tolerance` (0 disables a rule), and return the columns
+        of `ALL_FIELDS` mapped back to every input point by `expand_columns()`, whose `kept`
+        holds the indices of the matched points. The kept points are matched piecewise by
+        `match_split()` with the `split` options if they are given.
+        """
+        lon, lat = float64_array(lon), float64_array(lat)
+        ts = None if ts is None else float64_array(ts)
+        kept = thin_trajectory(lon, lat, ts, min_dist, min_interval, tolerance)
+        sub = lambda xs: None if xs is None else np.ascontiguousarray(xs[kept])
+        if split is None:
+            result = self.match_coords(sub(lon), sub(lat), sub(ts))
+        else:
+            result = self.match_split(sub(lon), sub(lat), sub(ts), n_threads=n_threads, **split)
+        return expand_columns(match_columns(result, ALL_FIELDS), lon, lat, kept)
+
+    def open_session(self, max_window: int = 32):
+        """
+        Open an online matching session, whose points are appended one by one and whose
+        transition graph is kept for the latest `max_window` points only. The session
+        refers to this matcher, which should be kept alive until the session is closed.
+        """
+        if not isinstance(self.model, FastMapMatch):
+            raise ValueError("Online matching sessions are only supported by the fmm model.")
+        return FastMapMatchSession(self.model, self.mm_config, max_window)
+
+
+def model_config(model: str, parameters: dict):
+    """
+    The configuration of `model` ("fmm" or "stmatch") from the `parameters` of a configuration file.
+    """
+    if model == "stmatch":
+        config = STMATCHConfig()
+        config.factor = parameters["f"]
+        config.vmax = parameters["vmax"]
+    elif model == "fmm":
+        config = FastMapMatchConfig()
+    else:
+        raise Exception("Unkown model.")
+    config.k = parameters["k"]
+    config.radius = parameters["r"]
+    config.gps_error = parameters["e"]
+    return config
+
+
+def file_identity(filename: str) -> str:
+    """
+    Identify a file by its path, size and modification time.
+    """
+    st = os.stat(filename)
+    return f"{os.path.abspath(filename)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def float64_buffer(xs):
+    """
+    Return `xs` as an object exposing a contiguous float64 buffer to the fmm binding.
+    """
+    if isinstance(xs, (bytes, bytearray, memoryview)):
+        return xs
+    return np.ascontiguousarray(xs, dtype=np.float64)
+
+
+def float64_array(xs) -> np.ndarray:
+    """
+    Return `xs` as a float64 numpy array, raw bytes are read as packed little-endian values.
+    """
+    if isinstance(xs, (bytes, bytearray, memoryview)):
+        return np.frombuffer(xs, dtype="<f8")
+    return np.asarray(xs, dtype=np.float64)
+
+
+## All the fields that can be requested with `fields=`, `ratio` is the matched
+## offset divided by the edge length and clamped into [0, 1].
+ALL_FIELDS = ("opath", "cpath", "indices", "offset", "length", "spdist", "ratio", "mgeom", "pgeom")
+DEFAULT_FIELDS = ("opath", "cpath", "indices", "offset", "length", "spdist", "mgeom", "pgeom")
+INT_FIELDS = ("opath", "cpath", "indices")
+## The values of each segment of a trajectory matched piecewise by `match_split()`, which
+## are packed as a flat int64 array `segments` of 6 values per segment.
+SEGMENT_FIELDS = ("start", "end", "cpath_start", "cpath_end", "state", "connected")
+## The fields kept in the columns whatever is requested, `kept` holds the indices of the
+## points matched by `MapMatcher.match_thinned()`.
+EXTRA_FIELDS = ("state", "segments", "kept")
+
+
+def parse_fields(fields) -> tuple:
+    """
+    Parse the `fields=` request parameter, which is either a comma separated string
+    such as "cpath,ratio" or a list of field names; `None` gives `DEFAULT_FIELDS`.
+    """
+    if fields is None or fields == "":
+        return DEFAULT_FIELDS
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    fields = tuple(f.strip() for f in fields)
+    unknown = [f for f in fields if f not in ALL_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields {unknown}, the valid fields are {list(ALL_FIELDS)}.")
+    return fields
+
+
+def match_columns(result, fields=DEFAULT_FIELDS) -> dict:
+    """
+    Extract the requested fields of a match result as numpy arrays, `opath`, `cpath`
+    and `indices` are int64, the others are float64 and the geometries `mgeom` and
+    `pgeom` are flat coordinate arrays x0,y0,x1,y1,... The returned dict also holds
+    `state`, which is 0 if the trajectory can not be matched.
+    """
+    if result.mgeom.get_num_points() == 0:
+        return {"state": 0}
+    columns = {"state": 1}
+    for f in INT_FIELDS:
+        if f in fields:
+            columns[f] = np.array(getattr(result, f), dtype=np.int64)
+    if any(f in fields for f in ("offset", "length", "spdist", "ratio")):
+        n = len(result.candidates)
+        values = np.fromiter((v for c in result.candidates for v in (c.offset, c.length, c.spdist)),
+                             dtype=np.float64, count=3*n).reshape(n, 3)
+        offset, length, spdist = values[:, 0], values[:, 1], values[:, 2]
+        for f, v in (("offset", offset), ("length", length), ("spdist", spdist)):
+            if f in fields:
+                columns[f] = np.ascontiguousarray(v)
+        if "ratio" in fields:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = np.where(length > 0, offset / length, 0.0)
+            columns["ratio"] = np.clip(ratio, 0.0, 1.0)
+    for f in ("mgeom", "pgeom"):
+        if f in fields:
+            columns[f] = np.array(getattr(result, f).export_coords(), dtype=np.float64)
+    if len(result.segments) > 0:
+        columns["segments"] = np.array([getattr(s, f) for s in result.segments for f in SEGMENT_FIELDS],
+                                       dtype=np.int64)
+    return columns
+
+
+def segments_json(segments) -> list:
+    """
+    The segments as a list of objects keyed by `SEGMENT_FIELDS`.
+    """
+    return [dict(zip(SEGMENT_FIELDS, row)) for row in np.reshape(segments, (-1, len(SEGMENT_FIELDS))).tolist()]
+
+
+def parse_match(result, fields=DEFAULT_FIELDS) -> dict:
+    """
+    The JSON response of a match result, the geometries are returned as WKT text
+    under the keys `mgeom_wkt` and `pgeom_wkt`.
+    """
+    if result.mgeom.get_num_points() == 0:
+        return {"state": 0}
+    response = {}
+    columns = match_columns(result, tuple(f for f in fields if f not in ("mgeom", "pgeom")))
+    for f in fields:
+        if f in ("mgeom", "pgeom"):
+            geom = getattr(result, f)
+            response[f + "_wkt"] = geom.export_wkt() if geom.get_num_points() > 0 else ""
+        else:
+            response[f] = columns[f].tolist()
+    if "segments" in columns:
+        response["segments"] = segments_json(columns["segments"])
+    response["state"] = 1
     return response
 
+
+def coords_wkt(coords) -> str:
+    """
+    Format flat coordinates x0,y0,x1,y1,... as a WKT linestring like `export_wkt()`.
+    """
+    if len(coords) == 0:
+        return ""
+    points = ",".join(f"{x:.8g} {y:.8g}" for x, y in zip(coords[0::2], coords[1::2]))
+    return f"LINESTRING({points})"
+
+
+def select_columns(columns: dict, fields=DEFAULT_FIELDS) -> dict:
+    """
+    Keep only the requested fields (and `EXTRA_FIELDS`) of the columns returned by
+    `match_columns()`.
+    """
+    return {k: v for k, v in columns.items() if k in EXTRA_FIELDS or k in fields}
+
+
+def columns_json(columns: dict, fields=DEFAULT_FIELDS) -> dict:
+    """
+    The JSON response built from the columns, which is the same as `parse_match()`.
+    """
+    if columns["state"] == 0:
+        return {"state": 0}
+    response = {}
+    for f in fields:
+        if f in ("mgeom", "pgeom"):
+            response[f + "_wkt"] = coords_wkt(columns[f])
+        else:
+            response[f] = columns[f].tolist()
+    if "segments" in columns:
+        response["segments"] = segments_json(columns["segments"])
+    if "kept" in columns:
+        response["kept"] = columns["kept"].tolist()
+    response["state"] = 1
+    return response
+
+
+def pack_columns(columns: dict) -> bytes:
+    """
+    Pack the columns returned by `match_columns()` into a binary record with the layout
+        uint32 nfields
+        nfields x (uint8 namelen, name, dtype 'q' or 'd', uint32 count, count x int64/float64)
+    where all the numbers are little-endian and `state` is packed as an int64 array
+    of length 1.
+    """
+    parts = [struct.pack("<I", len(columns))]
+    for name, value in columns.items():
+        value = np.atleast_1d(np.asarray(value))
+        dtype = "q" if value.dtype.kind in "iub" else "d"
+        value = value.astype("<i8" if dtype == "q" else "<f8", copy=False)
+        name = name.encode()
+        parts.append(struct.pack("<B", len(name)) + name + struct.pack("<cI", dtype.encode(), value.size))
+        parts.append(value.tobytes())
+    return b"".join(parts)
+
+
+def unpack_columns(data, offset=0):
+    """
+    The inverse of `pack_columns()`, returns the columns and the offset of the next byte.
+    """
+    (nfields,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    columns = {}
+    for _ in range(nfields):
+        (namelen,) = struct.unpack_from("<B", data, offset)
+        name = bytes(data[offset+1:offset+1+namelen]).decode()
+        offset += 1 + namelen
+        dtype, count = struct.unpack_from("<cI", data, offset)
+        offset += 5
+        value = np.frombuffer(data, dtype="<i8" if dtype == b"q" else "<f8", count=count, offset=offset)
+        offset += 8 * count
+        columns[name] = int(value[0]) if name == "state" else value
+    return columns, offset
+
+
+def msgpack_columns(columns: dict) -> dict:
+    """
+    Convert the columns into plain lists that msgpack can serialize.
+    """
+    return {k: (v.tolist() if isinstance(v, np.ndarray) else v) for k, v in columns.items()}
+
 if __name__ == "__main__":
     #match_wkt = get_mapmatcher("fmm_config.json")
     gps_wkt = "LINESTRING(126.60311000000002 45.742172,126.60328 45.742348,126.60574 45.744152,126.60761 45.746216,126.60878999999998 45.74774,126.60878 45.74777,126.60883 45.747696000000005,126.60884 45.7477,126.60725 45.74565,126.60481 45.74328,126.60404 45.74251,126.60352 45.742764,126.60663 45.740715,126.61026 45.73876,126.61136 45.738293,126.614 45.736755,126.617516 45.73877,126.619125 45.739956,126.62125 45.739075,126.622284 45.73876,126.62337 45.738537,126.62215 45.736294,126.620705 45.73475,126.61933 45.733807,126.614494 45.73659,126.61197 45.738026,126.60894 45.73976,126.6061 45.741264,126.607025 45.74259,126.60714 45.742744,126.60595 45.7412,126.61218999999998 45.73778,126.6141 45.736694)"
@@ -1,16 +1,528 @@
-from flask import Flask, request, jsonify
-from flask_mapmatcher import MapMatcher, parse_match
+import json
+import os
+import struct
+import time
+import numpy as np
+from flask import Flask, Response, request, jsonify, abort, make_response, g
+from flask_mapmatcher import (MapMatcher, parse_match, parse_fields, match_columns, select_columns,
+                              columns_json, pack_columns, unpack_columns, msgpack_columns, ALL_FIELDS)
+from match_cache import MatchCache, trajectory_key, wkt_coords
+from gcjwgs import gcj2wgsExact
+from city_pool import CityPool
+from fmm import FastMapMatch
+from match_session import SessionStore
+from match_metrics import MatchMetrics
+from tiled_mapmatcher import TiledMapMatcher, is_tiled
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
-app = Flask(__name__)        
+app = Flask(__name__)
+## The maximum number of trajectories accepted by a single `/match_batch` request,
+## it can be changed by setting the environment variable `MM_MAX_BATCH_SIZE`.
+app.config["MAX_BATCH_SIZE"] = int(os.environ.get("MM_MAX_BATCH_SIZE", 1000))
+## The number of worker processes serving the app, set by `preload_server.py` from `-w`.
+app.config["WORKERS"] = int(os.environ.get("MM_WORKERS", 1))
+## The number of native threads used by `/match_batch` in each worker, 0 means all the cores;
+## with several workers the cores are divided among them, so that concurrent batches do not
+## oversubscribe the machine. It can be changed by setting the environment variable `MM_NUM_THREADS`.
+app.config["NUM_THREADS"] = int(os.environ.get("MM_NUM_THREADS",
+                                               0 if app.config["WORKERS"] <= 1 else
+                                               max(1, (os.cpu_count() or 1) // app.config["WORKERS"])))
 
-mapmatcher = MapMatcher("fmm_config.json")
+## The coordinate system of the incoming trajectories, `wgs84` or `gcj02` (e.g., the
+## chengdu and xian trips), the GCJ-02 trajectories are converted to WGS-84 before matching.
+## The default is set by the environment variable `MM_INPUT_CRS` and a request can
+## override it with the query parameter `crs=` or the `crs` key of a JSON body.
+app.config["INPUT_CRS"] = os.environ.get("MM_INPUT_CRS", "wgs84")
+
+## Long or gappy trajectories are split and matched piecewise by `/match` and `/match_coords`
+## if any of `MM_SPLIT_MAX_GAP` (in map unit, e.g., the UBODT delta), `MM_SPLIT_MAX_GAP_TIME`
+## (seconds) and `MM_SPLIT_MAX_POINTS` is set, the response then holds the `segments`. A request
+## can turn it off with the query parameter `split=0` or the `split` key of a JSON body.
+app.config["SPLIT"] = {"max_gap": float(os.environ.get("MM_SPLIT_MAX_GAP", 0)),
+                       "max_gap_time": float(os.environ.get("MM_SPLIT_MAX_GAP_TIME", 0)),
+                       "max_points": int(os.environ.get("MM_SPLIT_MAX_POINTS", 0))}
+
+## Dense trajectories are thinned before matching by `/match` and `/match_coords` if any of
+## `MM_THIN_MIN_DIST` (drop the points within it of the last kept point, in map unit),
+## `MM_THIN_MIN_INTERVAL` (seconds, with timestamps only) and `MM_THIN_TOLERANCE` (the
+## Douglas-Peucker tolerance, in map unit) is set. The per point fields still have one entry
+## per input point and the response holds the indices of the matched points as `kept`. A
+## request can turn it off with the query parameter `thin=0` or the `thin` key of a JSON body.
+app.config["THIN"] = {"min_dist": float(os.environ.get("MM_THIN_MIN_DIST", 0)),
+                      "min_interval": float(os.environ.get("MM_THIN_MIN_INTERVAL", 0)),
+                      "tolerance": float(os.environ.get("MM_THIN_TOLERANCE", 0))}
+
+## Many cities are served by one server if `MM_CONFIG_DIR` is set to a directory of
+## `{city}.json` configurations (written by `fmm_config_gen.py`); a city is loaded on its
+## first request to `/match/<city>` (or with the `city` key/parameter) and the least
+## recently used cities are evicted beyond `MM_MEMORY_BUDGET` MB (0 for no limit). The
+## cities in `MM_PIN_CITIES` (comma separated) are preloaded and never evicted.
+config_dir = os.environ.get("MM_CONFIG_DIR")
+
+## The stage timings and counters of the matches and the seconds taken by the requests are
+## collected unless `MM_METRICS=0` and exposed by `/metrics`. The workers write their metrics
+## to the directory `MM_METRICS_DIR` (created by `preload_server.py`) if it is set, so that
+## `/metrics` reports every worker, otherwise only the one answering it.
+metrics = None
+if os.environ.get("MM_METRICS", "1") != "0":
+    metrics = MatchMetrics(os.environ.get("MM_METRICS_DIR"))
+
+## With `MM_SP_FALLBACK_DELTA` (in map unit, larger than the UBODT delta) the OD pairs missing in
+## the UBODT of an fmm model are searched on the graph within it rather than failing the match, so a
+## much smaller UBODT can be shipped. The paths are cached in each worker for `MM_SP_CACHE_SIZE` pairs.
+sp_fallback = (float(os.environ.get("MM_SP_FALLBACK_DELTA", 0)), int(os.environ.get("MM_SP_CACHE_SIZE", 100000)))
+
+## A configuration with `"tiles"` in its input is a region split into tiles by `tile_gen.py`, whose
+## tiles are loaded as the trajectories touch them and evicted beyond `MM_TILE_MEMORY_BUDGET` MB if it
+## is set, otherwise beyond the `memory_budget` of the configuration.
+tile_budget = os.environ.get("MM_TILE_MEMORY_BUDGET")
+
+def load_mapmatcher(config_file: str) -> MapMatcher:
+    if is_tiled(config_file):
+        matcher = TiledMapMatcher(config_file, None if tile_budget is None else
+                                  int(float(tile_budget) * 1024 * 1024))
+    else:
+        matcher = MapMatcher(config_file)
+    if metrics is not None:
+        matcher.enable_stats(metrics.observe_result, metrics.observe_tier)
+    if sp_fallback[0] > 0 and isinstance(matcher.model, FastMapMatch):
+        matcher.enable_sp_fallback(*sp_fallback)
+    return matcher
+
+pool = None
+if config_dir:
+    pin_cities = [c for c in os.environ.get("MM_PIN_CITIES", "").split(",") if c]
+    pool = CityPool(config_dir, int(float(os.environ.get("MM_MEMORY_BUDGET", 0)) * 1024 * 1024), pin_cities,
+                    loader=load_mapmatcher)
+    pool.preload(pin_cities)
+
+## The model configuration file, it can be changed by setting the environment variable `MM_CONFIG`,
+## with `MM_CONFIG_DIR` the default city is only loaded if `MM_CONFIG` is given.
+mapmatcher = None
+if pool is None or "MM_CONFIG" in os.environ:
+    mapmatcher = load_mapmatcher(os.environ.get("MM_CONFIG", "fmm_config.json"))
+
+## The result cache holds `MM_CACHE_SIZE` results in memory in each worker and, if
+## `MM_CACHE_FILE` is set, all the results in a SQLite file shared by the workers;
+## it is disabled with `MM_CACHE_SIZE=0` and no `MM_CACHE_FILE`.
+cache_size = int(os.environ.get("MM_CACHE_SIZE", 10000))
+cache_file = os.environ.get("MM_CACHE_FILE")
+cache = MatchCache(cache_size, cache_file) if cache_size > 0 or cache_file else None
+
+## The online matching sessions of `/session`, a session is kept in the memory of the worker
+## that opened it, so they are only served by a single worker with threads, e.g.,
+## `preload_server.py -w 1 --threads 8`; with more workers the next points of a session would
+## reach a worker that does not hold it, so `/session` is rejected. A session idle for
+## `MM_SESSION_TIMEOUT` seconds is closed and at most `MM_MAX_SESSIONS` sessions are open.
+sessions = SessionStore(float(os.environ.get("MM_SESSION_TIMEOUT", 300)),
+                        int(os.environ.get("MM_MAX_SESSIONS", 10000)))
+
+## The response formats, chosen by the query parameter `format=` or the Accept header.
+FORMATS = {"application/json": "json",
+           "application/msgpack": "msgpack",
+           "application/x-msgpack": "msgpack",
+           "application/octet-stream": "packed"}
+
+def response_options():
+    """
+    Return the response format and the requested fields, the fields are given by
+    the query parameter `fields=cpath,ratio` or the `fields` key of a JSON body.
+    """
+    fmt = request.args.get("format")
+    if fmt is None:
+        fmt = FORMATS[request.accept_mimetypes.best_match(FORMATS.keys(), default="application/json")]
+    if fmt not in FORMATS.values():
+        abort(make_response(jsonify({"error": f"Unknown format {fmt}, the valid formats are json, msgpack and packed."}), 400))
+    if fmt == "msgpack" and msgpack is None:
+        abort(make_response(jsonify({"error": "The format msgpack requires the package `msgpack` on the server."}), 406))
+    body = request.get_json(silent=True) if request.is_json else None
+    fields = request.args.get("fields", body.get("fields") if isinstance(body, dict) else None)
+    try:
+        return fmt, parse_fields(fields)
+    except ValueError as e:
+        abort(make_response(jsonify({"error": str(e)}), 400))
+
+def input_crs():
+    body = request.get_json(silent=True) if request.is_json else None
+    crs = request.args.get("crs", body.get("crs") if isinstance(body, dict) else None) or app.config["INPUT_CRS"]
+    if crs not in ("wgs84", "gcj02"):
+        abort(make_response(jsonify({"error": f"Unknown crs {crs}, the valid ones are wgs84 and gcj02."}), 400))
+    return crs
+
+def split_options():
+    """
+    The options of `MapMatcher.match_split()` for this request, None if it is not split.
+    """
+    body = request.get_json(silent=True) if request.is_json else None
+    split = request.args.get("split", body.get("split") if isinstance(body, dict) else None)
+    if split in ("0", 0, False) or not any(app.config["SPLIT"].values()):
+        return None
+    return app.config["SPLIT"]
+
+def thin_options():
+    """
+    The options of `MapMatcher.match_thinned()` for this request, None if it is not thinned.
+    """
+    body = request.get_json(silent=True) if request.is_json else None
+    thin = request.args.get("thin", body.get("thin") if isinstance(body, dict) else None)
+    if thin in ("0", 0, False) or not any(app.config["THIN"].values()):
+        return None
+    return app.config["THIN"]
+
+def request_mapmatcher(city=None):
+    """
+    The matcher of the city given by the route `/<city>`, the query parameter `city=`
+    or the `city` key of a JSON body, and the default matcher without a city.
+    """
+    if city is None:
+        body = request.get_json(silent=True) if request.is_json else None
+        city = request.args.get("city", body.get("city") if isinstance(body, dict) else None)
+    if city is None:
+        if mapmatcher is None:
+            abort(make_response(jsonify({"error": "The city should be given by /<city> or `city`."}), 400))
+        return mapmatcher
+    if pool is None:
+        abort(make_response(jsonify({"error": "The server does not serve multiple cities."}), 404))
+    try:
+        return pool.get(city)
+    except KeyError as e:
+        abort(make_response(jsonify({"error": e.args[0]}), 404))
+    except MemoryError as e:
+        abort(make_response(jsonify({"error": str(e)}), 503))
+
+def gcj2wgs_coords(lon, lat):
+    lat, lon = gcj2wgsExact(lat, lon)
+    return lon, lat
+
+def gcj2wgs_wkt(gps_wkt):
+    """
+    Convert a GCJ-02 WKT linestring to WGS-84, raise ValueError if it is malformed.
+    """
+    lon, lat = gcj2wgs_coords(*wkt_coords(gps_wkt))
+    return "LINESTRING(" + ",".join(f"{x} {y}" for x, y in zip(lon.tolist(), lat.tolist())) + ")"
+
+def split_identity(identity, split, thin=None):
+    """
+    The identity of the results matched with the split and thin options, which are cached apart.
+    """
+    if split is not None:
+        identity += json.dumps(split, sort_keys=True)
+    if thin is not None:
+        identity += json.dumps({"thin": thin}, sort_keys=True)
+    return identity
+
+def serialized(format_response):
+    """
+    Record the seconds taken by `format_response()` as the stage `serialize`.
+    """
+    def timed(*args):
+        tic = time.perf_counter()
+        response = format_response(*args)
+        if metrics is not None:
+            metrics.observe("mm_stage_seconds", time.perf_counter() - tic, stage="serialize")
+        return response
+    return timed
+
+@serialized
+def match_response(result, fmt, fields):
+    if fmt == "json":
+        return jsonify(parse_match(result, fields))
+    columns = match_columns(result, fields)
+    if fmt == "msgpack":
+        return Response(msgpack.packb(msgpack_columns(columns)), mimetype="application/msgpack")
+    return Response(pack_columns(columns), mimetype="application/octet-stream")
+
+@serialized
+def columns_response(columns, fmt, fields):
+    if fmt == "json":
+        return jsonify(columns_json(columns, fields))
+    columns = select_columns(columns, fields)
+    if fmt == "msgpack":
+        return Response(msgpack.packb(msgpack_columns(columns)), mimetype="application/msgpack")
+    return Response(pack_columns(columns), mimetype="application/octet-stream")
+
+def cached_match(key, match):
+    """
+    Return the columns of all the fields for the trajectory `key`, `match()` is called
+    to match the trajectory only if it is not found in the cache, it returns either a
+    match result or the columns of all the fields.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return unpack_columns(value)[0]
+    columns = match()
+    if not isinstance(columns, dict):
+        columns = match_columns(columns, ALL_FIELDS)
+    cache.put(key, pack_columns(columns))
+    return columns
+
+
+@app.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """
+    Record the seconds taken by the request by its endpoint and status code.
+    """
+    if metrics is not None and "start_time" in g:
+        metrics.observe("mm_request_seconds", time.perf_counter() - g.start_time,
+                        endpoint=request.endpoint or "none", status=response.status_code)
+        metrics.flush()
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_text():
+    """
+    The metrics of all the workers in the Prometheus text format, see `match_metrics.py`.
+    """
+    if metrics is None:
+        return jsonify({"error": "The metrics are disabled by MM_METRICS=0."}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Report that the worker is serving together with the seconds taken to load the model.
+    """
+    load_timings = mapmatcher.load_timings if mapmatcher is not None else {}
+    return jsonify({"status": "ok", "pid": os.getpid(), "load_timings": load_timings,
+                    "cities": list(pool.stats()["loaded"]) if pool is not None else []})
+
+@app.route('/cities', methods=['GET'])
+def cities():
+    """
+    The cities available and loaded in this worker with their memory footprints.
+    """
+    if pool is None:
+        return jsonify({"pid": os.getpid(), "enabled": False})
+    return jsonify(dict(pool.stats(), available=pool.available()))
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """
+    The hit/miss counters of the result cache in this worker together with those of the
+    shortest path fallback cache of the default matcher as `sp_fallback`, its resident
+    tiles as `tiles` and the counters of its tiered matching as `match_tiers`.
+    """
+    stats = cache.stats() if cache is not None else {"pid": os.getpid(), "enabled": False}
+    stats["sp_fallback"] = mapmatcher.sp_fallback_stats() if mapmatcher is not None else None
+    stats["tiles"] = mapmatcher.tile_stats() if mapmatcher is not None else None
+    stats["match_tiers"] = mapmatcher.tier_stats() if mapmatcher is not None else None
+    return jsonify(stats)
 
 @app.route('/match', methods=['POST'])
-def mapmatch():
+@app.route('/match/<city>', methods=['POST'])
+def mapmatch(city=None):
+    options = response_options()
+    matcher = request_mapmatcher(city)
     gps_wkt = request.json.get("gps_wkt", "")
-    result = mapmatcher.match_wkt(gps_wkt)
-    response = parse_match(result)
-    return jsonify(response)
+    if input_crs() == "gcj02":
+        try:
+            gps_wkt = gcj2wgs_wkt(gps_wkt)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    split, thin = split_options(), thin_options()
+    if split is None and thin is None:
+        match = lambda: matcher.match_wkt(gps_wkt)
+    else:
+        try:
+            lon, lat = wkt_coords(gps_wkt)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if thin is not None:
+            match = lambda: matcher.match_thinned(lon, lat, None, split=split,
+                                                  n_threads=app.config["NUM_THREADS"], **thin)
+        else:
+            match = lambda: matcher.match_split(lon, lat, None, n_threads=app.config["NUM_THREADS"], **split)
+    if cache is None:
+        return match_response(match(), *options) if thin is None else columns_response(match(), *options)
+    key = trajectory_key(split_identity(matcher.identity, split, thin), *wkt_coords(gps_wkt))
+    return columns_response(cached_match(key, match), *options)
+
+@app.route('/match_coords', methods=['POST'])
+@app.route('/match_coords/<city>', methods=['POST'])
+def mapmatch_coords(city=None):
+    """
+    Match a trajectory sent as `application/octet-stream`, the body packs the
+    little-endian float64 arrays `lon`, `lat` and, if the query parameter `ts=1`
+    is given, `tms` one after another, all of them with the same length.
+    """
+    options = response_options()
+    matcher = request_mapmatcher(city)
+    crs = input_crs()
+    num_arrays = 3 if request.args.get("ts", "0") == "1" else 2
+    data = memoryview(request.get_data())
+    if len(data) == 0 or len(data) % (8 * num_arrays) != 0:
+        return jsonify({"error": f"Body size {len(data)} is not a multiple of {8 * num_arrays} bytes."}), 400
+    n = len(data) // (8 * num_arrays)
+    lon, lat = data[:8*n], data[8*n:16*n]
+    ts = data[16*n:] if num_arrays == 3 else None
+    if crs == "gcj02":
+        lon, lat = gcj2wgs_coords(np.frombuffer(lon, dtype="<f8"), np.frombuffer(lat, dtype="<f8"))
+    split, thin = split_options(), thin_options()
+    if thin is not None:
+        match = lambda: matcher.match_thinned(lon, lat, ts, split=split,
+                                              n_threads=app.config["NUM_THREADS"], **thin)
+    elif split is None:
+        match = lambda: matcher.match_coords(lon, lat, ts)
+    else:
+        match = lambda: matcher.match_split(lon, lat, ts, n_threads=app.config["NUM_THREADS"], **split)
+    if cache is None:
+        return match_response(match(), *options) if thin is None else columns_response(match(), *options)
+    arrays = [np.frombuffer(a, dtype="<f8") for a in ([lon, lat] if ts is None else [lon, lat, ts])]
+    key = trajectory_key(split_identity(matcher.identity, split, thin), *arrays)
+    return columns_response(cached_match(key, match), *options)
+
+@app.route('/match_batch', methods=['POST'])
+@app.route('/match_batch/<city>', methods=['POST'])
+def mapmatch_batch(city=None):
+    """
+    Match many trajectories in one request, the request body looks like
+        {"trips": [{"id": 1, "gps_wkt": "LINESTRING(...)"}, ...]}
+    and the results are returned in the same order as
+        {"results": [{"id": 1, "state": 1, "cpath": [...], ...}, ...]}
+    A trajectory that can not be matched gets `state: 0`, with an `error` message if it is
+    malformed, and does not affect the other trajectories in the batch. With `format=msgpack` the
+    same structure is returned in msgpack, with `format=packed` see below.
+    """
+    fmt, fields = response_options()
+    matcher = request_mapmatcher(city)
+    crs = input_crs()
+    trips = request.json.get("trips", [])
+    max_batch_size = app.config["MAX_BATCH_SIZE"]
+    if not isinstance(trips, list):
+        return jsonify({"error": "`trips` should be an array."}), 400
+    if len(trips) > max_batch_size:
+        return jsonify({"error": f"Batch size {len(trips)} exceeds the limit {max_batch_size}."}), 413
+
+    ## The trajectories missing in the cache are matched natively in parallel, the
+    ## malformed items are reported without being sent to the matcher.
+    results = [None] * len(trips)
+    pending = []
+    for i, trip in enumerate(trips):
+        if not (isinstance(trip, dict) and isinstance(trip.get("gps_wkt"), str)):
+            results[i] = {"state": 0, "error": "Each trip should be an object with a string `gps_wkt`."}
+            continue
+        gps_wkt, key = trip["gps_wkt"], None
+        if crs == "gcj02":
+            try:
+                gps_wkt = gcj2wgs_wkt(gps_wkt)
+            except ValueError as e:
+                results[i] = {"state": 0, "error": str(e)}
+                continue
+        if cache is not None:
+            try:
+                key = trajectory_key(matcher.identity, *wkt_coords(gps_wkt))
+            except ValueError:
+                pass
+            value = cache.get(key) if key is not None else None
+            if value is not None:
+                columns = unpack_columns(value)[0]
+                results[i] = columns_json(columns, fields) if fmt == "json" else select_columns(columns, fields)
+                continue
+        pending.append((i, gps_wkt, key))
+    matched = matcher.match_batch([p[1] for p in pending], app.config["NUM_THREADS"]) if pending else []
+    for (i, _, key), result in zip(pending, matched):
+        if result.error:
+            results[i] = {"state": 0, "error": result.error}
+            continue
+        try:
+            if key is None:
+                results[i] = parse_match(result, fields) if fmt == "json" else match_columns(result, fields)
+                continue
+            columns = match_columns(result, ALL_FIELDS)
+            cache.put(key, pack_columns(columns))
+            results[i] = columns_json(columns, fields) if fmt == "json" else select_columns(columns, fields)
+        except Exception as e:
+            results[i] = {"state": 0, "error": f"{type(e).__name__}: {e}"}
+    for trip, response in zip(trips, results):
+        response["id"] = trip.get("id") if isinstance(trip, dict) else None
+    if fmt == "json":
+        return jsonify({"results": results})
+    if fmt == "msgpack":
+        return Response(msgpack.packb({"results": [msgpack_columns(r) for r in results]}),
+                        mimetype="application/msgpack")
+    ## The packed batch is uint32 n followed by n length-prefixed records in the
+    ## request order, `id` and `error` are left out as they are not numeric.
+    records = [pack_columns({k: v for k, v in r.items() if k not in ("id", "error")}) for r in results]
+    body = b"".join([struct.pack("<I", len(records))] +
+                    [struct.pack("<I", len(r)) + r for r in records])
+    return Response(body, mimetype="application/octet-stream")
+
+@app.route('/session', methods=['POST'])
+def open_session():
+    """
+    Open an online matching session of a device, the optional JSON body
+        {"session_id": "device-1", "max_window": 32, "city": "harbin"}
+    gives the session id (a random one by default), the maximum number of points kept
+    uncommitted and the city. The response holds the `session_id` to append points to.
+    """
+    if app.config["WORKERS"] > 1:
+        return jsonify({"error": f"Sessions are kept in the memory of a worker and need a single worker, "
+                                 f"the server runs {app.config['WORKERS']} workers."}), 501
+    matcher = request_mapmatcher()
+    body = request.get_json(silent=True) if request.is_json else None
+    body = body if isinstance(body, dict) else {}
+    max_window = body.get("max_window", 32)
+    if not isinstance(max_window, int) or max_window < 1:
+        return jsonify({"error": "`max_window` should be a positive integer."}), 400
+    try:
+        session_id = sessions.open(matcher, max_window, body.get("session_id"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except OverflowError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({"session_id": session_id, "max_window": max_window, "pid": os.getpid()})
+
+@app.route('/session/<session_id>/points', methods=['POST'])
+def session_points(session_id):
+    """
+    Append points to a session, the JSON body is
+        {"lon": [...], "lat": [...]}
+    or a single point {"lon": 126.6, "lat": 45.7}. The response holds the points committed
+    by them, see `update_json()`, together with the number of points still in the window.
+    """
+    crs = input_crs()
+    try:
+        session = sessions.get(session_id)
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    body = request.get_json(silent=True)
+    try:
+        lon = np.atleast_1d(np.asarray(body["lon"], dtype=np.float64))
+        lat = np.atleast_1d(np.asarray(body["lat"], dtype=np.float64))
+        if lon.ndim != 1 or lon.shape != lat.shape:
+            raise ValueError
+    except (TypeError, KeyError, ValueError):
+        return jsonify({"error": "The body should hold the arrays `lon` and `lat` of the same length."}), 400
+    if crs == "gcj02":
+        lon, lat = gcj2wgs_coords(lon, lat)
+    return jsonify(session.add_points(lon, lat))
+
+@app.route('/session/<session_id>', methods=['DELETE'])
+def close_session(session_id):
+    """
+    Close a session, the points left in the window are committed with the current
+    optimal path and returned.
+    """
+    try:
+        session = sessions.close(session_id)
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    return jsonify(session.flush())
+
+@app.route('/sessions', methods=['GET'])
+def sessions_stats():
+    """
+    The number of open sessions in this worker and the counters of opened, closed and
+    expired sessions.
+    """
+    return jsonify(sessions.stats())
 
 # if __name__ == '__main__':
 #     app.run(threaded=True, processes=5)
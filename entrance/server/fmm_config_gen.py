@@ -1,71 +1,117 @@
-import os, sys, json
+import argparse, os, json
 
-assert len(sys.argv) > 1, "Please provide the city name like, python fmm_config_gen.py harbin"
-city = sys.argv[1]
-assert os.path.exists(f"../data/cities/{city}"), f"{city} is not found in ../data/cities"
+parser = argparse.ArgumentParser(description="Write the fmm configuration of a city.")
+parser.add_argument("city", nargs="?", help="the city written to fmm_config.json, e.g., harbin")
+parser.add_argument("--all", action="store_true", help="write the configurations of all cities in ../data/cities")
+parser.add_argument("--config_dir", default="configs", help="the directory of the per-city configurations")
+parser.add_argument("--tiles", type=float, default=None,
+                    help="match on the tiles written by tile_gen.py with a budget of the resident tiles in MB")
+parser.add_argument("--tiers", action="store_true",
+                    help="try cheaper k and r first and escalate to the city parameters and then stmatch")
+args = parser.parse_args()
+assert args.city or args.all, "Please provide the city name like, python fmm_config_gen.py harbin"
 
-config = {
-    "harbin": {
-        "input": {
-            "network": {
-                "file": f"../data/cities/{city}/edges.shp",
-                "id": "fid",
-                "source": "u",
-                "target": "v"
+def city_config(city: str) -> dict:
+    return {
+        "harbin": {
+            "input": {
+                "network": {
+                    "file": f"../data/cities/{city}/edges.shp",
+                    "id": "fid",
+                    "source": "u",
+                    "target": "v"
+                },
+                "ubodt": {
+                    "file": f"../data/cities/{city}/ubodt.mmap"
+                }
             },
-            "ubodt": {
-                "file": f"../data/cities/{city}/ubodt.bin"
+            "model": "fmm",
+            "parameters": {
+                "k": 32,
+                "r": 0.01, # 1000m
+                "e": 0.002 # 200m
             }
         },
-        "model": "fmm",
-        "parameters": {
-            "k": 32,
-            "r": 0.01, # 1000m
-            "e": 0.002 # 200m
-        }
-    },
-    "chengdu": {
-        "input": {
-            "network": {
-                "file": f"../data/cities/{city}/edges.shp",
-                "id": "fid",
-                "source": "u",
-                "target": "v"
+        "chengdu": {
+            "input": {
+                "network": {
+                    "file": f"../data/cities/{city}/edges.shp",
+                    "id": "fid",
+                    "source": "u",
+                    "target": "v"
+                },
+                "ubodt": {
+                    "file": f"../data/cities/{city}/ubodt.mmap"
+                }
             },
-            "ubodt": {
-                "file": f"../data/cities/{city}/ubodt.bin"
+            "model": "fmm",
+            "parameters": {
+                "k": 16,
+                "r": 0.003, #300m
+                "e": 0.003  #300m
             }
         },
-        "model": "fmm",
-        "parameters": {
-            "k": 16,
-            "r": 0.003, #300m
-            "e": 0.003  #300m
-        }
-    },
-    "porto": {
-        "input": {
-            "network": {
-                "file": f"../data/cities/{city}/edges.shp",
-                "id": "fid",
-                "source": "u",
-                "target": "v"
+        "porto": {
+            "input": {
+                "network": {
+                    "file": f"../data/cities/{city}/edges.shp",
+                    "id": "fid",
+                    "source": "u",
+                    "target": "v"
+                },
+                "ubodt": {
+                    "file": f"../data/cities/{city}/ubodt.mmap"
+                }
             },
-            "ubodt": {
-                "file": f"../data/cities/{city}/ubodt.bin"
+            "model": "fmm",
+            "parameters": {
+                "k": 16,
+                "r": 0.003, #300m
+                "e": 0.003  #300m
             }
-        },
-        "model": "fmm",
-        "parameters": {
-            "k": 16,
-            "r": 0.003, #300m
-            "e": 0.003  #300m
         }
-    }
-}
-assert city in config.keys(), f"Not found config for city {city}"
-print("fmm will be running with the following configuration:")
-print(json.dumps(config[city], indent=2))
+    }.get(city)
+
+def tiered_config(config: dict) -> dict:
+    """
+    Add the tiers of `MapMatcher`: a quarter and a half of k with a half and all of r, escalated
+    on a failure, an error above 3e or shortest paths 1.5 times longer than the straight lines.
+    """
+    k, r, e = (config["parameters"][p] for p in ("k", "r", "e"))
+    return dict(config, tiers={"configs": [{"k": max(k // 4, 1), "r": r / 2}, {"k": max(k // 2, 1), "r": r}],
+                               "max_error": 3 * e, "max_spdist_ratio": 1.5,
+                               "stmatch": {"f": 1.5, "vmax": 0.0003}}) # about 30 m/s
+
+def tiled_config(city: str, config: dict) -> dict:
+    """
+    Replace the network and UBODT of a city with its tiles, loaded on demand under a memory budget.
+    """
+    return dict(config, input={"tiles": {"file": f"../data/cities/{city}/tiles/tiles.json",
+                                         "memory_budget": args.tiles}})
+
+## Each city also gets `{config_dir}/{city}.json` which is served by a multi-city server.
+os.makedirs(args.config_dir, exist_ok=True)
+for city in (sorted(os.listdir("../data/cities")) if args.all else [args.city]):
+    assert os.path.exists(f"../data/cities/{city}"), f"{city} is not found in ../data/cities"
+    config = city_config(city)
+    if config is not None and args.tiles is not None:
+        config = tiled_config(city, config)
+    if config is not None and args.tiers:
+        config = tiered_config(config)
+    assert config is not None or args.all, f"Not found config for city {city}"
+    if config is None:
+        print(f"Skip city {city} without a configuration.")
+        continue
+    with open(os.path.join(args.config_dir, f"{city}.json"), "w") as f:
+        json.dump(config, f, indent=2)
 
-with open("fmm_config.json", "w") as f:
-    json.dump(config[city], f, indent=2)
\ No newline at end of file
+if args.city:
+    config = city_config(args.city)
+    if args.tiles is not None:
+        config = tiled_config(args.city, config)
+    if args.tiers:
+        config = tiered_config(config)
+    print("fmm will be running with the following configuration:")
+    print(json.dumps(config, indent=2))
+    with open("fmm_config.json", "w") as f:
+        json.dump(config, f, indent=2)
\ No newline at end of file
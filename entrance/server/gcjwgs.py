@@ -1,6 +1,8 @@
 import math
+import numpy as np
 
 earthR = 6378137.0
+ee = 0.00669342162296594323
 
 def outOfChina(lat, lng):
     return not (72.004 <= lng <= 137.8347 and 0.8293 <= lat <= 55.8271)
@@ -32,7 +34,6 @@ def transform(x, y):
 
 
 def delta(lat, lng):
-    ee = 0.00669342162296594323
     dLat, dLng = transform(lng-105.0, lat-35.0)
     radLat = lat / 180.0 * math.pi
     magic = math.sin(radLat)
@@ -56,4 +57,68 @@ def gcj2wgs(gcjLat, gcjLng):
         return gcjLat, gcjLng
     else:
         dlat, dlng = delta(gcjLat, gcjLng)
-        return gcjLat - dlat, gcjLng - dlng
\ No newline at end of file
+        return gcjLat - dlat, gcjLng - dlng
+
+## The array versions of the conversions above, `lat` and `lng` are numpy arrays (or
+## anything `np.asarray` accepts) and the points out of China are left untouched.
+
+def outOfChinaArray(lat, lng):
+    lat, lng = np.asarray(lat, dtype=np.float64), np.asarray(lng, dtype=np.float64)
+    return ~((72.004 <= lng) & (lng <= 137.8347) & (0.8293 <= lat) & (lat <= 55.8271))
+
+
+def transformArray(x, y):
+    xPi = x * np.pi
+    yPi = y * np.pi
+    d = 20.0*np.sin(6.0*xPi) + 20.0*np.sin(2.0*xPi)
+    lat = d + 20.0*np.sin(yPi) + 40.0*np.sin(yPi/3.0) + 160.0*np.sin(yPi/12.0) + 320*np.sin(yPi/30.0)
+    lng = d + 20.0*np.sin(xPi) + 40.0*np.sin(xPi/3.0) + 150.0*np.sin(xPi/12.0) + 300.0*np.sin(xPi/30.0)
+    xy, absX = x * y, np.sqrt(np.abs(x))
+    lat = lat * (2.0 / 3.0) - 100.0 + 2.0*x + 3.0*y + 0.2*y*y + 0.1*xy + 0.2*absX
+    lng = lng * (2.0 / 3.0) + 300.0 + x + 2.0*y + 0.1*x*x + 0.1*xy + 0.1*absX
+    return lat, lng
+
+
+def deltaArray(lat, lng):
+    dLat, dLng = transformArray(lng-105.0, lat-35.0)
+    radLat = lat / 180.0 * np.pi
+    magic = 1 - ee * np.sin(radLat)**2
+    sqrtMagic = np.sqrt(magic)
+    dLat = (dLat * 180.0) / ((earthR * (1 - ee)) / (magic * sqrtMagic) * np.pi)
+    dLng = (dLng * 180.0) / (earthR / sqrtMagic * np.cos(radLat) * np.pi)
+    ## No shift outside China, as the scalar versions.
+    outside = outOfChinaArray(lat, lng)
+    return np.where(outside, 0.0, dLat), np.where(outside, 0.0, dLng)
+
+
+def wgs2gcjArray(wgsLat, wgsLng):
+    wgsLat, wgsLng = np.asarray(wgsLat, dtype=np.float64), np.asarray(wgsLng, dtype=np.float64)
+    dlat, dlng = deltaArray(wgsLat, wgsLng)
+    return wgsLat + dlat, wgsLng + dlng
+
+
+def gcj2wgsArray(gcjLat, gcjLng):
+    """
+    The one step inverse of `wgs2gcjArray` as `gcj2wgs`, its error is up to a few meters.
+    """
+    gcjLat, gcjLng = np.asarray(gcjLat, dtype=np.float64), np.asarray(gcjLng, dtype=np.float64)
+    dlat, dlng = deltaArray(gcjLat, gcjLng)
+    return gcjLat - dlat, gcjLng - dlng
+
+
+def gcj2wgsExact(gcjLat, gcjLng, threshold=1e-9, maxIter=10):
+    """
+    The inverse of `wgs2gcjArray` refined by the fixed point iteration
+        wgs <- wgs - (wgs2gcj(wgs) - gcj)
+    until all points move less than `threshold` degrees, which takes 2 or 3 iterations
+    to reach ~1e-9 degrees (~0.1 mm).
+    """
+    gcjLat, gcjLng = np.asarray(gcjLat, dtype=np.float64), np.asarray(gcjLng, dtype=np.float64)
+    wgsLat, wgsLng = gcj2wgsArray(gcjLat, gcjLng)
+    for _ in range(maxIter):
+        lat, lng = wgs2gcjArray(wgsLat, wgsLng)
+        dLat, dLng = lat - gcjLat, lng - gcjLng
+        wgsLat, wgsLng = wgsLat - dLat, wgsLng - dLng
+        if np.all(np.abs(dLat) < threshold) and np.all(np.abs(dLng) < threshold):
+            break
+    return wgsLat, wgsLng
@@ -0,0 +1,103 @@
+import hashlib, os, sqlite3, threading
+from collections import OrderedDict
+import numpy as np
+
+
+def trajectory_key(identity: str, *arrays) -> str:
+    """
+    The content address of a trajectory, i.e., the hash of the model `identity` and the
+    coordinate arrays normalized to float64 rounded at 1e-7, so the same trajectory gets
+    the same key no matter it is sent as WKT or packed coordinates.
+    """
+    h = hashlib.sha1(identity.encode())
+    for xs in arrays:
+        xs = np.round(np.asarray(xs, dtype=np.float64), 7) + 0.0 # -0.0 -> 0.0
+        h.update(len(xs).to_bytes(8, "little"))
+        h.update(xs.astype("<f8").tobytes())
+    return h.hexdigest()
+
+
+def wkt_coords(gps_wkt: str):
+    """
+    Parse the x and y coordinates of a WKT linestring.
+    """
+    start, end = gps_wkt.find("("), gps_wkt.rfind(")")
+    if start < 0 or end < start:
+        raise ValueError("Invalid WKT linestring.")
+    xy = np.array(gps_wkt[start+1:end].replace(",", " ").split(), dtype=np.float64)
+    return xy[0::2], xy[1::2]
+
+
+class MatchCache(object):
+    """
+    A result cache with a bounded in-memory LRU tier and an optional SQLite tier, the
+    SQLite file can be shared by the gunicorn workers. The values are bytes, e.g., the
+    packed columns of a match result.
+    """
+    def __init__(self, capacity: int = 10000, sqlite_file: str = None) -> None:
+        self.capacity = capacity
+        self.sqlite_file = sqlite_file
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = {"memory": 0, "sqlite": 0}
+        self.misses = 0
+        ## The connection is opened lazily by each process, as a connection can not be
+        ## used across `fork()` once the workers are forked from a preloaded master.
+        self.db, self.db_pid = None, None
+
+    def connection(self):
+        if self.sqlite_file is None:
+            return None
+        if self.db is None or self.db_pid != os.getpid():
+            self.db = sqlite3.connect(self.sqlite_file, timeout=30, isolation_level=None,
+                                      check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB)")
+            self.db_pid = os.getpid()
+        return self.db
+
+    def get(self, key: str):
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return value
+            db = self.connection()
+            row = db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone() if db else None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits["sqlite"] += 1
+            self.put_memory(key, row[0])
+            return row[0]
+
+    def put(self, key: str, value: bytes) -> None:
+        with self.lock:
+            self.put_memory(key, value)
+            db = self.connection()
+            if db is not None:
+                db.execute("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", (key, value))
+
+    def put_memory(self, key: str, value: bytes) -> None:
+        if self.capacity <= 0:
+            return
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = sum(self.hits.values()) + self.misses
+            stats = {"pid": os.getpid(),
+                     "hits": dict(self.hits),
+                     "misses": self.misses,
+                     "hit_rate": sum(self.hits.values()) / lookups if lookups > 0 else 0.0,
+                     "memory_size": len(self.memory),
+                     "memory_capacity": self.capacity,
+                     "memory_bytes": sum(len(v) for v in self.memory.values())}
+            db = self.connection()
+            if db is not None:
+                stats["sqlite_size"] = db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            return stats
@@ -0,0 +1,197 @@
+"""
+The metrics of the matching in a worker, i.e., the histograms of the seconds taken by
+the stages of a match (see `MatchStats` of fmm) and by the requests together with the
+counters of the work done, rendered in the Prometheus text format by `/metrics`.
+
+The gunicorn workers are separate processes and a scrape of `/metrics` reaches only one
+of them, so with a shared `directory` each worker writes its metrics to `{pid}.json` in
+it and the one answering the scrape renders those of all the live workers, each sample
+labelled with its `worker`.
+"""
+import bisect, json, os, threading, time
+from artifacts import write_atomic
+
+## The stages of `MatchStats` in the order they run, the server adds `serialize` for formatting the response.
+STAGES = ("parse", "search", "transition_graph", "update", "backtrack", "complete_path",
+          "geometry", "output")
+## The counters of `MatchStats` with their metric names.
+COUNTERS = {"points": "mm_points_total",
+            "candidates": "mm_candidates_total",
+            "transitions": "mm_transitions_total",
+            "ubodt_hits": "mm_ubodt_hits_total",
+            "ubodt_misses": "mm_ubodt_misses_total",
+            "sp_searches": "mm_sp_searches_total",
+            "sp_cache_hits": "mm_sp_cache_hits_total"}
+SECONDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1, 2.5, 5, 10)
+## The upper bounds of the buckets of each histogram.
+BUCKETS = {"mm_stage_seconds": SECONDS,
+           "mm_request_seconds": SECONDS,
+           "mm_candidates_per_point": (0.5, 1, 2, 4, 8, 16, 32, 64)}
+HELP = {"mm_stage_seconds": "Seconds taken by a stage of matching a trajectory.",
+        "mm_request_seconds": "Seconds taken by a request.",
+        "mm_candidates_per_point": "Average number of candidates per point of a trajectory.",
+        "mm_trajectories_total": "Trajectories matched by state, 1 if matched and 0 otherwise.",
+        "mm_points_total": "Points of the trajectories matched.",
+        "mm_candidates_total": "Candidates found for the points.",
+        "mm_transitions_total": "Transitions between candidates evaluated.",
+        "mm_ubodt_hits_total": "UBODT lookups found.",
+        "mm_ubodt_misses_total": "UBODT lookups not found.",
+        "mm_sp_searches_total": "Bounded shortest path searches of stmatch or the UBODT fallback of fmm.",
+        "mm_sp_cache_hits_total": "UBODT misses found in the shortest path cache of the fallback.",
+        "mm_tier_trajectories_total": "Trajectories tried by a tier of the tiered matching by outcome, "
+                                      "accepted or the reason to escalate.",
+        "mm_tier_seconds_total": "Seconds taken by a tier of the tiered matching."}
+
+
+def label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def format_labels(labels) -> str:
+    escape = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}" if labels else ""
+
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def worker_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MatchMetrics(object):
+    """
+    Histograms and counters of one worker. The metrics are written to `directory`, if it
+    is given, at most every `flush_interval` seconds by `flush()`, which the server calls
+    after each request.
+    """
+    def __init__(self, directory: str = None, flush_interval: float = 1.0) -> None:
+        self.directory = directory
+        self.flush_interval = flush_interval
+        ## (name, labels) -> [bucket counts, sum, count]
+        self.histograms = {}
+        ## (name, labels) -> value
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.flushed = 0.0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        buckets = BUCKETS[name]
+        with self.lock:
+            h = self.histograms.setdefault((name, label_key(labels)), [[0] * len(buckets), 0.0, 0])
+            i = bisect.bisect_left(buckets, value)
+            if i < len(buckets):
+                h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def inc(self, name: str, value=1, **labels) -> None:
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe_result(self, result) -> None:
+        """
+        Record a match result of fmm, the stages and the counters are recorded only if its
+        `stats` are collected, i.e., `set_stats_enabled(True)` of the model.
+        """
+        self.inc("mm_trajectories_total", state=int(len(result.cpath) > 0))
+        stats = result.stats
+        if stats.points == 0:
+            return
+        for stage in STAGES:
+            self.observe("mm_stage_seconds", getattr(stats, stage), stage=stage)
+        for field, name in COUNTERS.items():
+            self.inc(name, getattr(stats, field))
+        self.observe("mm_candidates_per_point", stats.candidates / stats.points)
+
+    def observe_tier(self, tier: str, outcome: str, seconds: float) -> None:
+        """
+        Record an attempt of the tiered matching of `MapMatcher`.
+        """
+        self.inc("mm_tier_trajectories_total", tier=tier, outcome=outcome)
+        self.inc("mm_tier_seconds_total", seconds, tier=tier)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"histograms": [[name, labels, list(h[0]), h[1], h[2]]
+                                   for (name, labels), h in self.histograms.items()],
+                    "counters": [[name, labels, value] for (name, labels), value in self.counters.items()]}
+
+    def flush(self, force: bool = False) -> None:
+        """
+        Write the metrics of this worker to `{directory}/{pid}.json` if the last write is
+        older than `flush_interval` seconds or `force` is set.
+        """
+        now = time.monotonic()
+        if not self.directory or (not force and now - self.flushed < self.flush_interval):
+            return
+        self.flushed = now
+        write_atomic(os.path.join(self.directory, f"{os.getpid()}.json"), json.dumps(self.snapshot()))
+
+    def workers(self) -> dict:
+        """
+        The metrics of the live workers by pid, those of this worker are always current.
+        """
+        pid = os.getpid()
+        snapshots = {pid: self.snapshot()}
+        if not self.directory:
+            return snapshots
+        for filename in os.listdir(self.directory):
+            name, ext = os.path.splitext(filename)
+            if ext != ".json" or not name.isdigit() or int(name) == pid:
+                continue
+            if not worker_alive(int(name)):
+                ## The worker has exited, e.g., restarted by gunicorn.
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshots[int(name)] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """
+        The metrics of the live workers in the Prometheus text format.
+        """
+        ## name -> [(labels, value)] with the worker label added
+        histograms, counters = {}, {}
+        for pid, snapshot in sorted(self.workers().items()):
+            worker = (("worker", str(pid)),)
+            for name, labels, counts, total, count in snapshot["histograms"]:
+                labels = tuple(tuple(l) for l in labels) + worker
+                histograms.setdefault(name, []).append((labels, counts, total, count))
+            for name, labels, value in snapshot["counters"]:
+                labels = tuple(tuple(l) for l in labels) + worker
+                counters.setdefault(name, []).append((labels, value))
+        lines = []
+        for name in sorted(histograms):
+            lines += [f"# HELP {name} {HELP[name]}", f"# TYPE {name} histogram"]
+            for labels, counts, total, count in sorted(histograms[name]):
+                cumulative = 0
+                for le, c in zip(BUCKETS[name], counts):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(le)),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        for name in sorted(counters):
+            lines += [f"# HELP {name} {HELP[name]}", f"# TYPE {name} counter"]
+            for labels, value in sorted(counters[name]):
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,141 @@
+"""
+Online map matching sessions for live GPS streams. A session is opened per device, the
+points are appended as they arrive and each append returns the points whose match has
+been committed, together with the edges appended to the complete path, so the work per
+point does not grow with the length of the trip. The sessions are kept in the memory of
+one process, see `SessionStore`.
+"""
+import os, re, threading, time, uuid
+from collections import OrderedDict
+import numpy as np
+
+
+def update_json(update) -> dict:
+    """
+    The JSON response of a `SessionUpdate`, `indices` are the positions of the committed
+    points in the stream, `opath` and `offset` their matched edges and offsets, `cpath`
+    the edges appended to the complete path and `segments` the positions in `cpath` where
+    a new disconnected segment starts.
+    """
+    return {"indices": list(update.indices),
+            "opath": list(update.opath),
+            "offset": list(update.offset),
+            "cpath": list(update.cpath),
+            "segments": list(update.segments),
+            "skipped": list(update.skipped)}
+
+
+class MatchSession(object):
+    """
+    A session of `matcher`, which keeps the matcher (and so its network) alive until the
+    session is closed even if the matcher is evicted from a `CityPool` meanwhile.
+    """
+    def __init__(self, matcher, max_window: int = 32) -> None:
+        self.matcher = matcher
+        self.session = matcher.open_session(max_window)
+        self.max_window = max_window
+        ## The native session is not thread safe, the appends of a device are serialized.
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def add_points(self, lon, lat) -> dict:
+        """
+        Append the points and return the update together with the `stats()` after it.
+        """
+        with self.lock:
+            self.last_used = time.monotonic()
+            lon = np.ascontiguousarray(np.atleast_1d(lon), dtype=np.float64)
+            lat = np.ascontiguousarray(np.atleast_1d(lat), dtype=np.float64)
+            return dict(update_json(self.session.add_points(lon, lat)), **self.unlocked_stats())
+
+    def flush(self) -> dict:
+        """
+        Commit the points left in the window and return the update with the `stats()` after it.
+        """
+        with self.lock:
+            self.last_used = time.monotonic()
+            return dict(update_json(self.session.flush()), **self.unlocked_stats())
+
+    def stats(self) -> dict:
+        ## The native session may be changed by an append of another thread meanwhile.
+        with self.lock:
+            return self.unlocked_stats()
+
+    def unlocked_stats(self) -> dict:
+        """
+        The number of points appended, those in the window and the idle seconds, the caller
+        holds the lock.
+        """
+        return {"num_points": self.session.get_num_points(),
+                "window": self.session.get_window_size(),
+                "max_window": self.max_window,
+                "idle": time.monotonic() - self.last_used}
+
+
+class SessionStore(object):
+    """
+    The open sessions of this process. A session idle for more than `timeout` seconds is
+    closed, dropping its uncommitted points, and at most `max_sessions` sessions are open
+    at the same time, each of them takes the memory of at most `max_window` points.
+    """
+    def __init__(self, timeout: float = 300, max_sessions: int = 10000) -> None:
+        self.timeout = timeout
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"opened": 0, "closed": 0, "expired": 0}
+
+    def expire(self) -> None:
+        """
+        Close the sessions idle for more than `timeout` seconds, the caller holds the lock.
+        """
+        now = time.monotonic()
+        for session_id in [sid for sid, s in self.sessions.items() if now - s.last_used > self.timeout]:
+            del self.sessions[session_id]
+            self.counters["expired"] += 1
+
+    def open(self, matcher, max_window: int = 32, session_id: str = None) -> str:
+        """
+        Open a session and return its id, a device can give its own `session_id`. Raise
+        ValueError for an invalid or taken id and OverflowError if too many are open.
+        """
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+        elif re.fullmatch(r"[A-Za-z0-9_\-]{1,64}", session_id) is None:
+            raise ValueError(f"Invalid session id {session_id}.")
+        session = MatchSession(matcher, max_window)
+        with self.lock:
+            self.expire()
+            if session_id in self.sessions:
+                raise ValueError(f"Session {session_id} is already open.")
+            if len(self.sessions) >= self.max_sessions:
+                raise OverflowError(f"Too many open sessions, the limit is {self.max_sessions}.")
+            self.sessions[session_id] = session
+            self.counters["opened"] += 1
+        return session_id
+
+    def get(self, session_id: str) -> MatchSession:
+        """
+        Raise KeyError if the session is not open in this process.
+        """
+        with self.lock:
+            self.expire()
+            session = self.sessions.get(session_id)
+            if session is None:
+                raise KeyError(f"Session {session_id} is not found, it may be closed or expired.")
+            session.last_used = time.monotonic()
+            return session
+
+    def close(self, session_id: str) -> MatchSession:
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                raise KeyError(f"Session {session_id} is not found, it may be closed or expired.")
+            self.counters["closed"] += 1
+            return session
+
+    def stats(self) -> dict:
+        with self.lock:
+            self.expire()
+            return {"pid": os.getpid(), "open": len(self.sessions), "timeout": self.timeout,
+                    "max_sessions": self.max_sessions, **self.counters}
@@ -4,7 +4,7 @@ from shapely.geometry import Polygon, LineString
 from shapely import wkt
 from toolz.curried import *
 from typing import Tuple
-from gcjwgs import wgs2gcj
+from gcjwgs import wgs2gcjArray
 import os, sys, re
 
 
@@ -27,15 +27,51 @@ def lonlat2wktlinestring(lon: np.array, lat: np.array) -> str:
 
 def wktlinestring_wgs2gcj(gps_wkt: str) -> str:
     lon_wgs, lat_wgs = wktlinestring2lonlat(gps_wkt)
-    lat_gcj, lon_gcj = list(zip(*map(wgs2gcj, lat_wgs, lon_wgs)))
-    return lonlat2wktlinestring(np.asarray(lon_gcj), np.asarray(lat_gcj))
+    lat_gcj, lon_gcj = wgs2gcjArray(lat_wgs, lon_wgs)
+    return lonlat2wktlinestring(lon_gcj, lat_gcj)
 
 
 def shapelylinestring_wgs2gcj(linestr: LineString) -> LineString:
-    wgs_wkt = linestr.to_wkt()
-    lon_wgs, lat_wgs = wktlinestring2lonlat(wgs_wkt)
-    lat_gcj, lon_gcj = list(zip(*map(wgs2gcj, lat_wgs, lon_wgs)))
-    return LineString([[x, y] for (x, y) in zip(lon_gcj, lat_gcj)])
+    lon_wgs, lat_wgs = np.asarray(linestr.coords, dtype=np.float64)[:, :2].T
+    lat_gcj, lon_gcj = wgs2gcjArray(lat_wgs, lon_wgs)
+    return LineString(np.column_stack((lon_gcj, lat_gcj)))
+
+def network_arrays(gdf_edges, id_name="fid", source_name="u", target_name="v") -> tuple:
+    """
+    Return the arrays `(ids, sources, targets, coords, offsets)` of `Network.from_arrays`
+    from the edges GeoDataFrame of `graph_to_gdfs`, the edge ids are the row numbers if
+    there is no column `id_name`.
+    """
+    if source_name not in gdf_edges.columns:
+        ## osmnx keeps (u, v, key) as the index of the edges
+        gdf_edges = gdf_edges.reset_index()
+    n = gdf_edges.shape[0]
+    ids = gdf_edges[id_name] if id_name in gdf_edges.columns else np.arange(0, n)
+    coords = [np.asarray(geom.coords, dtype=np.float64)[:, :2] for geom in gdf_edges.geometry]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(xy) for xy in coords], out=offsets[1:])
+    return (np.ascontiguousarray(ids, dtype=np.int64),
+            np.ascontiguousarray(gdf_edges[source_name], dtype=np.int64),
+            np.ascontiguousarray(gdf_edges[target_name], dtype=np.int64),
+            np.concatenate(coords).ravel() if n > 0 else np.zeros(0),
+            offsets)
+
+def network_from_gdf(gdf_edges, id_name="fid", source_name="u", target_name="v"):
+    """
+    Build an fmm `Network` from the edges GeoDataFrame in memory, without writing and
+    reading back the shapefile.
+    """
+    from fmm import Network
+    return Network.from_arrays(*network_arrays(gdf_edges, id_name, source_name, target_name))
+
+def network_from_graph(G, to_gcj=False):
+    """
+    Build an fmm `Network` from an osmnx graph with the same edge ids as `save_shapefile`.
+    """
+    _, gdf_edges = ox.utils_graph.graph_to_gdfs(G)
+    gdf_edges["fid"] = np.arange(0, gdf_edges.shape[0])
+    if to_gcj: gdf_edges.geometry = gdf_edges.geometry.map(shapelylinestring_wgs2gcj)
+    return network_from_gdf(gdf_edges)
 
 def save_shapefile(G, dirpath: str, to_gcj=False):
     nodes_file = os.path.join(dirpath, "nodes.shp")
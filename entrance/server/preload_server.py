@@ -0,0 +1,101 @@
+"""
+Launch the flask server with gunicorn in the preload-and-fork mode, the network, graph
+and UBODT are loaded only once in the master process before the workers are forked,
+and the workers share them copy-on-write, e.g.,
+
+    python preload_server.py -c fmm_config.json -b 0.0.0.0:1236 -w 5 --ready_file server.ready
+
+Once the model is loaded and the address is bound the file `--ready_file` is written
+with the per-stage load timings, so a supervisor or script can wait for it before
+sending requests, which are queued on the socket until a worker accepts them.
+
+With `--config_dir configs` the server serves every city configured in the directory,
+the cities of `--pin` are preloaded in the master and the others are loaded by each
+worker on demand within `--memory_budget` MB.
+"""
+import argparse, gc, json, os, shutil, sys, tempfile, time
+from gunicorn.app.base import BaseApplication
+from artifacts import write_atomic
+
+
+class PreloadApplication(BaseApplication):
+    def __init__(self, application, options: dict) -> None:
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preload the map matcher and fork gunicorn workers.")
+    parser.add_argument("-c", "--config", default=None, help="the model configuration file, fmm_config.json by default")
+    parser.add_argument("-b", "--bind", default="0.0.0.0:1236", help="the address to bind")
+    parser.add_argument("-w", "--workers", type=int, default=5, help="the number of worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="the number of threads of each worker")
+    parser.add_argument("--timeout", type=int, default=120, help="the timeout of a worker in seconds")
+    parser.add_argument("--ready_file", default="", help="the file written once the server is ready")
+    parser.add_argument("--config_dir", default="", help="serve the cities configured in this directory")
+    parser.add_argument("--memory_budget", type=float, default=0, help="the memory budget of the cities in MB")
+    parser.add_argument("--pin", default="", help="the cities preloaded and never evicted, comma separated")
+    args = parser.parse_args()
+
+    if args.ready_file and os.path.exists(args.ready_file):
+        os.remove(args.ready_file)
+    if args.config is not None or not args.config_dir:
+        os.environ["MM_CONFIG"] = args.config or "fmm_config.json"
+    if args.config_dir:
+        os.environ["MM_CONFIG_DIR"] = args.config_dir
+        os.environ["MM_MEMORY_BUDGET"] = str(args.memory_budget)
+        os.environ["MM_PIN_CITIES"] = args.pin
+    ## The workers divide the cores of `/match_batch` among them, see `NUM_THREADS` in flask_server.py.
+    os.environ["MM_WORKERS"] = str(args.workers)
+    ## The workers share their metrics through this directory so that `/metrics` reports all of them.
+    metrics_dir = None
+    if "MM_METRICS_DIR" not in os.environ:
+        metrics_dir = tempfile.mkdtemp(prefix="mm_metrics_")
+        os.environ["MM_METRICS_DIR"] = metrics_dir
+    tic = time.perf_counter()
+    ## Importing the flask app builds the MapMatcher and the pinned cities in this (master) process.
+    from flask_server import app, mapmatcher, pool
+    load_timings = dict(mapmatcher.load_timings if mapmatcher is not None else {},
+                        total=time.perf_counter() - tic)
+    print("Model loaded in the master process " +
+          ", ".join(f"{k}: {v:.2f}s" for k, v in load_timings.items()), flush=True)
+    ## Move the loaded objects to the permanent generation, so that the collections in the
+    ## workers do not traverse them and write their GC headers, which would dirty and copy the
+    ## shared pages. The reference counts are still updated, freezing does not prevent that.
+    gc.collect()
+    gc.freeze()
+
+    def when_ready(server):
+        info = {"pid": os.getpid(), "bind": args.bind, "workers": args.workers,
+                "config": os.environ.get("MM_CONFIG"), "load_timings": load_timings,
+                "cities": list(pool.stats()["loaded"]) if pool is not None else []}
+        if args.ready_file:
+            write_atomic(args.ready_file, json.dumps(info, indent=2))
+        server.log.info(f"Server ready {json.dumps(info)}")
+
+    def on_exit(server):
+        if args.ready_file and os.path.exists(args.ready_file):
+            os.remove(args.ready_file)
+        if metrics_dir is not None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    options = {"bind": args.bind,
+               "workers": args.workers,
+               "threads": args.threads,
+               "timeout": args.timeout,
+               "preload_app": True,
+               "when_ready": when_ready,
+               "on_exit": on_exit}
+    PreloadApplication(app, options).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,47 +1,121 @@
-import socketserver
-from mapmatcher import MapMatcher
-import optparse
+"""
+A raw TCP server for local high-QPS clients, a low-overhead alternative to the flask server, e.g.,
+
+    python server.py -c fmm_config.json -p 1235 --workers 8
+
+A connection carries any number of requests. Each message in both directions is a
+frame made up of a little-endian uint32 byte length and a UTF-8 JSON object. A request
+looks like either of
+
+    {"id": 1, "gps_wkt": "LINESTRING(...)"}
+    {"id": 2, "lon": [...], "lat": [...], "tms": [...]}
+
+with the optional keys `fields` (as `fields=` of the flask server) and `tms`. The requests
+can be pipelined, i.e., sent without waiting for the responses. They are matched
+concurrently by a pool of threads (the matching releases the GIL), so the responses
+come back in completion order and the `id` of a request is echoed in its response
+    {"id": 1, "state": 1, "cpath": [...], ...}
+A request that can not be matched gets `state: 0`, plus an `error` message if it is malformed
+or fails. A frame larger than `MAX_FRAME_SIZE` is answered by an error frame with `id: null`
+before the connection is closed, as the rest of the stream can not be framed any more.
+"""
+import asyncio
 import json
+import optparse
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from flask_mapmatcher import MapMatcher, parse_match, parse_fields
 
-class MyTCPHandler(socketserver.StreamRequestHandler):
-    """
-    The request handler class for our server.
+HEADER = struct.Struct("<I")
+## Frames larger than this are rejected and the connection is closed.
+MAX_FRAME_SIZE = 64 * 1024 * 1024
 
-    It is instantiated once per connection to the server, and must
-    override the handle() method to implement communication to the
-    client.
-    """
 
-    def handle(self):
-        # self.request is the TCP socket connected to the client
-        wkt = self.rfile.readline().strip().decode("utf-8")
-        result = self.server.mapmatcher.match_wkt(wkt)
-        if result.mgeom.get_num_points() > 0:
-            mgeom_wkt = result.mgeom.export_wkt()
-        else:
-            mgeom_wkt = ""
-        if result.pgeom.get_num_points() > 0:
-            pgeom_wkt = result.pgeom.export_wkt()
-        else:
-            pgeom_wkt = ""
-
-        length = [c.length for c in result.candidates]
-        offset = [c.offset for c in result.candidates]
-        spdist = [c.spdist for c in result.candidates]
-
-        if mgeom_wkt != "":
-            response_json = {"mgeom_wkt": mgeom_wkt, 
-                             "pgeom_wkt": pgeom_wkt, 
-                             "opath": list(result.opath), 
-                             "cpath": list(result.cpath),
-                             "indices": list(result.indices),
-                             "offset": offset, 
-                             "length": length,
-                             "spdist": spdist, 
-                             "state": 1}
-            self.request.sendall(json.dumps(response_json).encode("utf-8"))
+def encode_frame(response: dict) -> bytes:
+    data = json.dumps(response).encode("utf-8")
+    return HEADER.pack(len(data)) + data
+
+
+def handle_request(mapmatcher, payload: bytes) -> bytes:
+    """
+    Decode, match and encode one request, it runs in the executor threads so that the
+    event loop is not blocked by the JSON work either. It always answers, an unexpected
+    error is reported in the response rather than leaving the client waiting for its `id`.
+    """
+    request_id = None
+    try:
+        request = json.loads(payload)
+        if not isinstance(request, dict):
+            raise ValueError("The request should be a JSON object.")
+        request_id = request.get("id")
+        fields = parse_fields(request.get("fields"))
+        if "gps_wkt" in request:
+            result = mapmatcher.match_wkt(str(request["gps_wkt"]))
         else:
-            self.request.sendall(json.dumps({"state": 0}).encode("utf-8"))
+            result = mapmatcher.match_coords(request["lon"], request["lat"], request.get("tms"))
+        response = parse_match(result, fields)
+    except Exception as e:
+        response = {"state": 0, "error": f"{type(e).__name__}: {e}"}
+    response["id"] = request_id
+    return encode_frame(response)
+
+
+class MatchServer(object):
+    def __init__(self, mapmatcher, workers: int, max_inflight: int) -> None:
+        self.mapmatcher = mapmatcher
+        self.executor = ThreadPoolExecutor(workers)
+        ## The requests of a connection being matched at once, the connection is not
+        ## read further when it is reached, which pushes back on the client.
+        self.max_inflight = max_inflight
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        inflight = asyncio.Semaphore(self.max_inflight)
+        tasks = set()
+
+        async def respond(payload: bytes) -> None:
+            try:
+                data = await loop.run_in_executor(self.executor, handle_request, self.mapmatcher, payload)
+                ## A frame is written by a single `write()` call, so frames never interleave.
+                writer.write(data)
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                inflight.release()
+
+        try:
+            while True:
+                header = await reader.readexactly(HEADER.size)
+                size, = HEADER.unpack(header)
+                if size > MAX_FRAME_SIZE:
+                    writer.write(encode_frame({"id": None, "state": 0,
+                                               "error": f"Frame size {size} exceeds the limit {MAX_FRAME_SIZE}."}))
+                    await writer.drain()
+                    break
+                payload = await reader.readexactly(size)
+                await inflight.acquire()
+                task = asyncio.create_task(respond(payload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            ## Finish the requests already received before closing the connection.
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self, host: str, port: int) -> None:
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving on {', '.join(str(s.getsockname()) for s in server.sockets)}", flush=True)
+        async with server:
+            await server.serve_forever()
+
 
 if __name__ == "__main__":
 
@@ -57,14 +131,21 @@ if __name__ == "__main__":
         '-c', '--config',
         help="the model configuration file", action="store", dest="config_file",
         type='string', default="fmm_config.json")
+    parser.add_option(
+        '-w', '--workers',
+        help="the number of matching threads", action="store", dest="workers", type='int', default=8)
+    parser.add_option(
+        '--max_inflight',
+        help="the maximum number of requests matched at once for a connection",
+        action="store", dest="max_inflight", type='int', default=64)
     opts, args = parser.parse_args()
 
     HOST, PORT = "0.0.0.0", opts.port
-    
-    server = socketserver.TCPServer((HOST, PORT), MyTCPHandler)
-    server.mapmatcher = MapMatcher(opts.config_file)
-
 
-    # Activate the server; this will keep running until you
+    server = MatchServer(MapMatcher(opts.config_file), opts.workers, opts.max_inflight)
+    # Run the server; this will keep running until you
     # interrupt the program with Ctrl-C
-    server.serve_forever()
\ No newline at end of file
+    try:
+        asyncio.run(server.serve(HOST, PORT), debug=opts.debug)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,158 @@
+"""
+Match all the trip files in `trips/input` with a pool of worker processes, e.g.,
+
+    python shard_match.py --city harbin --workers 8
+
+Each input file is split into shards of `--shard_size` trips, and the shards of all the
+files are handed to the workers dynamically, so a huge file does not leave the workers
+idle at its tail. The model is loaded once before the workers are forked and shared by
+them copy-on-write. A completed shard is recorded in the manifest `{stem}.manifest.json`
+under `trips/output`, and once all shards of a file are done they are merged into
+`{stem}.jsonl`. A restarted run only processes the shards missing in the manifests, it
+refuses to resume a manifest whose input file or model has changed since.
+"""
+import argparse, itertools, json, multiprocessing, os, shutil, time
+from artifacts import open_atomic, write_atomic
+from flask_mapmatcher import MapMatcher, file_identity
+from stream_match import match_chunk, chunked
+from trip_reader import trip_reader, trip_offsets
+
+## The matcher shared by the forked workers, it is set before the pool is created.
+mapmatcher = None
+
+
+def shard_name(start: int, stop: int) -> str:
+    return f"{start:09d}-{stop:09d}"
+
+
+def load_manifest(manifest_file: str, input_file: str, city: str, shard_size: int, identity: str) -> dict:
+    """
+    Load the manifest of `input_file` or make a new one. A manifest is only resumed for the
+    same input file (its shard offsets point into it) and the same model `identity`, so that
+    the shards merged into one output are all matched alike.
+    """
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+        if manifest["shard_size"] != shard_size or manifest["city"] != city:
+            raise ValueError(f"{manifest_file} was made with city {manifest['city']} shard_size "
+                             f"{manifest['shard_size']}, remove it to start over.")
+        if manifest.get("input_identity") != file_identity(input_file):
+            raise ValueError(f"{manifest_file} was made for another version of {input_file}, "
+                             f"remove it to start over.")
+        if manifest.get("identity") != identity:
+            raise ValueError(f"{manifest_file} was made with another model, remove it to start over.")
+        return manifest
+    reader, _ = trip_reader(city)
+    ## The byte offset of each shard lets a worker seek to it instead of parsing the rows before it.
+    ntrips, offsets = trip_offsets(input_file, reader, shard_size)
+    return {"input": os.path.abspath(input_file),
+            "input_identity": file_identity(input_file),
+            "identity": identity,
+            "city": city,
+            "shard_size": shard_size,
+            "ntrips": ntrips,
+            "offsets": offsets,
+            "shards": {},
+            "merged": False}
+
+
+def match_shard(task: tuple) -> tuple:
+    """
+    Match the trips `[start, stop)` of a file into the shard file, run in a worker.
+    """
+    input_file, city, start, stop, offset, shard_file = task
+    tic = time.perf_counter()
+    read_trips, prepare = trip_reader(city)
+    trips = itertools.takewhile(lambda trip: trip[0] < stop,
+                                read_trips(input_file, start=start, offset=offset))
+    stats = {"trips": 0, "matched": 0, "invalid": 0}
+    with open_atomic(shard_file) as f:
+        for chunk in chunked(trips, 100):
+            text, n, matched, invalid = match_chunk(mapmatcher, chunk, prepare)
+            f.write(text)
+            stats["trips"] += n
+            stats["matched"] += matched
+            stats["invalid"] += invalid
+    stats["seconds"] = time.perf_counter() - tic
+    return input_file, shard_name(start, stop), stats
+
+
+def merge_shards(manifest: dict, shard_dir: str, output_file: str, keep_shards: bool) -> None:
+    with open_atomic(output_file, "wb") as out:
+        for name in sorted(manifest["shards"]):
+            with open(os.path.join(shard_dir, name + ".jsonl"), "rb") as f:
+                shutil.copyfileobj(f, out)
+    manifest["merged"] = True
+    if not keep_shards:
+        shutil.rmtree(shard_dir)
+
+
+def shard_match(matcher, city: str, input_path: str, output_path: str, workers: int,
+                shard_size: int, keep_shards: bool = False) -> dict:
+    """
+    Match all files in `input_path` into `output_path` with `matcher` and return their manifests.
+    """
+    global mapmatcher
+    mapmatcher = matcher
+    os.makedirs(output_path, exist_ok=True)
+    manifests, tasks, paths = {}, [], {}
+    for tripfile in sorted(os.listdir(input_path)):
+        input_file = os.path.join(input_path, tripfile)
+        stem = os.path.splitext(tripfile)[0]
+        manifest_file = os.path.join(output_path, stem + ".manifest.json")
+        shard_dir = os.path.join(output_path, stem + ".shards")
+        manifest = load_manifest(manifest_file, input_file, city, shard_size, matcher.identity)
+        manifests[input_file] = manifest
+        paths[input_file] = (manifest_file, shard_dir, os.path.join(output_path, stem + ".jsonl"))
+        write_atomic(manifest_file, json.dumps(manifest, indent=2))
+        if manifest["merged"]:
+            continue
+        os.makedirs(shard_dir, exist_ok=True)
+        ## The harbin files have no offsets, their shards are read directly.
+        offsets = manifest["offsets"]
+        for start in range(0, manifest["ntrips"], shard_size):
+            stop = min(start + shard_size, manifest["ntrips"])
+            name = shard_name(start, stop)
+            shard_file = os.path.join(shard_dir, name + ".jsonl")
+            if name not in manifest["shards"] or not os.path.exists(shard_file):
+                manifest["shards"].pop(name, None)
+                offset = offsets[start // shard_size] if offsets else None
+                tasks.append((input_file, city, start, stop, offset, shard_file))
+    print(f"{len(tasks)} shards to match in {len(manifests)} files.")
+
+    def finish(input_file):
+        manifest = manifests[input_file]
+        manifest_file, shard_dir, output_file = paths[input_file]
+        nshards = (manifest["ntrips"] + shard_size - 1) // shard_size
+        if not manifest["merged"] and len(manifest["shards"]) == nshards:
+            merge_shards(manifest, shard_dir, output_file, keep_shards)
+            stats = [s for s in manifest["shards"].values()]
+            print(f"File: {input_file}, #Trips: {sum(s['trips'] for s in stats)}, "
+                  f"#Matched: {sum(s['matched'] for s in stats)}, #Invalid: {sum(s['invalid'] for s in stats)}")
+        write_atomic(manifest_file, json.dumps(manifest, indent=2))
+
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        for i, (input_file, name, stats) in enumerate(pool.imap_unordered(match_shard, tasks)):
+            print(f"Shard {i+1}/{len(tasks)} {os.path.basename(input_file)}:{name} "
+                  f"{stats['trips']} trips in {stats['seconds']:.1f} seconds", flush=True)
+            manifests[input_file]["shards"][name] = stats
+            finish(input_file)
+    for input_file in manifests:
+        finish(input_file)
+    return manifests
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match the trip files with resumable shards.")
+    parser.add_argument("--city", required=True, help="harbin, chengdu, xian or porto")
+    parser.add_argument("--input_path", default="../../trips/input", help="the directory of the trip files")
+    parser.add_argument("--output_path", default="../../trips/output", help="the output directory")
+    parser.add_argument("--config", default="fmm_config.json", help="the model configuration file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="the number of worker processes")
+    parser.add_argument("--shard_size", type=int, default=1000, help="the number of trips in a shard")
+    parser.add_argument("--keep_shards", action="store_true", help="keep the shard files after merging")
+    args = parser.parse_args()
+
+    shard_match(MapMatcher(args.config), args.city, args.input_path, args.output_path,
+                args.workers, args.shard_size, args.keep_shards)
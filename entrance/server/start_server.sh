@@ -11,7 +11,26 @@ num_workers=$3
 
 python ubodt_gen.py $city
 python fmm_config_gen.py $city
-gunicorn -w $num_workers -b 0.0.0.0:$port flask_server:app &
+rm -f server.ready
+## Give up if the server dies (its error is printed above) or is not ready within
+## `ready_timeout` seconds.
+ready_timeout=${READY_TIMEOUT:-600}
+python preload_server.py -c fmm_config.json -b 0.0.0.0:$port -w $num_workers --ready_file server.ready &
+pid=$!
+waited=0
+while [ ! -f server.ready ]; do
+    if ! kill -0 $pid 2> /dev/null; then
+        echo "The server exited before it was ready."
+        exit 1
+    fi
+    if [ $waited -ge $ready_timeout ]; then
+        echo "The server is not ready after $ready_timeout seconds."
+        kill $pid
+        exit 1
+    fi
+    sleep 1
+    waited=$((waited + 1))
+done
 
 echo "Server started and is listening at port: $port"
 echo "Test like: python flask_client.py 1236"
\ No newline at end of file
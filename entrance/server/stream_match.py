@@ -0,0 +1,191 @@
+"""
+Match a trip file to a JSON lines file without the http round trip, e.g.,
+
+    python stream_match.py --city harbin --input ../../trips/input/trips.h5 --output ../../trips/output/trips.jsonl
+
+The trips are read lazily in chunks and matched by `--workers` threads sharing one
+in-process `MapMatcher` (the matching releases the GIL), and the results are appended
+to the output in the input order as soon as their chunk is done, so the memory is
+bounded by the chunks in flight. The progress is checkpointed to `{output}.ckpt` after
+each chunk and an interrupted run resumes from the last checkpoint, unless the input file,
+the model or the split and thin options have changed since, which needs `--restart`.
+"""
+import argparse, itertools, json, os, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from artifacts import write_atomic
+from flask_mapmatcher import MapMatcher, parse_match, columns_json, file_identity
+from trip_reader import trip_reader, valid_speed
+
+## The fields written for each trip, named as the fields of `Trip` in `Trips.jl`.
+MATCH_FIELDS = ("opath", "cpath", "indices", "ratio", "spdist", "mgeom", "pgeom")
+
+
+def trip_record(i: int, trip: dict, result) -> dict:
+    """
+    The output record of trip `i` and its match result, `None` for a failed match, or the
+    columns returned by `MapMatcher.match_thinned()`.
+    """
+    if result is None:
+        parsed = {"state": 0}
+    elif isinstance(result, dict):
+        parsed = columns_json(result, MATCH_FIELDS)
+    else:
+        parsed = parse_match(result, MATCH_FIELDS)
+    record = {"id": i,
+              "devid": trip["devid"],
+              "lon": trip["lon"].tolist(),
+              "lat": trip["lat"].tolist(),
+              "tms": trip["tms"].tolist(),
+              "opath": parsed.get("opath", []),
+              "cpath": parsed.get("cpath", []),
+              "index": parsed.get("indices", []),
+              "ratio": parsed.get("ratio", []),
+              "spdist": parsed.get("spdist", []),
+              "mgeom": parsed.get("mgeom_wkt", ""),
+              "pgeom": parsed.get("pgeom_wkt", ""),
+              "state": parsed["state"] == 1}
+    for f in ("segments", "kept"):
+        if f in parsed:
+            record[f] = parsed[f]
+    record["validspeed"] = valid_speed({**record, "tms": trip["tms"]})
+    return record
+
+
+def match_chunk(mapmatcher, chunk, prepare, split=None, thin=None) -> tuple:
+    """
+    Match a chunk of `(i, trip)` and return the JSON lines with the number of trips,
+    matched trips and invalid trips. With the `split` options of `MapMatcher.match_split()`
+    the trips are matched piecewise, one thread per trip as the chunks run in parallel,
+    and with the `thin` options of `MapMatcher.match_thinned()` they are thinned first.
+    """
+    lines, matched, invalid = [], 0, 0
+    for i, trip in chunk:
+        trip = prepare(trip)
+        try:
+            if thin is not None:
+                result = mapmatcher.match_thinned(trip["lon"], trip["lat"], trip["tms"], split=split,
+                                                  n_threads=1, **thin)
+            elif split is None:
+                result = mapmatcher.match_coords(trip["lon"], trip["lat"], trip["tms"])
+            else:
+                result = mapmatcher.match_split(trip["lon"], trip["lat"], trip["tms"], n_threads=1, **split)
+        except RuntimeError:
+            result = None
+        record = trip_record(i, trip, result)
+        matched += record["state"]
+        invalid += not record["validspeed"]
+        lines.append(json.dumps(record))
+    text = "".join(line + "\n" for line in lines)
+    return text, len(chunk), matched, invalid
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_checkpoint(checkpoint_file: str, input_file: str, settings: dict):
+    """
+    Load the checkpoint of matching `input_file` with `settings`, i.e., the identities of the
+    input file and the model and the split and thin options. A checkpoint of another input
+    file is ignored, while one made with other settings is refused, as resuming it would
+    append results matched differently to the same output.
+    """
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file, "r") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("input") != os.path.abspath(input_file):
+        return None
+    names = {"input_identity": "input file", "identity": "model", "split": "split options", "thin": "thin options"}
+    changed = [names.get(key, key) for key, value in settings.items() if checkpoint.get(key) != value]
+    if changed:
+        raise ValueError(f"{checkpoint_file} was made with a different {', '.join(changed)}, "
+                         f"restart (--restart) to start over.")
+    return checkpoint
+
+
+def stream_match(mapmatcher, city: str, input_file: str, output_file: str,
+                 workers: int = 4, chunk_size: int = 100, restart: bool = False, split=None,
+                 thin=None) -> dict:
+    """
+    Match `input_file` into `output_file` resuming from its checkpoint unless `restart`,
+    and return the final checkpoint holding the statistics. A checkpoint made for another
+    version of the input file or with another model, split or thin options raises a
+    `ValueError` unless `restart`.
+    """
+    read_trips, prepare = trip_reader(city)
+    checkpoint_file = output_file + ".ckpt"
+    settings = {"input_identity": file_identity(input_file), "identity": mapmatcher.identity,
+                "split": split, "thin": thin}
+    checkpoint = None if restart else load_checkpoint(checkpoint_file, input_file, settings)
+    if checkpoint is not None and checkpoint["done"]:
+        return checkpoint
+    if checkpoint is None:
+        checkpoint = {"input": os.path.abspath(input_file), **settings, "next_trip": 0, "output_bytes": 0,
+                      "trips": 0, "matched": 0, "invalid": 0, "done": False}
+    ## Drop whatever was written after the last checkpoint.
+    with open(output_file, "ab") as out:
+        out.truncate(checkpoint["output_bytes"])
+
+    def write(out, chunk_future):
+        next_trip, future = chunk_future
+        text, n, matched, invalid = future.result()
+        out.write(text.encode())
+        out.flush()
+        os.fsync(out.fileno())
+        checkpoint.update(next_trip=next_trip, output_bytes=out.tell(), trips=checkpoint["trips"] + n,
+                          matched=checkpoint["matched"] + matched, invalid=checkpoint["invalid"] + invalid)
+        write_atomic(checkpoint_file, json.dumps(checkpoint))
+
+    with open(output_file, "ab") as out, ThreadPoolExecutor(workers) as executor:
+        inflight = deque()
+        for chunk in chunked(read_trips(input_file, start=checkpoint["next_trip"]), chunk_size):
+            inflight.append((chunk[-1][0] + 1, executor.submit(match_chunk, mapmatcher, chunk, prepare, split, thin)))
+            ## Bound the chunks in memory, the results are written in the input order.
+            if len(inflight) >= 2 * workers:
+                write(out, inflight.popleft())
+        while inflight:
+            write(out, inflight.popleft())
+    checkpoint["done"] = True
+    write_atomic(checkpoint_file, json.dumps(checkpoint))
+    return checkpoint
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match a trip file into a JSON lines file.")
+    parser.add_argument("--city", required=True, help="harbin, chengdu, xian or porto")
+    parser.add_argument("--input", required=True, help="the input trip file")
+    parser.add_argument("--output", required=True, help="the output JSON lines file")
+    parser.add_argument("--config", default="fmm_config.json", help="the model configuration file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="the number of matching threads")
+    parser.add_argument("--chunk_size", type=int, default=100, help="the number of trips in a chunk")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    parser.add_argument("--max_gap", type=float, default=0,
+                        help="split the trips at distance gaps longer than it, in map unit (0 for no split)")
+    parser.add_argument("--max_gap_time", type=float, default=0,
+                        help="split the trips at time gaps longer than it, in seconds (0 for no split)")
+    parser.add_argument("--max_points", type=int, default=0,
+                        help="split the trips into pieces of at most this many points (0 for no split)")
+    parser.add_argument("--min_dist", type=float, default=0,
+                        help="drop the points within it of the last kept point, in map unit (0 for no thinning)")
+    parser.add_argument("--min_interval", type=float, default=0,
+                        help="drop the points within it of the last kept point, in seconds (0 for no thinning)")
+    parser.add_argument("--tolerance", type=float, default=0,
+                        help="the Douglas-Peucker tolerance of thinning, in map unit (0 for no thinning)")
+    args = parser.parse_args()
+    split = {"max_gap": args.max_gap, "max_gap_time": args.max_gap_time, "max_points": args.max_points}
+    thin = {"min_dist": args.min_dist, "min_interval": args.min_interval, "tolerance": args.tolerance}
+
+    mapmatcher = MapMatcher(args.config)
+    tic = time.perf_counter()
+    stats = stream_match(mapmatcher, args.city, args.input, args.output,
+                         args.workers, args.chunk_size, args.restart,
+                         split if any(split.values()) else None, thin if any(thin.values()) else None)
+    print(f"File: {args.input}, #Trips: {stats['trips']}, #Matched: {stats['matched']}, "
+          f"#Invalid: {stats['invalid']}, {time.perf_counter() - tic:.1f} seconds")
@@ -0,0 +1,153 @@
+"""
+Thin a trajectory before matching and map the match of the kept points back to all the
+points. Dense traces, e.g., the runs of identical points of a taxi waiting at a light, cost
+k candidate searches and k x k transitions per point while adding nothing to the path, so
+only the points kept by `thin_trajectory()` are matched and `expand_columns()` gives every
+dropped point the match of its nearest kept neighbour.
+"""
+import numpy as np
+
+
+def thin_distance(x, y, min_dist: float) -> np.ndarray:
+    """
+    Drop the points closer than `min_dist` to the last kept point, which removes the
+    stationary points. The indices of the kept points are returned, the first and the
+    last points are always kept.
+    """
+    n = len(x)
+    if n <= 2:
+        return np.arange(n)
+    kept = [0]
+    xs, ys = x.tolist(), y.tolist()
+    lx, ly = xs[0], ys[0]
+    d2 = min_dist * min_dist
+    for i in range(1, n - 1):
+        if (xs[i] - lx) ** 2 + (ys[i] - ly) ** 2 >= d2:
+            kept.append(i)
+            lx, ly = xs[i], ys[i]
+    kept.append(n - 1)
+    return np.array(kept, dtype=np.int64)
+
+
+def thin_time(ts, min_interval: float) -> np.ndarray:
+    """
+    Drop the points less than `min_interval` seconds after the last kept point.
+    """
+    n = len(ts)
+    if n <= 2:
+        return np.arange(n)
+    kept = [0]
+    ts = ts.tolist()
+    last = ts[0]
+    for i in range(1, n - 1):
+        if ts[i] - last >= min_interval:
+            kept.append(i)
+            last = ts[i]
+    kept.append(n - 1)
+    return np.array(kept, dtype=np.int64)
+
+
+def douglas_peucker(x, y, tolerance: float) -> np.ndarray:
+    """
+    Simplify the trajectory with the Douglas-Peucker algorithm, a point is dropped if it
+    is within `tolerance` of the segment between the kept points around it. The distance
+    is taken to the segment rather than its line, so the U-turns are kept.
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = n > 0
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        px, py = x[a+1:b] - x[a], y[a+1:b] - y[a]
+        seg2 = dx * dx + dy * dy
+        t = np.clip((px * dx + py * dy) / seg2, 0.0, 1.0) if seg2 > 0 else 0.0
+        d = np.hypot(px - t * dx, py - t * dy)
+        i = int(np.argmax(d))
+        if d[i] > tolerance:
+            m = a + 1 + i
+            keep[m] = True
+            stack += [(a, m), (m, b)]
+    return np.flatnonzero(keep)
+
+
+def thin_trajectory(x, y, ts=None, min_dist: float = 0, min_interval: float = 0,
+                    tolerance: float = 0) -> np.ndarray:
+    """
+    The indices of the points kept by the enabled rules (a value of 0 disables a rule),
+    applied in the order distance, time and Douglas-Peucker. The time rule is ignored
+    without timestamps.
+    """
+    kept = np.arange(len(x))
+    if min_dist > 0:
+        kept = kept[thin_distance(x[kept], y[kept], min_dist)]
+    if min_interval > 0 and ts is not None:
+        kept = kept[thin_time(ts[kept], min_interval)]
+    if tolerance > 0 and len(kept) > 2:
+        kept = kept[douglas_peucker(x[kept], y[kept], tolerance)]
+    return kept
+
+
+def representatives(x, y, kept) -> np.ndarray:
+    """
+    The position in `kept` of the kept point representing each point, which is the
+    point itself if kept, otherwise the nearer of the kept points before and after it.
+    """
+    i = np.arange(len(x))
+    after = np.searchsorted(kept, i)
+    before = np.maximum(after - 1, 0)
+    ka, kb = kept[after], kept[before]
+    nearer_after = np.hypot(x - x[ka], y - y[ka]) < np.hypot(x - x[kb], y - y[kb])
+    return np.where((ka == i) | nearer_after, after, before)
+
+
+def expand_columns(columns: dict, x, y, kept) -> dict:
+    """
+    Map the columns of the match of the points `kept` (see `match_columns()`) back to all
+    the `len(x)` points. The per point fields `opath`, `indices`, `offset`, `length`,
+    `ratio` and `pgeom` of a dropped point are those of its representative; the `spdist`
+    of a kept point is spread over it and the points dropped before it in proportion to
+    their steps (evenly if none of them moves), so that the total distance is kept and the
+    stationary points do not move. `cpath` and `mgeom` are unchanged, the `segments` of a
+    split match are mapped to the original points and `kept` holds the indices of the
+    points matched.
+    """
+    if columns["state"] == 0:
+        return columns
+    n = len(x)
+    ## Only the points of the matched segments are in the per point fields of a split match.
+    matched = np.ones(len(kept), dtype=bool)
+    expanded = dict(columns)
+    if "segments" in columns:
+        segments = np.array(columns["segments"], dtype=np.int64).reshape(-1, 6)
+        matched[:] = False
+        for start, end, _, _, state, _ in segments.tolist():
+            matched[start:end] = state == 1
+        ## A segment covers the points dropped before its first point.
+        starts = np.where(segments[:, 0] > 0, kept[np.maximum(segments[:, 0] - 1, 0)] + 1, 0)
+        ends = np.where(segments[:, 1] > 0, kept[np.maximum(segments[:, 1] - 1, 0)] + 1, 0)
+        segments[:, 0], segments[:, 1] = starts, ends
+        expanded["segments"] = segments.ravel()
+    position = np.cumsum(matched) - 1
+    rep = representatives(x, y, kept)
+    points = matched[rep]
+    index = position[rep[points]]
+    for f in ("opath", "indices", "offset", "length", "ratio"):
+        if f in columns:
+            expanded[f] = columns[f][index]
+    if "pgeom" in columns:
+        expanded["pgeom"] = np.reshape(columns["pgeom"], (-1, 2))[index].ravel()
+    if "spdist" in columns:
+        owner = np.searchsorted(kept, np.arange(n))
+        step = np.concatenate(([0.0], np.hypot(np.diff(x), np.diff(y))))
+        total = np.bincount(owner, step, minlength=len(kept))
+        run = np.diff(np.concatenate(([-1], kept)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            share = np.where(total[owner] > 0, step / total[owner], 1.0 / run[owner])
+        spdist = np.where(matched[owner], columns["spdist"][position[owner]] * share, 0.0)
+        expanded["spdist"] = spdist[points]
+    expanded["kept"] = np.asarray(kept, dtype=np.int64)
+    return expanded
@@ -0,0 +1,108 @@
+"""
+Split the network of a metro-scale region into overlapping tiles, each with its own
+network snapshot and UBODT, so that `TiledMapMatcher` loads only the tiles the
+trajectories touch instead of the whole region.
+
+The region is cut into square cores of `--tile_size`. A tile holds the edges within
+`--margin` of its core together with all the edges reachable from them within `--delta`,
+so the UBODT of the tile has the same shortest paths as that of the whole network for
+the nodes near its core. A trajectory whose points stay within `margin - r` of a core
+is matched on its tile exactly as on the whole network, r being the search radius.
+
+    python tile_gen.py porto --tile_size 0.1 --margin 0.02 --delta 0.03
+
+writes `../data/cities/porto/tiles/{ix}_{iy}.snap`, `{ix}_{iy}.mmap`, the configuration
+`{ix}_{iy}.json` of each tile and the manifest `tiles.json`.
+"""
+import argparse, json, math, os, time
+from fmm import Network, NetworkGraph, UBODTGenAlgorithm, UBODT
+from artifacts import (snapshot_options, tiles_options, ubodt_options, is_valid, remove_meta,
+                       write_meta)
+
+parser = argparse.ArgumentParser(description="Split the network of a city into tiles with their own UBODT.")
+parser.add_argument("city", help="the city in ../data/cities, e.g., porto")
+parser.add_argument("--network_file", default=None, help="the network, ../data/cities/{city}/edges.shp by default")
+parser.add_argument("--id", default="fid", help="the id field of the network")
+parser.add_argument("--source", default="u", help="the source field of the network")
+parser.add_argument("--target", default="v", help="the target field of the network")
+parser.add_argument("--tile_size", type=float, default=0.1, help="the side of the core of a tile in degrees")
+parser.add_argument("--margin", type=float, default=0.02,
+                    help="the edges within the margin of a core are in its tile, larger than the search radius r")
+parser.add_argument("--delta", type=float, default=0.03, help="the upper bound of the UBODT in degrees")
+parser.add_argument("--output", default=None, help="the directory of the tiles, ../data/cities/{city}/tiles by default")
+parser.add_argument("--force", action="store_true", help="regenerate the tiles even if they are valid")
+args = parser.parse_args()
+city = args.city
+assert os.path.exists(f"../data/cities/{city}"), f"{city} is not found in ../data/cities"
+assert args.tile_size > 0 and args.margin > 0 and args.delta > 0, "tile_size, margin and delta should be positive"
+
+network_file = args.network_file or f"../data/cities/{city}/edges.shp"
+output = args.output or f"../data/cities/{city}/tiles"
+manifest_file = os.path.join(output, "tiles.json")
+options = tiles_options(args.id, args.source, args.target, args.tile_size, args.margin, args.delta)
+if not args.force and is_valid(manifest_file, network_file, options):
+    print(f"The tiles of city {city} are up to date, skip generating them.")
+    raise SystemExit(0)
+
+os.makedirs(output, exist_ok=True)
+# The manifest is written last, so an interrupted generation is never taken as valid.
+remove_meta(manifest_file)
+tic = time.perf_counter()
+snapshot_file = os.path.splitext(network_file)[0] + ".snap"
+if is_valid(snapshot_file, network_file, snapshot_options(args.id, args.source, args.target)):
+    network = Network(snapshot_file, args.id, args.source, args.target)
+else:
+    network = Network(network_file, args.id, args.source, args.target)
+graph = NetworkGraph(network)
+print(network.get_node_count())
+print(network.get_edge_count())
+
+min_x = min_y = math.inf
+max_x = max_y = -math.inf
+for i in range(network.get_edge_count()):
+    coords = network.get_edge_geom(network.get_edge_id(i)).export_coords()
+    min_x, max_x = min(min_x, min(coords[0::2])), max(max_x, max(coords[0::2]))
+    min_y, max_y = min(min_y, min(coords[1::2])), max(max_y, max(coords[1::2]))
+nx = max(1, math.ceil((max_x - min_x) / args.tile_size))
+ny = max(1, math.ceil((max_y - min_y) / args.tile_size))
+print(f"Splitting the network into {nx} x {ny} tiles of {args.tile_size} degrees")
+
+tiles = {}
+for ix in range(nx):
+    for iy in range(ny):
+        x0, y0 = min_x + ix * args.tile_size, min_y + iy * args.tile_size
+        core_edges = network.get_edges_in_box(x0 - args.margin, y0 - args.margin,
+                                              x0 + args.tile_size + args.margin,
+                                              y0 + args.tile_size + args.margin)
+        if len(core_edges) == 0:
+            continue
+        name = f"{ix}_{iy}"
+        tile_snapshot = os.path.join(output, f"{name}.snap")
+        tile_ubodt = os.path.join(output, f"{name}.bin")
+        tile_mmap = os.path.join(output, f"{name}.mmap")
+        # Every shortest path within delta from a node of the core edges stays in the tile.
+        edges = graph.get_edges_within_dist(core_edges, args.delta)
+        tile = network.extract(edges)
+        tile.save_snapshot(tile_snapshot)
+        tile_graph = NetworkGraph(tile)
+        UBODTGenAlgorithm(tile, tile_graph).generate_ubodt(tile_ubodt, args.delta, binary=True, use_omp=True)
+        UBODT.read_ubodt_file(tile_ubodt).write_mmap_file(tile_mmap)
+        os.remove(tile_ubodt)
+        # The UBODT is checked against the tile snapshot by `MapMatcher`.
+        write_meta(tile_mmap, tile_snapshot, ubodt_options(args.id, args.source, args.target, args.delta))
+        # The parameters are given by the configuration of the region.
+        with open(os.path.join(output, f"{name}.json"), "w") as f:
+            json.dump({"input": {"network": {"file": tile_snapshot, "id": args.id,
+                                             "source": args.source, "target": args.target},
+                                 "ubodt": {"file": tile_mmap}},
+                       "model": "fmm"}, f, indent=2)
+        tiles[name] = {"edges": len(edges),
+                       "bytes": os.path.getsize(tile_snapshot) + os.path.getsize(tile_mmap)}
+        print(f"Tile {name} with {len(core_edges)} core edges and {len(edges)} edges")
+
+with open(manifest_file, "w") as f:
+    json.dump({"version": options["tiles"], "origin": [min_x, min_y], "nx": nx, "ny": ny,
+               "tile_size": args.tile_size, "margin": args.margin, "delta": args.delta,
+               "tiles": tiles}, f, indent=2)
+write_meta(manifest_file, network_file, options, time.perf_counter() - tic)
+print(f"{len(tiles)} tiles of {sum(t['bytes'] for t in tiles.values())} bytes written to {output}")
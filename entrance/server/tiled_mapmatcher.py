@@ -0,0 +1,293 @@
+"""
+Map matching over a metro-scale region split into overlapping tiles by `tile_gen.py`.
+Only the tiles touched by the trajectories are loaded and the resident tiles are kept
+by a `CityPool` under a memory budget, the least recently used ones are evicted.
+
+The candidates of a point within `margin - r` of the core of a tile are all in the tile
+and so are the shortest paths within the UBODT delta between them, so a trajectory within
+that reach of one tile is matched on it exactly as on the whole network. A trajectory
+crossing the tiles is cut into pieces each within the reach of a tile, a piece reaches a
+few points back into the previous one and the results of the pieces are stitched by
+`stitch_tiles` of fmm where they agree, in the same way as `MapMatcher.match_split()`, so
+it may differ from the whole network near the joins. The tiles should be much larger than
+the trajectories for most of them to stay within one tile.
+"""
+import json, math, os, threading
+import numpy as np
+from fmm import FastMapMatchConfig, PyMatchResult, stitch_tiles
+from city_pool import CityPool
+from flask_mapmatcher import MapMatcher, file_identity, float64_array
+from match_cache import wkt_coords
+
+## The number of points a piece reaches back into the previous one, where they are stitched.
+TILE_OVERLAP = 8
+
+
+def is_tiled(config_file: str) -> bool:
+    """
+    Return true if `config_file` configures a region split into tiles.
+    """
+    with open(config_file, "r") as f:
+        return "tiles" in json.load(f)["input"]
+
+
+def run_length(mask: np.ndarray) -> int:
+    """
+    The number of leading true values of `mask`.
+    """
+    return len(mask) if mask.all() else int(np.argmin(mask))
+
+
+class TiledMapMatcher(MapMatcher):
+    """
+    The map matcher of a region split into tiles, which is configured as
+        {"input": {"tiles": {"file": "../data/cities/porto/tiles/tiles.json", "memory_budget": 2048}},
+         "model": "fmm", "parameters": {"k": 8, "r": 0.003, "e": 0.0005}}
+    where `memory_budget` (MB, 0 for no limit) bounds the resident tiles unless `memory_budget`
+    (bytes) is given. Online matching sessions and the shortest path fallback are not supported.
+    """
+    def __init__(self, config_file, memory_budget: int = None) -> None:
+        with open(config_file, "r") as f:
+            params = json.load(f)
+        if params["model"] != "fmm":
+            raise ValueError("Only the fmm model is supported with tiles.")
+        manifest_file = params["input"]["tiles"]["file"]
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+
+        self.parameters = params["parameters"]
+        self.mm_config = FastMapMatchConfig()
+        self.mm_config.k = params["parameters"]["k"]
+        self.mm_config.radius = params["parameters"]["r"]
+        self.mm_config.gps_error = params["parameters"]["e"]
+        self.origin = manifest["origin"]
+        self.tile_size = manifest["tile_size"]
+        self.names = set(manifest["tiles"])
+        ## The distance from the core of a tile within which a point is matched on it.
+        self.reach = manifest["margin"] - self.mm_config.radius
+        if self.reach <= 0:
+            raise ValueError(f"The search radius {self.mm_config.radius} should be smaller than the margin "
+                             f"{manifest['margin']} of the tiles, regenerate them with tile_gen.py.")
+        if memory_budget is None:
+            memory_budget = int(float(params["input"]["tiles"].get("memory_budget", 0)) * 1024 * 1024)
+        ## The tiles are loaded from `{ix}_{iy}.json` next to the manifest.
+        self.tiles = CityPool(os.path.dirname(manifest_file), memory_budget, loader=self.load_tile)
+
+        self.model = None
+        self.load_timings = {}
+        self.identity = json.dumps({"model": "fmm", "parameters": params["parameters"],
+                                    "files": [file_identity(manifest_file)]}, sort_keys=True)
+        self.observer = None
+        ## The tiered matching of `MapMatcher` is not supported with tiles.
+        self.tiers = []
+        self.stats_enabled = False
+        ## The trajectories matched on one tile and across tiles, the pieces of the latter and
+        ## the trajectories with a point out of the reach of any tile.
+        self.counters = {"single": 0, "stitched": 0, "pieces": 0, "uncovered": 0}
+        self.lock = threading.Lock()
+
+    def load_tile(self, config_file: str) -> MapMatcher:
+        matcher = MapMatcher(config_file, self.parameters)
+        if self.stats_enabled:
+            matcher.model.set_stats_enabled(True)
+        return matcher
+
+    def enable_stats(self, observer=None, tier_observer=None) -> None:
+        self.stats_enabled = True
+        self.observer = observer
+        with self.tiles.lock:
+            loaded = [entry["matcher"] for entry in self.tiles.cities.values()]
+        for matcher in loaded:
+            matcher.model.set_stats_enabled(True)
+
+    def enable_sp_fallback(self, delta: float, capacity: int = 100000) -> None:
+        raise ValueError("The shortest path fallback is not supported with tiles.")
+
+    def open_session(self, max_window: int = 32):
+        raise ValueError("Online matching sessions are not supported with tiles.")
+
+    def tile_stats(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+        return dict(counters, tiles=len(self.names), resident=self.tiles.stats())
+
+    def count(self, pieces: list) -> None:
+        with self.lock:
+            if any(name is None for _, _, name in pieces):
+                self.counters["uncovered"] += 1
+            if len(pieces) == 1:
+                self.counters["single"] += 1
+            elif len(pieces) > 1:
+                self.counters["stitched"] += 1
+                self.counters["pieces"] += len(pieces)
+
+    def covering(self, x: float, y: float) -> list:
+        """
+        The tiles within whose reach the point is, the tile of its own core first.
+        """
+        fx = (x - self.origin[0]) / self.tile_size
+        fy = (y - self.origin[1]) / self.tile_size
+        r = self.reach / self.tile_size
+        home = f"{math.floor(fx)}_{math.floor(fy)}"
+        names = [f"{ix}_{iy}" for ix in range(math.floor(fx - r), math.floor(fx + r) + 1)
+                 for iy in range(math.floor(fy - r), math.floor(fy + r) + 1)]
+        names.sort(key=lambda name: name != home)
+        return [name for name in names if name in self.names]
+
+    def inside(self, name: str, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """
+        Whether each point is within the reach of the tile `name`.
+        """
+        ix, iy = map(int, name.split("_"))
+        x0 = self.origin[0] + ix * self.tile_size
+        y0 = self.origin[1] + iy * self.tile_size
+        return ((lon >= x0 - self.reach) & (lon <= x0 + self.tile_size + self.reach) &
+                (lat >= y0 - self.reach) & (lat <= y0 + self.tile_size + self.reach))
+
+    def plan(self, lon, lat, ts=None, max_gap: float = 0, max_gap_time: float = 0,
+             max_points: int = 0) -> list:
+        """
+        Cut a trajectory into the pieces `(start, end, tile)` each within the reach of its
+        tile, the tile is None for a point out of the reach of any tile. A piece goes as far
+        as any tile reaches, reaches back up to `TILE_OVERLAP` points into the previous one
+        and follows the split rules of `MapMatcher.match_split()`: it ends before the gaps,
+        where it does not reach back, and has at most `max_points` points, overlapping the
+        previous one by a quarter of them.
+        """
+        n = len(lon)
+        if len(lat) != n or (ts is not None and len(ts) != n):
+            raise ValueError("The coordinates and the timestamps should have the same length.")
+        gaps = np.zeros(n, dtype=bool)
+        if max_gap > 0:
+            gaps[1:] |= np.hypot(np.diff(lon), np.diff(lat)) > max_gap
+        if ts is not None and max_gap_time > 0:
+            gaps[1:] |= np.diff(ts) > max_gap_time
+        gap_points = np.flatnonzero(gaps)
+        overlap = max(1, max_points // 4) if max_points > 0 else TILE_OVERLAP
+        pieces = []
+        anchor = 0
+        while anchor < n:
+            ## The piece holds `anchor`, the first point not in the previous piece.
+            i = np.searchsorted(gap_points, anchor, side="right")
+            stop = gap_points[i] if i < len(gap_points) else n
+            joined = len(pieces) > 0 and pieces[-1][2] is not None and not gaps[anchor]
+            lo = max(pieces[-1][0] + 1, anchor - overlap) if joined else anchor
+            best = None
+            for name in self.covering(lon[anchor], lat[anchor]):
+                mask = self.inside(name, lon[lo:stop], lat[lo:stop])
+                forward = run_length(mask[anchor-lo:])
+                backward = run_length(mask[anchor-lo-1::-1]) if anchor > lo else 0
+                if best is None or (forward, backward) > best[:2]:
+                    best = (forward, backward, name)
+            if best is None:
+                pieces.append((anchor, anchor + 1, None))
+                anchor += 1
+                continue
+            forward, backward, name = best
+            start, end = anchor - backward, anchor + forward
+            if max_points > 0:
+                end = min(end, max(start + max_points, anchor + 1))
+            pieces.append((start, end, name))
+            anchor = end
+        return pieces
+
+    def match_pieces(self, lon, lat, ts, pieces: list) -> PyMatchResult:
+        """
+        Match each piece on its tile and stitch their results.
+        """
+        results, networks, matchers = [], [], []
+        for start, end, name in pieces:
+            if name is None:
+                results.append(PyMatchResult())
+                networks.append(None)
+                continue
+            ## The matchers are held until the results are stitched, even if evicted meanwhile.
+            matcher = self.tiles.get(name)
+            matchers.append(matcher)
+            piece_ts = b"" if ts is None else np.ascontiguousarray(ts[start:end])
+            results.append(matcher.model.match_coords(np.ascontiguousarray(lon[start:end]),
+                                                      np.ascontiguousarray(lat[start:end]),
+                                                      piece_ts, self.mm_config))
+            networks.append(matcher.network)
+        if not matchers:
+            return PyMatchResult()
+        ## The network of a failed piece is never used.
+        networks = [matchers[0].network if network is None else network for network in networks]
+        return stitch_tiles(results, [start for start, _, _ in pieces], [end for _, end, _ in pieces],
+                            lon, lat, networks)
+
+    def match_arrays(self, lon: np.ndarray, lat: np.ndarray, ts: np.ndarray = None) -> PyMatchResult:
+        lon, lat = np.ascontiguousarray(lon), np.ascontiguousarray(lat)
+        ts = None if ts is None else np.ascontiguousarray(ts)
+        pieces = self.plan(lon, lat, ts)
+        self.count(pieces)
+        ## A point without candidates fails the whole trajectory as on the whole network.
+        if len(pieces) == 0 or any(name is None for _, _, name in pieces):
+            return PyMatchResult()
+        if len(pieces) == 1:
+            return self.tiles.get(pieces[0][2]).model.match_coords(
+                lon, lat, b"" if ts is None else ts, self.mm_config)
+        result = self.match_pieces(lon, lat, ts, pieces)
+        if any(segment.state == 0 for segment in result.segments):
+            return PyMatchResult()
+        return result
+
+    def match_wkt(self, gps_wkt: str):
+        try:
+            lon, lat = wkt_coords(gps_wkt)
+        except ValueError:
+            return self.observed(PyMatchResult())
+        return self.observed(self.match_arrays(lon, lat))
+
+    def match_coords(self, lon, lat, ts=None):
+        lon, lat = float64_array(lon), float64_array(lat)
+        ts = None if ts is None else float64_array(ts)
+        return self.observed(self.match_arrays(lon, lat, ts))
+
+    def match_batch(self, gps_wkts, n_threads: int = 0):
+        """
+        Match a list of WKT trajectories, those within the reach of one tile are matched in
+        a batch of the tile by `n_threads` native threads and the others one by one.
+        """
+        gps_wkts = list(gps_wkts)
+        results = [None] * len(gps_wkts)
+        batches = {}
+        for i, gps_wkt in enumerate(gps_wkts):
+            try:
+                lon, lat = wkt_coords(gps_wkt)
+            except ValueError as e:
+                results[i] = PyMatchResult()
+                results[i].error = str(e)
+                continue
+            pieces = self.plan(lon, lat)
+            if len(pieces) == 1 and pieces[0][2] is not None:
+                self.count(pieces)
+                batches.setdefault(pieces[0][2], []).append(i)
+            else:
+                results[i] = self.match_arrays(lon, lat)
+        for name, indices in batches.items():
+            matched = self.tiles.get(name).model.match_batch([gps_wkts[i] for i in indices],
+                                                             self.mm_config, n_threads)
+            for i, result in zip(indices, matched):
+                results[i] = result
+        for result in results:
+            self.observed(result)
+        return results
+
+    def match_split(self, lon, lat, ts=None, max_gap: float = 0, max_gap_time: float = 0,
+                    max_points: int = 0, n_threads: int = 0):
+        """
+        Match a trajectory piecewise like `MapMatcher.match_split()`, a trajectory within the
+        reach of one tile is split and matched by the tile with `n_threads` native threads,
+        the pieces of the others are matched one by one on their tiles.
+        """
+        lon, lat = np.ascontiguousarray(float64_array(lon)), np.ascontiguousarray(float64_array(lat))
+        ts = None if ts is None else np.ascontiguousarray(float64_array(ts))
+        pieces = self.plan(lon, lat, ts)
+        if len(pieces) == 1 and pieces[0][2] is not None:
+            self.count(pieces)
+            return self.observed(self.tiles.get(pieces[0][2]).match_split(
+                lon, lat, ts, max_gap, max_gap_time, max_points, n_threads))
+        pieces = self.plan(lon, lat, ts, max_gap, max_gap_time, max_points)
+        self.count(pieces)
+        return self.observed(self.match_pieces(lon, lat, ts, pieces))
@@ -0,0 +1,174 @@
+"""
+Lazy readers of the trip files in `trips/input`, the Python counterparts of `readtripsgaia`,
+`readtripsharbin` and `readtripsporto` in `Trips/src/tripUtils.jl`. Each reader yields
+`(i, trip)` where `i` is the ordinal of the trip in the file and `trip` is a dict with
+the numpy arrays `lon`, `lat`, `tms` and the int `devid`; trips with less than 2 points
+are dropped but still counted in `i`, so that `start=i` resumes right after trip `i-1`.
+The csv readers parse every row before trip `start` unless they are also given its byte
+`offset` from `trip_offsets()`, where they seek to.
+"""
+import csv, itertools, json
+import numpy as np
+from gcjwgs import gcj2wgsArray
+
+## The bound (min_lon, max_lon, min_lat, max_lat) of the porto network.
+PORTO_BOUND = (-8.7015, -8.5302, 40.0990, 41.2082)
+## The columns of the gaia csv files, which have no header line.
+GAIA_HEADER = ("devid", "tripid", "tms", "lon", "lat")
+
+
+def make_trip(lon, lat, tms, devid=-1) -> dict:
+    return {"lon": np.asarray(lon, dtype=np.float64),
+            "lat": np.asarray(lat, dtype=np.float64),
+            "tms": np.asarray(tms, dtype=np.float64),
+            "devid": int(devid)}
+
+
+def read_trips_gaia(tripfile: str, start: int = 0, header=GAIA_HEADER, offset: int = None):
+    """
+    Read trips from a gaia csv file without a header line, whose columns are `header`.
+    The rows of a trip are expected to be contiguous in the file, which is how the gaia
+    files are laid out, so that only one trip is kept in memory.
+    """
+    with open(tripfile, "r", newline="") as f:
+        if offset is not None:
+            f.seek(offset)
+        rows = csv.DictReader(f, fieldnames=header)
+        groups = itertools.groupby(rows, key=lambda row: row["tripid"])
+        for i, (_, group) in enumerate(groups, start=0 if offset is None else start):
+            if i < start:
+                continue
+            group = sorted(group, key=lambda row: float(row["tms"]))
+            lon = [float(row["lon"]) for row in group]
+            lat = [float(row["lat"]) for row in group]
+            tms = [float(row["tms"]) + 8*3600.0 for row in group] # (GMT+8)
+            devid = int(group[0]["devid"]) if "devid" in header else -1
+            if len(lon) >= 2:
+                yield i, make_trip(lon, lat, tms, devid)
+
+
+def read_trips_harbin(tripfile: str, start: int = 0, offset: int = None):
+    """
+    Read trips from a harbin hdf5 file holding `/meta/ntrips` and `/trip/{i}/{lon,lat,tms}`,
+    which are read directly so `offset` is not used.
+    """
+    import h5py
+    with h5py.File(tripfile, "r") as f:
+        ntrips = int(f["/meta/ntrips"][()])
+        for i in range(start, ntrips):
+            lon = f[f"/trip/{i+1}/lon"][()]
+            lat = f[f"/trip/{i+1}/lat"][()]
+            tms = f[f"/trip/{i+1}/tms"][()]
+            if len(lon) >= 2:
+                yield i, make_trip(lon, lat, tms)
+
+
+def read_trips_porto(tripfile: str, start: int = 0, bound=PORTO_BOUND, offset: int = None):
+    """
+    Read trips from the porto csv file whose column POLYLINE holds the points sampled
+    every 15 seconds from TIMESTAMP; the trips with missing data or outside `bound`
+    are dropped.
+    """
+    with open(tripfile, "r", newline="") as f:
+        fieldnames = next(csv.reader([f.readline()]))
+        if offset is not None:
+            f.seek(offset)
+        rows = csv.DictReader(f, fieldnames=fieldnames)
+        for i, row in enumerate(rows, start=0 if offset is None else start):
+            if i < start or row["MISSING_DATA"].strip().lower() == "true":
+                continue
+            try:
+                points = np.array(json.loads(row["POLYLINE"]), dtype=np.float64).reshape(-1, 2)
+            except ValueError:
+                continue
+            if len(points) < 2:
+                continue
+            lon, lat = points[:, 0], points[:, 1]
+            if bound is not None:
+                min_lon, max_lon, min_lat, max_lat = bound
+                if not np.all((min_lon <= lon) & (lon <= max_lon) & (min_lat <= lat) & (lat <= max_lat)):
+                    continue
+            tms = float(row["TIMESTAMP"]) + np.arange(len(lon)) * 15.0
+            yield i, make_trip(lon, lat, tms, row["TAXI_ID"])
+
+
+def csv_rows(f):
+    """
+    Yield the byte offset and the fields of each line of a csv file opened in binary mode,
+    the trip files have no line breaks within a field.
+    """
+    offset = f.tell()
+    for line in f:
+        yield offset, next(csv.reader([line.decode()]))
+        offset += len(line)
+
+
+def trip_offsets(tripfile: str, reader, every: int = 1, header=GAIA_HEADER) -> tuple:
+    """
+    The number of trips in `tripfile` for `reader`, i.e., the bound of the ordinals `i`
+    yielded by the reader, and the byte offsets of the trips 0, `every`, 2 * `every`, ...
+    to be passed to the reader with `start`; they are found without parsing the points.
+    The offsets are None for the harbin files, which are read directly.
+    """
+    if reader is read_trips_harbin:
+        import h5py
+        with h5py.File(tripfile, "r") as f:
+            return int(f["/meta/ntrips"][()]), None
+    with open(tripfile, "rb") as f:
+        if reader is read_trips_gaia:
+            column = header.index("tripid")
+            trips = (next(rows)[0] for _, rows in
+                     itertools.groupby(csv_rows(f), key=lambda row: row[1][column]))
+        elif reader is read_trips_porto:
+            f.readline()
+            trips = (offset for offset, _ in csv_rows(f))
+        else:
+            raise ValueError(f"Unsupported reader {reader}.")
+        offsets = []
+        ntrips = 0
+        for ntrips, offset in enumerate(trips, start=1):
+            if (ntrips - 1) % every == 0:
+                offsets.append(offset)
+    return ntrips, offsets
+
+
+def count_trips(tripfile: str, reader, header=GAIA_HEADER) -> int:
+    """
+    The number of trips in `tripfile` for `reader`, which is counted without parsing the points.
+    """
+    return trip_offsets(tripfile, reader, header=header)[0]
+
+
+def gcj2wgs_trip(trip: dict) -> dict:
+    """
+    Convert the coordinates of `trip` from GCJ-02 to WGS-84 in place, like `gcj2wgs!`,
+    it uses the one step inverse so that the results agree with the Julia client.
+    """
+    trip["lat"], trip["lon"] = gcj2wgsArray(trip["lat"], trip["lon"])
+    return trip
+
+
+def trip_reader(city: str):
+    """
+    Return the reader and the preparation function for the trips of `city`.
+    """
+    if city in ("chengdu", "xian"):
+        return read_trips_gaia, gcj2wgs_trip
+    if city == "harbin":
+        return read_trips_harbin, lambda trip: trip
+    if city == "porto":
+        return read_trips_porto, lambda trip: trip
+    raise ValueError(f"Unsupported city {city}.")
+
+
+def valid_speed(trip: dict, max_speed: float = 35) -> bool:
+    """
+    Return true if the trip is matched and its maximum speed does not exceed `max_speed`,
+    the same as `validspeed` in `tripUtils.jl`.
+    """
+    if not trip["state"] or len(trip["spdist"]) < 2:
+        return False
+    delta = np.diff(trip["tms"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.asarray(trip["spdist"][1:]) * 10000 / delta
+    return bool(np.max(speed) < max_speed)
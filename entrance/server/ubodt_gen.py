@@ -1,21 +1,77 @@
-import os, sys
-from fmm import Network, NetworkGraph, UBODTGenAlgorithm
+import argparse, os, time
+from fmm import Network, NetworkGraph, UBODTGenAlgorithm, UBODT, CandidateIndex
+from artifacts import (ubodt_options, snapshot_options, candidate_index_options, is_valid, remove_meta,
+                       write_meta)
 
 #for city in os.listdir("../data/cities/"):
 
-assert len(sys.argv) > 1, "Please provide the city name like, python ubodt_gen.py harbin"
-city = sys.argv[1]
+parser = argparse.ArgumentParser(description="Generate the UBODT of a city unless the existing one is still valid.")
+parser.add_argument("city", help="the city in ../data/cities, e.g., harbin")
+# The delta is defined as 3 km approximately. 0.03 degrees.
+parser.add_argument("--delta", type=float, default=0.03, help="the upper bound of the UBODT in degrees")
+parser.add_argument("--radius", type=float, default=None,
+                    help="also build the candidate index for the search radius r of the city, e.g., 0.01")
+parser.add_argument("--cell_size", type=float, default=0,
+                    help="the cell size of the candidate index, half of the radius by default")
+parser.add_argument("--force", action="store_true", help="regenerate the UBODT even if it is valid")
+args = parser.parse_args()
+city = args.city
 assert os.path.exists(f"../data/cities/{city}"), f"{city} is not found in ../data/cities"
 
-print(f"Generating ubodt for city {city}...")
-network = Network(f"../data/cities/{city}/edges.shp", "fid", "u", "v")
-print(network.get_node_count())
-print(network.get_edge_count())
-graph = NetworkGraph(network)
-
-# Can be skipped if you already generated an ubodt file
-ubodt_gen = UBODTGenAlgorithm(network, graph)
-# The delta is defined as 3 km approximately. 0.03 degrees. 
-status = ubodt_gen.generate_ubodt(f"../data/cities/{city}/ubodt.bin", 0.03, binary=True, use_omp=True)
-# Binary is faster for both IO and precomputation
-print(status)
\ No newline at end of file
+network_file = f"../data/cities/{city}/edges.shp"
+snapshot_file = f"../data/cities/{city}/edges.snap"
+ubodt_file = f"../data/cities/{city}/ubodt.bin"
+mmap_file = f"../data/cities/{city}/ubodt.mmap"
+index_file = f"../data/cities/{city}/candidates.idx"
+options = ubodt_options("fid", "u", "v", args.delta)
+index_options = candidate_index_options("fid", "u", "v", args.radius, args.cell_size)
+
+# The files are keyed on the network files and the options, so a restart reuses them.
+need_snapshot = args.force or not is_valid(snapshot_file, network_file, snapshot_options("fid", "u", "v"))
+need_ubodt = args.force or not is_valid(ubodt_file, network_file, options)
+need_mmap = need_ubodt or not is_valid(mmap_file, network_file, options)
+need_index = args.radius is not None and (args.force or not is_valid(index_file, network_file, index_options))
+if not (need_snapshot or need_ubodt or need_mmap or need_index):
+    print(f"The ubodt for city {city} is up to date, skip generating it.")
+
+if need_snapshot or need_ubodt or need_index:
+    network = Network(network_file, "fid", "u", "v")
+    print(network.get_node_count())
+    print(network.get_edge_count())
+
+if need_snapshot:
+    # The snapshot is loaded by the server in place of the shapefile, without GDAL.
+    remove_meta(snapshot_file)
+    tic = time.perf_counter()
+    network.save_snapshot(snapshot_file)
+    write_meta(snapshot_file, network_file, snapshot_options("fid", "u", "v"), time.perf_counter() - tic)
+
+if need_ubodt:
+    print(f"Generating ubodt for city {city}...")
+    remove_meta(ubodt_file)
+    tic = time.perf_counter()
+    graph = NetworkGraph(network)
+    ubodt_gen = UBODTGenAlgorithm(network, graph)
+    status = ubodt_gen.generate_ubodt(ubodt_file, args.delta, binary=True, use_omp=True)
+    # Binary is faster for both IO and precomputation
+    print(status)
+    write_meta(ubodt_file, network_file, options, time.perf_counter() - tic)
+
+if need_mmap:
+    # Convert it into the flat mmap format, which is memory-mapped by the server workers
+    # so that they share one copy of the table and start without rebuilding the hashtable.
+    remove_meta(mmap_file)
+    tic = time.perf_counter()
+    ubodt = UBODT.read_ubodt_file(ubodt_file)
+    ubodt.write_mmap_file(mmap_file)
+    write_meta(mmap_file, network_file, options, time.perf_counter() - tic)
+
+if need_index:
+    # The edges near each grid cell, which the server searches in place of the rtree for
+    # any radius up to args.radius.
+    remove_meta(index_file)
+    tic = time.perf_counter()
+    index = CandidateIndex.build(network, args.radius, args.cell_size)
+    index.write(index_file)
+    print(f"Candidate index with {index.get_num_cells()} cells and {index.get_num_entries()} entries")
+    write_meta(index_file, network_file, index_options, time.perf_counter() - tic)
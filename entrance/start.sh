@@ -14,7 +14,28 @@ cd server
 
 python ubodt_gen.py $city
 python fmm_config_gen.py $city
-gunicorn -w $num_workers -b 0.0.0.0:$port flask_server:app &> "$city-log.txt" &
+## The model is loaded once and shared by the forked workers, wait until it is ready.
+rm -f "$city.ready"
+## Give up if the server dies (e.g., a bad configuration, a stale UBODT or the port in use)
+## or is not ready within `ready_timeout` seconds.
+ready_timeout=${READY_TIMEOUT:-600}
+python preload_server.py -c fmm_config.json -b 0.0.0.0:$port -w $num_workers --ready_file "$city.ready" &> "$city-log.txt" &
+pid=$!
+waited=0
+while [ ! -f "$city.ready" ]; do
+    if ! kill -0 $pid 2> /dev/null; then
+        echo "The server for city $city exited before it was ready, the end of $city-log.txt:"
+        tail -n 20 "$city-log.txt"
+        exit 1
+    fi
+    if [ $waited -ge $ready_timeout ]; then
+        echo "The server for city $city is not ready after $ready_timeout seconds, see server/$city-log.txt."
+        kill $pid
+        exit 1
+    fi
+    sleep 1
+    waited=$((waited + 1))
+done
 
 echo "Server started and is listening at port: $port with $num_workers workers for city $city."
 echo "Test like: python flask_client.py 1236"
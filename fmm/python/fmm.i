@@ -5,6 +5,7 @@
 %include "std_vector.i"
 %include "std_shared_ptr.i"
 %shared_ptr(FMM::MM::UBODT)
+%shared_ptr(FMM::NETWORK::CandidateIndex)
 %ignore FMM::NETWORK::Network::route2geometry(std::vector<EdgeIndex> const &) const;
 %ignore FMM::NETWORK::Network::get_edge(EdgeIndex index) const;
 %ignore operator<<(std::ostream& os, const LineString& rhs);
@@ -12,6 +13,9 @@
 %ignore FMM::MM::FastMapMatchConfig::print() const;
 %ignore FMM::CONFIG::GPSConfig::print() const;
 %ignore FMM::CONFIG::ResultConfig::print() const;
+%ignore FMM::MM::split_trajectory;
+%ignore FMM::MM::stitch_results;
+%ignore FMM::NETWORK::Network::edges_to_geometry;
 
 %exception {
     try {
@@ -23,17 +27,55 @@
     }
 }
 
+// Release the GIL while matching so that other Python threads keep running,
+// the error is kept and raised after the GIL is acquired again.
+%define FMM_RELEASE_GIL(method)
+%exception method {
+    std::string fmm_error;
+    bool fmm_failed = false;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        $action
+    } catch (std::exception& e) {
+        fmm_failed = true;
+        fmm_error = e.what();
+    } catch (...) {
+        fmm_failed = true;
+        fmm_error = "Unknown error";
+    }
+    Py_END_ALLOW_THREADS
+    if (fmm_failed) {
+        SWIG_exception(SWIG_RuntimeError, const_cast<char*>(fmm_error.c_str()));
+    }
+}
+%enddef
+FMM_RELEASE_GIL(FMM::MM::FastMapMatch::match_wkt)
+FMM_RELEASE_GIL(FMM::MM::FastMapMatch::match_coords)
+FMM_RELEASE_GIL(FMM::MM::FastMapMatch::match_batch)
+FMM_RELEASE_GIL(FMM::MM::FastMapMatch::match_split)
+FMM_RELEASE_GIL(FMM::MM::FastMapMatchSession::add_point)
+FMM_RELEASE_GIL(FMM::MM::FastMapMatchSession::add_points)
+FMM_RELEASE_GIL(FMM::MM::FastMapMatchSession::flush)
+FMM_RELEASE_GIL(FMM::MM::STMATCH::match_wkt)
+FMM_RELEASE_GIL(FMM::MM::STMATCH::match_coords)
+FMM_RELEASE_GIL(FMM::MM::STMATCH::match_batch)
+FMM_RELEASE_GIL(FMM::MM::STMATCH::match_split)
+
 %{
 /* Put header files here or function declarations like below */
 #include "core/geometry.hpp"
 #include "network/type.hpp"
+#include "network/candidate_index.hpp"
 #include "network/network.hpp"
 #include "network/network_graph.hpp"
 #include "python/pyfmm.hpp"
 #include "config/gps_config.hpp"
 #include "config/result_config.hpp"
 #include "mm/mm_type.hpp"
+#include "mm/mm_split.hpp"
+#include "mm/fmm/sp_cache.hpp"
 #include "mm/fmm/fmm_algorithm.hpp"
+#include "mm/fmm/fmm_session.hpp"
 #include "mm/fmm/ubodt_gen_algorithm.hpp"
 #include "mm/stmatch/stmatch_algorithm.hpp"
 #include "mm/fmm/ubodt.hpp"
@@ -48,12 +90,113 @@ using namespace FMM::MM;
 using namespace FMM::CONFIG;
 %}
 
+%{
+/**
+ * Get a C-contiguous buffer of float64 values from a Python object that
+ * supports the buffer protocol, e.g., a numpy float64 array, or raw bytes
+ * holding float64 values in native (little-endian) byte order.
+ */
+static int fmm_get_double_buffer(PyObject *obj, Py_buffer *view) {
+  if (PyObject_GetBuffer(obj, view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) != 0) {
+    return -1;
+  }
+  const char *fmt = view->format;
+  if (fmt != NULL && (fmt[0] == '<' || fmt[0] == '=' || fmt[0] == '@')) ++fmt;
+  bool is_double = fmt != NULL && strcmp(fmt, "d") == 0 &&
+    view->itemsize == sizeof(double);
+  bool is_raw = fmt == NULL || strcmp(fmt, "B") == 0 ||
+    strcmp(fmt, "b") == 0 || strcmp(fmt, "c") == 0;
+  if (!is_double && !(is_raw && view->len % sizeof(double) == 0)) {
+    PyBuffer_Release(view);
+    PyErr_SetString(PyExc_TypeError, "A contiguous float64 array or bytes "
+      "with a length of multiple of 8 is expected.");
+    return -1;
+  }
+  return 0;
+}
+
+/**
+ * Get a C-contiguous buffer of int64 values from a Python object that
+ * supports the buffer protocol, e.g., a numpy int64 array.
+ */
+static int fmm_get_int64_buffer(PyObject *obj, Py_buffer *view) {
+  if (PyObject_GetBuffer(obj, view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) != 0) {
+    return -1;
+  }
+  const char *fmt = view->format;
+  if (fmt != NULL && (fmt[0] == '<' || fmt[0] == '=' || fmt[0] == '@')) ++fmt;
+  bool is_int64 = fmt != NULL && (strcmp(fmt, "q") == 0 ||
+    strcmp(fmt, "l") == 0) && view->itemsize == sizeof(long long);
+  if (!is_int64) {
+    PyBuffer_Release(view);
+    PyErr_SetString(PyExc_TypeError, "A contiguous int64 array is expected.");
+    return -1;
+  }
+  return 0;
+}
+%}
+
+// Coordinates passed as a buffer are read in place without any copy.
+%typemap(in) (const double *DOUBLE_BUFFER, int DOUBLE_BUFFER_SIZE)
+  (Py_buffer view) {
+  if (fmm_get_double_buffer($input, &view) != 0) SWIG_fail;
+  $1 = (double *) view.buf;
+  $2 = (int) (view.len / sizeof(double));
+}
+%typemap(arginit) (const double *DOUBLE_BUFFER, int DOUBLE_BUFFER_SIZE) {
+  view$argnum.obj = NULL;
+}
+%typemap(freearg) (const double *DOUBLE_BUFFER, int DOUBLE_BUFFER_SIZE) {
+  if (view$argnum.obj != NULL) PyBuffer_Release(&view$argnum);
+}
+%typemap(typecheck, precedence=SWIG_TYPECHECK_POINTER)
+  (const double *DOUBLE_BUFFER, int DOUBLE_BUFFER_SIZE) {
+  $1 = PyObject_CheckBuffer($input) ? 1 : 0;
+}
+%apply (const double *DOUBLE_BUFFER, int DOUBLE_BUFFER_SIZE) {
+  (const double *x, int nx),
+  (const double *y, int ny),
+  (const double *ts, int nts),
+  (const double *coords, int ncoords)
+};
+
+// Ids passed as an int64 buffer are read in place without any copy.
+%typemap(in) (const long long *INT64_BUFFER, int INT64_BUFFER_SIZE)
+  (Py_buffer view) {
+  if (fmm_get_int64_buffer($input, &view) != 0) SWIG_fail;
+  $1 = (long long *) view.buf;
+  $2 = (int) (view.len / sizeof(long long));
+}
+%typemap(arginit) (const long long *INT64_BUFFER, int INT64_BUFFER_SIZE) {
+  view$argnum.obj = NULL;
+}
+%typemap(freearg) (const long long *INT64_BUFFER, int INT64_BUFFER_SIZE) {
+  if (view$argnum.obj != NULL) PyBuffer_Release(&view$argnum);
+}
+%typemap(typecheck, precedence=SWIG_TYPECHECK_POINTER)
+  (const long long *INT64_BUFFER, int INT64_BUFFER_SIZE) {
+  $1 = PyObject_CheckBuffer($input) ? 1 : 0;
+}
+%apply (const long long *INT64_BUFFER, int INT64_BUFFER_SIZE) {
+  (const long long *ids, int nids),
+  (const long long *sources, int nsources),
+  (const long long *targets, int ntargets),
+  (const long long *offsets, int noffsets)
+};
+// The network built from arrays is owned by its Python proxy.
+%newobject FMM::NETWORK::Network::from_arrays;
+%newobject FMM::NETWORK::Network::extract;
+
 %template(IntVector) std::vector<int>;
 %template(IDVector) std::vector<long long>;
 %template(HexVector) std::vector<unsigned long long>;
 %template(UnsignedIntVector) std::vector<unsigned int>;
 %template(DoubleVector) std::vector<double>;
 %template(PyCandidateVector) std::vector<FMM::PYTHON::PyCandidate>;
+%template(PyMatchResultVector) std::vector<FMM::PYTHON::PyMatchResult>;
+%template(PySegmentVector) std::vector<FMM::PYTHON::PySegment>;
+%template(StringVector) std::vector<std::string>;
+%template(NetworkVector) std::vector<const FMM::NETWORK::Network *>;
 // %template(DoubleVVector) vector<vector<double> >;
 // %template(DoubleVVVector) vector<vector<vector<double> > >;
 // %template(IntSet) set<int>;
@@ -61,11 +204,15 @@ using namespace FMM::CONFIG;
 %include "core/geometry.hpp"
 %include "mm/mm_type.hpp"
 %include "network/type.hpp"
+%include "network/candidate_index.hpp"
 %include "network/network.hpp"
 %include "python/pyfmm.hpp"
+%include "mm/mm_split.hpp"
 %include "mm/fmm/ubodt.hpp"
 %include "network/network_graph.hpp"
+%include "mm/fmm/sp_cache.hpp"
 %include "mm/fmm/fmm_algorithm.hpp"
+%include "mm/fmm/fmm_session.hpp"
 %include "mm/fmm/ubodt_gen_algorithm.hpp"
 %include "config/gps_config.hpp"
 %include "config/result_config.hpp"
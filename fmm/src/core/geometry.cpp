@@ -44,3 +44,13 @@ FMM::CORE::LineString FMM::CORE::wkt2linestring(const std::string &wkt){
   boost::geometry::read_wkt(wkt,line.get_geometry());
   return line;
 };
+
+FMM::CORE::LineString FMM::CORE::coords2linestring(
+  const double *x, const double *y, int n){
+  FMM::CORE::LineString line;
+  line.get_geometry().reserve(n);
+  for (int i=0;i<n;++i){
+    line.add_point(x[i],y[i]);
+  }
+  return line;
+};
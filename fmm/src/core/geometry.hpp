@@ -15,6 +15,7 @@
 #include <boost/geometry.hpp>
 #include <string>
 #include <sstream>
+#include <vector>
 
 namespace FMM {
 /**
@@ -164,6 +165,21 @@ public:
     }
     return ss.str();
   };
+  /**
+   * Export the coordinates of the line as a flat vector.
+   * @return The coordinates stored as x0,y0,x1,y1,...,which is cheaper
+   * to transfer and decode than the WKT or GeoJSON text.
+   */
+  inline std::vector<double> export_coords() const{
+    int N = get_num_points();
+    std::vector<double> coords;
+    coords.reserve(2*N);
+    for (int i=0;i<N;++i){
+      coords.push_back(get_x(i));
+      coords.push_back(get_y(i));
+    }
+    return coords;
+  };
   /**
    * Get a const reference to the inner boost geometry linestring
    * @return const reference to the inner boost geometry linestring
@@ -241,6 +257,15 @@ LineString ogr2linestring(const OGRMultiLineString *mline);
  */
 LineString wkt2linestring(const std::string &wkt);
 
+/**
+ * Convert coordinates stored in two contiguous arrays into a linestring
+ * @param x x coordinates of the points
+ * @param y y coordinates of the points
+ * @param n number of points
+ * @return a linestring
+ */
+LineString coords2linestring(const double *x, const double *y, int n);
+
 }; // CORE
 
 }; // FMM
@@ -9,6 +9,10 @@
 #include "io/gps_reader.hpp"
 #include "io/mm_writer.hpp"
 
+#include <omp.h>
+#include <stdexcept>
+#include <boost/format.hpp>
+
 
 using namespace FMM;
 using namespace FMM::CORE;
@@ -84,19 +88,34 @@ bool FastMapMatchConfig::validate() const {
 MatchResult FastMapMatch::match_traj(const Trajectory &traj,
                                      const FastMapMatchConfig &config) {
   SPDLOG_DEBUG("Count of points in trajectory {}", traj.geom.get_num_points());
+  MatchStats stats;
+  MatchStats *stats_ptr = stats_enabled_ ? &stats : nullptr;
+  UTIL::StageTimer timer;
   SPDLOG_DEBUG("Search candidates");
   Traj_Candidates tc = network_.search_tr_cs_knn(
     traj.geom, config.k, config.radius);
   SPDLOG_DEBUG("Trajectory candidate {}", tc);
-  if (tc.empty()) return MatchResult{};
+  if (stats_enabled_) {
+    stats.search = timer.lap();
+    stats.points = traj.geom.get_num_points();
+    for (const Point_Candidates &pc : tc) stats.candidates += pc.size();
+  }
+  if (tc.empty()) {
+    MatchResult result{};
+    result.stats = stats;
+    return result;
+  }
   SPDLOG_DEBUG("Generate transition graph");
   TransitionGraph tg(tc, config.gps_error);
+  if (stats_enabled_) stats.transition_graph = timer.lap();
   SPDLOG_DEBUG("Update cost in transition graph");
   // The network will be used internally to update transition graph
-  update_tg(&tg, traj, config.reverse_tolerance);
+  update_tg(&tg, traj, config.reverse_tolerance, stats_ptr);
+  if (stats_enabled_) stats.update = timer.lap();
   SPDLOG_DEBUG("Optimal path inference");
   TGOpath tg_opath = tg.backtrack();
   SPDLOG_DEBUG("Optimal path size {}", tg_opath.size());
+  if (stats_enabled_) stats.backtrack = timer.lap();
   MatchedCandidatePath matched_candidate_path(tg_opath.size());
   std::transform(tg_opath.begin(), tg_opath.end(),
                  matched_candidate_path.begin(),
@@ -113,30 +132,129 @@ MatchResult FastMapMatch::match_traj(const Trajectory &traj,
   });
   std::vector<int> indices;
   const std::vector<Edge> &edges = network_.get_edges();
+  std::shared_ptr<ShortestPathCache> sp_cache = std::atomic_load(&sp_cache_);
   C_Path cpath = ubodt_->construct_complete_path(traj.id, tg_opath, edges,
                                                  &indices,
-                                                 config.reverse_tolerance);
+                                                 config.reverse_tolerance,
+                                                 sp_cache.get());
+  if (stats_enabled_) stats.complete_path = timer.lap();
   SPDLOG_DEBUG("Opath is {}", opath);
   SPDLOG_DEBUG("Indices is {}", indices);
   SPDLOG_DEBUG("Complete path is {}", cpath);
   LineString mgeom = network_.complete_path_to_geometry(
     traj.geom, cpath);
-  return MatchResult{
+  if (stats_enabled_) stats.geometry = timer.lap();
+  MatchResult result{
     traj.id, matched_candidate_path, opath, cpath, indices, mgeom};
+  result.stats = stats;
+  return result;
 }
 
 PyMatchResult FastMapMatch::match_wkt(
   const std::string &wkt, const FastMapMatchConfig &config) {
+  UTIL::StageTimer timer;
   LineString line = wkt2linestring(wkt);
   std::vector<double> timestamps;
   Trajectory traj{0, line, timestamps};
+  double parse = timer.lap();
+  MatchResult result = match_traj(traj, config);
+  timer.lap();
+  PyMatchResult output = to_py_match_result(result);
+  if (stats_enabled_) {
+    output.stats.parse = parse;
+    output.stats.output = timer.lap();
+  }
+  return output;
+};
+
+PyMatchResult FastMapMatch::match_coords(
+  const double *x, int nx, const double *y, int ny,
+  const double *ts, int nts, const FastMapMatchConfig &config) {
+  if (nx != ny || (nts != 0 && nts != nx)) {
+    std::string message = (boost::format(
+      "Inconsistent coordinate sizes x %1% y %2% timestamps %3%")
+      % nx % ny % nts).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  UTIL::StageTimer timer;
+  LineString line = coords2linestring(x, y, nx);
+  std::vector<double> timestamps(ts, ts + nts);
+  Trajectory traj{0, line, timestamps};
+  double parse = timer.lap();
   MatchResult result = match_traj(traj, config);
+  timer.lap();
+  PyMatchResult output = to_py_match_result(result);
+  if (stats_enabled_) {
+    output.stats.parse = parse;
+    output.stats.output = timer.lap();
+  }
+  return output;
+};
+
+PyMatchResult FastMapMatch::match_split(
+  const double *x, int nx, const double *y, int ny,
+  const double *ts, int nts, const FastMapMatchConfig &config,
+  const SplitConfig &split_config, int n_threads) {
+  if (nx != ny || (nts != 0 && nts != nx)) {
+    std::string message = (boost::format(
+      "Inconsistent coordinate sizes x %1% y %2% timestamps %3%")
+      % nx % ny % nts).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  if (!split_config.validate()) {
+    throw std::invalid_argument("Invalid split configuration");
+  }
+  std::vector<std::pair<int, int>> ranges = split_trajectory(
+    x, y, nts == 0 ? nullptr : ts, nx, split_config);
+  int N = ranges.size();
+  if (n_threads <= 0) n_threads = omp_get_max_threads();
+  std::vector<PyMatchResult> parts(N);
+  #pragma omp parallel for num_threads(n_threads) schedule(dynamic)
+  for (int i = 0; i < N; ++i) {
+    int start = ranges[i].first;
+    int n = ranges[i].second - start;
+    try {
+      parts[i] = match_coords(x + start, n, y + start, n,
+                              nts == 0 ? ts : ts + start, nts == 0 ? 0 : n,
+                              config);
+    } catch (const std::exception &e) {
+      SPDLOG_WARN("Segment {} of trajectory not matched: {}", i, e.what());
+    }
+  }
+  PyMatchResult output = stitch_results(parts, ranges, x, y, network_);
+  for (const PyMatchResult &part : parts) output.stats.add(part.stats);
+  return output;
+};
+
+std::vector<PyMatchResult> FastMapMatch::match_batch(
+  const std::vector<std::string> &wkts, const FastMapMatchConfig &config,
+  int n_threads) {
+  int N = wkts.size();
+  if (n_threads <= 0) n_threads = omp_get_max_threads();
+  std::vector<PyMatchResult> results(N);
+  #pragma omp parallel for num_threads(n_threads) schedule(dynamic)
+  for (int i = 0; i < N; ++i) {
+    try {
+      results[i] = match_wkt(wkts[i], config);
+    } catch (const std::exception &e) {
+      SPDLOG_WARN("Trajectory {} in batch not matched: {}", i, e.what());
+      results[i].error = e.what();
+    }
+    results[i].id = i;
+  }
+  return results;
+};
+
+PyMatchResult FastMapMatch::to_py_match_result(const MatchResult &result) const {
   PyMatchResult output;
   output.id = result.id;
   output.opath = result.opath;
   output.cpath = result.cpath;
   output.mgeom = result.mgeom;
   output.indices = result.indices;
+  output.stats = result.stats;
   for (int i = 0; i < result.opt_candidate_path.size(); ++i) {
     const MatchedCandidate &mc = result.opt_candidate_path[i];
     output.candidates.push_back(
@@ -251,8 +369,39 @@ std::string FastMapMatch::match_gps_file(
   return oss.str();
 };
 
+void FastMapMatch::set_sp_fallback(double delta, int capacity) {
+  if (delta <= 0) {
+    std::atomic_store(&sp_cache_, std::shared_ptr<ShortestPathCache>());
+    return;
+  }
+  if (delta <= ubodt_->get_delta()) {
+    SPDLOG_WARN("Fallback delta {} not larger than UBODT delta {}",
+                delta, ubodt_->get_delta());
+  }
+  // The matches running in other threads keep the cache they loaded.
+  std::atomic_store(&sp_cache_, std::make_shared<ShortestPathCache>(
+    graph_, delta, capacity));
+};
+
+ShortestPathCacheStats FastMapMatch::get_sp_fallback_stats() const {
+  std::shared_ptr<ShortestPathCache> sp_cache = std::atomic_load(&sp_cache_);
+  if (sp_cache == nullptr) return ShortestPathCacheStats{0, 0, 0, 0, 0, 0};
+  return sp_cache->get_stats();
+};
+
+std::vector<EdgeIndex> FastMapMatch::get_sp_path(NodeIndex source,
+                                                 NodeIndex target) const {
+  std::vector<EdgeIndex> segs = ubodt_->look_sp_path(source, target);
+  if (segs.empty() && source != target) {
+    std::shared_ptr<ShortestPathCache> sp_cache = std::atomic_load(&sp_cache_);
+    if (sp_cache != nullptr) sp_cache->query(source, target, &segs);
+  }
+  return segs;
+};
+
 double FastMapMatch::get_sp_dist(
-  const Candidate *ca, const Candidate *cb, double reverse_tolerance) {
+  const Candidate *ca, const Candidate *cb, double reverse_tolerance,
+  MatchStats *stats) {
   double sp_dist = 0;
   if (ca->edge->id == cb->edge->id && ca->offset <= cb->offset) {
     sp_dist = cb->offset - ca->offset;
@@ -264,18 +413,37 @@ double FastMapMatch::get_sp_dist(
     // Transition on the same OD nodes
     sp_dist = ca->edge->length - ca->offset + cb->offset;
   } else {
-    Record *r = ubodt_->look_up(ca->edge->target, cb->edge->source);
-    // No sp path exist from O to D.
-    if (r == nullptr) return std::numeric_limits<double>::infinity();
+    const Record *r = ubodt_->look_up(ca->edge->target, cb->edge->source);
+    if (stats != nullptr) {
+      ++(r == nullptr ? stats->ubodt_misses : stats->ubodt_hits);
+    }
+    double cost;
+    // The cache is only loaded on a UBODT miss, which keeps the hits free of
+    // the atomic access.
+    std::shared_ptr<ShortestPathCache> sp_cache;
+    if (r != nullptr) {
+      cost = r->cost;
+    } else if ((sp_cache = std::atomic_load(&sp_cache_)) != nullptr) {
+      bool searched = false;
+      cost = sp_cache->query(ca->edge->target, cb->edge->source, nullptr,
+                              &searched);
+      if (stats != nullptr) {
+        ++(searched ? stats->sp_searches : stats->sp_cache_hits);
+      }
+    } else {
+      // No sp path exist from O to D.
+      return std::numeric_limits<double>::infinity();
+    }
+    if (cost == std::numeric_limits<double>::infinity()) return cost;
     // calculate original SP distance
-    sp_dist = r->cost + ca->edge->length - ca->offset + cb->offset;
+    sp_dist = cost + ca->edge->length - ca->offset + cb->offset;
   }
   return sp_dist;
 }
 
 void FastMapMatch::update_tg(
   TransitionGraph *tg,
-  const Trajectory &traj, double reverse_tolerance) {
+  const Trajectory &traj, double reverse_tolerance, MatchStats *stats) {
   SPDLOG_DEBUG("Update transition graph");
   std::vector<TGLayer> &layers = tg->get_layers();
   std::vector<double> eu_dists = ALGORITHM::cal_eu_dist(traj.geom);
@@ -284,7 +452,7 @@ void FastMapMatch::update_tg(
     SPDLOG_DEBUG("Update layer {} ", i);
     bool connected = false;
     update_layer(i, &(layers[i]), &(layers[i + 1]),
-                 eu_dists[i], reverse_tolerance, &connected);
+                 eu_dists[i], reverse_tolerance, &connected, stats);
     if (!connected){
       SPDLOG_WARN("Traj {} unmatched as point {} and {} not connected",
         traj.id, i, i+1);
@@ -300,15 +468,17 @@ void FastMapMatch::update_layer(int level,
                                 TGLayer *lb_ptr,
                                 double eu_dist,
                                 double reverse_tolerance,
-                                bool *connected) {
+                                bool *connected,
+                                MatchStats *stats) {
   // SPDLOG_TRACE("Update layer");
   TGLayer &lb = *lb_ptr;
+  if (stats != nullptr) stats->transitions += la_ptr->size() * lb_ptr->size();
   bool layer_connected = false;
   for (auto iter_a = la_ptr->begin(); iter_a != la_ptr->end(); ++iter_a) {
     NodeIndex source = iter_a->c->index;
     for (auto iter_b = lb_ptr->begin(); iter_b != lb_ptr->end(); ++iter_b) {
       double sp_dist = get_sp_dist(iter_a->c, iter_b->c,
-        reverse_tolerance);
+        reverse_tolerance, stats);
       double tp = TransitionGraph::calc_tp(sp_dist, eu_dist);
       double temp = iter_a->cumu_prob + log(tp) + log(iter_b->ep);
       SPDLOG_TRACE("L {} f {} t {} sp {} dist {} tp {} ep {} fcp {} tcp {}",
@@ -13,11 +13,14 @@
 #include "network/network.hpp"
 #include "network/network_graph.hpp"
 #include "mm/transition_graph.hpp"
+#include "mm/mm_split.hpp"
 #include "mm/fmm/ubodt.hpp"
+#include "mm/fmm/sp_cache.hpp"
 #include "python/pyfmm.hpp"
 #include "config/gps_config.hpp"
 #include "config/result_config.hpp"
 
+#include <memory>
 #include <string>
 #include <boost/property_tree/ptree.hpp>
 #include <boost/property_tree/xml_parser.hpp>
@@ -83,6 +86,7 @@ struct FastMapMatchConfig{
  *
  */
 class FastMapMatch {
+  friend class FastMapMatchSession;
  public:
   /**
    * Constructor of Fast map matching model
@@ -93,8 +97,52 @@ class FastMapMatch {
   FastMapMatch(const NETWORK::Network &network,
       const  NETWORK::NetworkGraph &graph,
       std::shared_ptr<UBODT> ubodt)
-      : network_(network), graph_(graph), ubodt_(ubodt) {
+      : network_(network), graph_(graph), ubodt_(ubodt),
+        stats_enabled_(false) {
   };
+  /**
+   * Enable or disable the collection of the stage timings and counters
+   * (MatchStats) of the matches, which are zero if disabled.
+   * @param enabled true to collect the statistics
+   */
+  void set_stats_enabled(bool enabled) {
+    stats_enabled_ = enabled;
+  };
+  /**
+   * Check if the statistics of the matches are collected
+   * @return true if the statistics are collected
+   */
+  bool get_stats_enabled() const {
+    return stats_enabled_;
+  };
+  /**
+   * Search the OD pairs missing in the UBODT by Dijkstra with an upper
+   * bound of delta on the graph rather than treating them as disconnected,
+   * the results are kept in a least recently used ShortestPathCache of
+   * capacity pairs. The UBODT can then be generated with a much smaller
+   * delta without failing the sparse trajectories.
+   * @param delta upper bound of the searches, which should be larger than
+   * the delta of the UBODT, 0 disables the fallback
+   * @param capacity maximum number of OD pairs cached
+   *
+   * It is safe to call while other threads are matching, the cache is
+   * replaced atomically and the running matches finish with the old one.
+   */
+  void set_sp_fallback(double delta, int capacity = 100000);
+  /**
+   * Get the counters of the fallback cache, which are zero if the fallback
+   * is disabled
+   */
+  ShortestPathCacheStats get_sp_fallback_stats() const;
+  /**
+   * Get the shortest path from source to target in the UBODT or, if it is
+   * missing, in the fallback cache
+   * @param source source node
+   * @param target target node
+   * @return edge indices of the path, empty if not found
+   */
+  std::vector<NETWORK::EdgeIndex> get_sp_path(NETWORK::NodeIndex source,
+                                              NETWORK::NodeIndex target) const;
   /**
    * Match a trajectory to the road network
    * @param  traj   input trajector data
@@ -111,6 +159,61 @@ class FastMapMatch {
    */
   PYTHON::PyMatchResult match_wkt(
       const std::string &wkt,const FastMapMatchConfig &config);
+  /**
+   * Match a trajectory stored in contiguous coordinate arrays to the road
+   * network, which avoids formatting and parsing a WKT string.
+   * @param x x coordinates of the points
+   * @param nx number of x coordinates
+   * @param y y coordinates of the points
+   * @param ny number of y coordinates, which should be equal to nx
+   * @param ts timestamps of the points
+   * @param nts number of timestamps, which should be 0 or equal to nx
+   * @param config Map matching configuration
+   * @return Map matching result in POD format used in Python API
+   */
+  PYTHON::PyMatchResult match_coords(
+      const double *x, int nx, const double *y, int ny,
+      const double *ts, int nts, const FastMapMatchConfig &config);
+  /**
+   * Match a long or gappy trajectory piecewise.
+   *
+   * The trajectory is split into segments by split_trajectory, which are
+   * matched in parallel by OpenMP threads and stitched back into one
+   * result by stitch_results, whose segments field gives the range of
+   * points and edges of each segment.
+   * @param x x coordinates of the points
+   * @param nx number of x coordinates
+   * @param y y coordinates of the points
+   * @param ny number of y coordinates, which should be equal to nx
+   * @param ts timestamps of the points
+   * @param nts number of timestamps, which should be 0 or equal to nx
+   * @param config Map matching configuration
+   * @param split_config Split configuration
+   * @param n_threads number of threads, if it is not positive,
+   * the default number of OpenMP threads is used.
+   * @return Map matching result in POD format used in Python API
+   */
+  PYTHON::PyMatchResult match_split(
+    const double *x, int nx, const double *y, int ny,
+    const double *ts, int nts, const FastMapMatchConfig &config,
+    const SplitConfig &split_config, int n_threads = 0);
+  /**
+   * Match a batch of wkt linestrings to the road network in parallel.
+   *
+   * The trajectories are distributed over OpenMP threads, which share the
+   * network and the other data of this model. A trajectory failing to be
+   * matched, e.g., due to an invalid wkt, gets an empty result whose error
+   * tells why and does not affect the others.
+   * @param wkts WKT representations of the trajectories
+   * @param config Map matching configuration
+   * @param n_threads number of threads, if it is not positive,
+   * the default number of OpenMP threads is used.
+   * @return Map matching results in POD format used in Python API, the id
+   * of each result is the index of the trajectory in wkts.
+   */
+  std::vector<PYTHON::PyMatchResult> match_batch(
+      const std::vector<std::string> &wkts, const FastMapMatchConfig &config,
+      int n_threads = 0);
   /**
    * Match GPS data stored in a file
    * @param  gps_config    [description]
@@ -130,20 +233,26 @@ class FastMapMatch {
    * Get shortest path distance between two candidates
    * @param  ca from candidate
    * @param  cb to candidate
+   * @param  stats statistics where the UBODT lookups and the fallback
+   * searches are counted if it is not null
    * @return  shortest path value
    */
   double get_sp_dist(const Candidate *ca,
                      const Candidate *cb,
-                     double reverse_tolerance);
+                     double reverse_tolerance,
+                     MatchStats *stats = nullptr);
   /**
    * Update probabilities in a transition graph
    * @param tg transition graph
    * @param traj raw trajectory
    * @param config map match configuration
+   * @param stats statistics where the transitions are counted if it is
+   * not null
    */
   void update_tg(TransitionGraph *tg,
                  const CORE::Trajectory &traj,
-                 double reverse_tolerance = 0);
+                 double reverse_tolerance = 0,
+                 MatchStats *stats = nullptr);
   /**
    * Update probabilities between two layers a and b in the transition graph
    * @param level   the index of layer a
@@ -152,14 +261,28 @@ class FastMapMatch {
    * @param eu_dist Euclidean distance between two observed point
    * @param connected the variable is set to false if the layer is not connected
    * with the next layer
+   * @param stats statistics where the transitions are counted if it is
+   * not null
    */
   void update_layer(int level, TGLayer *la_ptr, TGLayer *lb_ptr,
                     double eu_dist, double reverse_tolerance,
-                    bool *connected);
+                    bool *connected, MatchStats *stats = nullptr);
+  /**
+   * Convert a map matching result into the POD format used in Python API
+   * @param result map matching result
+   * @return Map matching result in POD format used in Python API
+   */
+  PYTHON::PyMatchResult to_py_match_result(const MatchResult &result) const;
  private:
   const NETWORK::Network &network_;
   const NETWORK::NetworkGraph &graph_;
   std::shared_ptr<UBODT> ubodt_;
+  bool stats_enabled_;
+  /**
+   * Fallback cache, only accessed by std::atomic_load and std::atomic_store
+   * as set_sp_fallback can be called while other threads are matching
+   */
+  std::shared_ptr<ShortestPathCache> sp_cache_;
 };
 }
 }
@@ -0,0 +1,273 @@
+//
+// Online map matching session of FMM.
+//
+
+#include "mm/fmm/fmm_session.hpp"
+#include "util/debug.hpp"
+
+#include <algorithm>
+#include <cmath>
+#include <limits>
+#include <stdexcept>
+#include <boost/format.hpp>
+
+using namespace FMM;
+using namespace FMM::CORE;
+using namespace FMM::NETWORK;
+using namespace FMM::MM;
+
+FastMapMatchSession::FastMapMatchSession(
+  FastMapMatch &model, const FastMapMatchConfig &config, int max_window)
+  : model_(model), config_(config), max_window_(max_window),
+    num_points_(0), has_anchor_(false) {
+  if (max_window < 1) {
+    std::string message = (boost::format(
+      "Invalid max window %1%, which should be positive") % max_window).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+};
+
+SessionUpdate FastMapMatchSession::add_point(double x, double y) {
+  SessionUpdate update;
+  append_point(x, y, &update);
+  return update;
+};
+
+SessionUpdate FastMapMatchSession::add_points(
+  const double *x, int nx, const double *y, int ny) {
+  if (nx != ny) {
+    std::string message = (boost::format(
+      "Inconsistent coordinate sizes x %1% y %2%") % nx % ny).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  SessionUpdate update;
+  for (int i = 0; i < nx; ++i) {
+    append_point(x[i], y[i], &update);
+  }
+  return update;
+};
+
+SessionUpdate FastMapMatchSession::flush() {
+  SessionUpdate update;
+  commit_all(&update);
+  return update;
+};
+
+int FastMapMatchSession::get_num_points() const {
+  return num_points_;
+};
+
+int FastMapMatchSession::get_window_size() const {
+  return window_.size();
+};
+
+void FastMapMatchSession::append_point(double x, double y,
+                                       SessionUpdate *update) {
+  int index = num_points_++;
+  LineString geom;
+  geom.add_point(x, y);
+  Traj_Candidates tc = model_.network_.search_tr_cs_knn(
+    geom, config_.k, config_.radius);
+  if (tc.empty()) {
+    SPDLOG_DEBUG("Point {} skipped as no candidate is found", index);
+    update->skipped.push_back(index);
+    return;
+  }
+  SessionLayer layer;
+  layer.index = index;
+  layer.x = x;
+  layer.y = y;
+  for (const Candidate &c : tc[0]) {
+    layer.nodes.push_back(SessionNode{
+      c, TransitionGraph::calc_ep(c.dist, config_.gps_error),
+      -std::numeric_limits<double>::infinity(), -1});
+  }
+  const SessionLayer *prev = nullptr;
+  if (!window_.empty()) {
+    prev = &window_.back();
+  } else if (has_anchor_) {
+    prev = &anchor_;
+  }
+  if (prev == nullptr) {
+    start_layer(&layer);
+  } else {
+    update_tp(*prev, &layer);
+    if (!update_layer(*prev, &layer)) {
+      SPDLOG_WARN("Point {} not connected with point {}, start a new segment",
+                  index, prev->index);
+      commit_all(update);
+      has_anchor_ = false;
+      layer.log_tp.clear();
+      start_layer(&layer);
+    }
+  }
+  window_.push_back(layer);
+  commit_converged(update);
+  if (window_.size() > max_window_) {
+    // The oldest point is committed with the current optimal path.
+    commit(backtrack(best_node(window_.back())), 1, update);
+  }
+};
+
+void FastMapMatchSession::update_tp(const SessionLayer &la,
+                                    SessionLayer *lb) const {
+  double eu_dist = std::sqrt((lb->x - la.x) * (lb->x - la.x) +
+                             (lb->y - la.y) * (lb->y - la.y));
+  int nb = lb->nodes.size();
+  lb->log_tp.resize(la.nodes.size() * nb);
+  for (int a = 0; a < la.nodes.size(); ++a) {
+    for (int b = 0; b < nb; ++b) {
+      double sp_dist = model_.get_sp_dist(
+        &la.nodes[a].c, &lb->nodes[b].c, config_.reverse_tolerance);
+      lb->log_tp[a * nb + b] =
+        log(TransitionGraph::calc_tp(sp_dist, eu_dist));
+    }
+  }
+};
+
+bool FastMapMatchSession::update_layer(const SessionLayer &la,
+                                       SessionLayer *lb) {
+  int nb = lb->nodes.size();
+  double max_prob = -std::numeric_limits<double>::infinity();
+  for (int b = 0; b < nb; ++b) {
+    SessionNode &node = lb->nodes[b];
+    node.cumu_prob = -std::numeric_limits<double>::infinity();
+    node.prev = -1;
+    for (int a = 0; a < la.nodes.size(); ++a) {
+      double temp = la.nodes[a].cumu_prob + lb->log_tp[a * nb + b] +
+        log(node.ep);
+      if (temp >= node.cumu_prob) {
+        node.cumu_prob = temp;
+        node.prev = a;
+      }
+    }
+    max_prob = std::max(max_prob, node.cumu_prob);
+  }
+  if (max_prob == -std::numeric_limits<double>::infinity()) return false;
+  // Only the differences matter, which keeps the values bounded for a
+  // stream of any length.
+  for (SessionNode &node : lb->nodes) {
+    node.cumu_prob -= max_prob;
+  }
+  return true;
+};
+
+void FastMapMatchSession::start_layer(SessionLayer *layer) {
+  for (SessionNode &node : layer->nodes) {
+    node.cumu_prob = log(node.ep);
+    node.prev = -1;
+  }
+};
+
+void FastMapMatchSession::commit(const std::vector<int> &path, int n,
+                                 SessionUpdate *update) {
+  for (int i = 0; i < n; ++i) {
+    const SessionLayer &layer = window_[i];
+    const SessionNode &node = layer.nodes[path[i]];
+    update->indices.push_back(layer.index);
+    update->opath.push_back(node.c.edge->id);
+    update->offset.push_back(node.c.offset);
+    append_cpath(node.c, update);
+    anchor_.index = layer.index;
+    anchor_.x = layer.x;
+    anchor_.y = layer.y;
+    anchor_.nodes = {SessionNode{node.c, node.ep, 0, -1}};
+    anchor_.log_tp.clear();
+    has_anchor_ = true;
+  }
+  int choice = path[n - 1];
+  window_.erase(window_.begin(), window_.begin() + n);
+  if (window_.empty()) return;
+  // Keep only the transitions from the anchor and update the window again
+  SessionLayer &first = window_.front();
+  int nb = first.nodes.size();
+  first.log_tp = std::vector<double>(first.log_tp.begin() + choice * nb,
+                                     first.log_tp.begin() + (choice + 1) * nb);
+  update_layer(anchor_, &first);
+  for (int i = 1; i < window_.size(); ++i) {
+    update_layer(window_[i - 1], &window_[i]);
+  }
+};
+
+void FastMapMatchSession::commit_converged(SessionUpdate *update) {
+  int last = window_.size() - 1;
+  // Nodes of each layer on the optimal path of any reachable node
+  std::vector<int> alive;
+  for (int b = 0; b < window_[last].nodes.size(); ++b) {
+    if (window_[last].nodes[b].cumu_prob >
+        -std::numeric_limits<double>::infinity()) {
+      alive.push_back(b);
+    }
+  }
+  int converged = last;
+  while (alive.size() != 1) {
+    if (converged == 0) return;
+    std::vector<int> prev;
+    for (int b : alive) {
+      int a = window_[converged].nodes[b].prev;
+      if (std::find(prev.begin(), prev.end(), a) == prev.end()) {
+        prev.push_back(a);
+      }
+    }
+    alive.swap(prev);
+    --converged;
+  }
+  // The optimal paths share a single chain up to the converged layer
+  std::vector<int> path(converged + 1);
+  path[converged] = alive[0];
+  for (int i = converged; i > 0; --i) {
+    path[i - 1] = window_[i].nodes[path[i]].prev;
+  }
+  commit(path, converged + 1, update);
+};
+
+void FastMapMatchSession::commit_all(SessionUpdate *update) {
+  if (window_.empty()) return;
+  commit(backtrack(best_node(window_.back())), window_.size(), update);
+};
+
+std::vector<int> FastMapMatchSession::backtrack(int last_node) const {
+  int last = window_.size() - 1;
+  std::vector<int> path(window_.size());
+  path[last] = last_node;
+  for (int i = last; i > 0; --i) {
+    path[i - 1] = window_[i].nodes[path[i]].prev;
+  }
+  return path;
+};
+
+int FastMapMatchSession::best_node(const SessionLayer &layer) const {
+  int best = 0;
+  for (int i = 1; i < layer.nodes.size(); ++i) {
+    if (layer.nodes[i].cumu_prob > layer.nodes[best].cumu_prob) best = i;
+  }
+  return best;
+};
+
+void FastMapMatchSession::append_cpath(const Candidate &c,
+                                       SessionUpdate *update) const {
+  if (!has_anchor_) {
+    update->segments.push_back(update->cpath.size());
+    update->cpath.push_back(c.edge->id);
+    return;
+  }
+  const Candidate &a = anchor_.nodes[0].c;
+  if (a.edge->id == c.edge->id &&
+      a.offset - c.offset <= a.edge->length * config_.reverse_tolerance) {
+    return;
+  }
+  std::vector<EdgeIndex> segs = model_.get_sp_path(
+    a.edge->target, c.edge->source);
+  if (segs.empty() && a.edge->target != c.edge->source) {
+    SPDLOG_WARN("Edge {} and edge {} disconnected, start a new segment",
+                a.edge->id, c.edge->id);
+    update->segments.push_back(update->cpath.size());
+  }
+  const std::vector<Edge> &edges = model_.network_.get_edges();
+  for (EdgeIndex e : segs) {
+    update->cpath.push_back(edges[e].id);
+  }
+  update->cpath.push_back(c.edge->id);
+};
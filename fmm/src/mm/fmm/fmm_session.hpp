@@ -0,0 +1,160 @@
+/**
+ * Fast map matching.
+ *
+ * Online map matching session, which matches a stream of GPS points
+ * incrementally with a sliding window of the transition graph.
+ *
+ * @author: Can Yang
+ * @version: 2020.01.31
+ */
+
+#ifndef FMM_FMM_SESSION_HPP_
+#define FMM_FMM_SESSION_HPP_
+
+#include "mm/fmm/fmm_algorithm.hpp"
+
+#include <deque>
+#include <vector>
+
+namespace FMM {
+namespace MM {
+
+/**
+ * The points committed by an update of a session. Once committed, the
+ * match of a point never changes.
+ */
+struct SessionUpdate {
+  std::vector<int> indices; /**< indices of the committed points in the
+                                 stream */
+  O_Path opath; /**< edge matched to each committed point */
+  std::vector<double> offset; /**< offset of each committed point on its
+                                   edge */
+  C_Path cpath; /**< edges appended to the complete path */
+  std::vector<int> segments; /**< positions in cpath where a new segment
+                                  of the complete path starts, i.e., the
+                                  edge is not connected to the previous
+                                  one, the first edge of a session always
+                                  starts a segment */
+  std::vector<int> skipped; /**< indices of the points without any
+                                 candidate, which are ignored */
+};
+
+/**
+ * Online map matching session of FMM.
+ *
+ * The points are appended as they arrive. The transition graph is kept
+ * for a window of the latest points only; the prefix shared by all the
+ * surviving candidates is committed as soon as the paths converge and
+ * the oldest point is committed with the current best path once the
+ * window exceeds max_window points. The work and memory per point are
+ * therefore bounded no matter how long the stream is.
+ */
+class FastMapMatchSession {
+ public:
+  /**
+   * Open a session
+   * @param model the FMM model, which should outlive the session
+   * @param config the configuration of the model
+   * @param max_window the maximum number of points kept in the window
+   */
+  FastMapMatchSession(FastMapMatch &model, const FastMapMatchConfig &config,
+                      int max_window = 32);
+  /**
+   * Append a point to the session
+   * @param x x coordinate
+   * @param y y coordinate
+   * @return the points committed by the new point
+   */
+  SessionUpdate add_point(double x, double y);
+  /**
+   * Append points to the session
+   * @param x x coordinates, x and nx
+   * @param y y coordinates, y and ny
+   * @return the points committed by the new points
+   * @throw std::invalid_argument if nx is not equal to ny
+   */
+  SessionUpdate add_points(const double *x, int nx, const double *y, int ny);
+  /**
+   * Commit all the points in the window with the current best path,
+   * which is called when the stream ends.
+   * @return the points committed
+   */
+  SessionUpdate flush();
+  /**
+   * Get the number of points appended
+   */
+  int get_num_points() const;
+  /**
+   * Get the number of points in the window, which are not committed
+   */
+  int get_window_size() const;
+ private:
+  /**
+   * A candidate in the window
+   */
+  struct SessionNode {
+    Candidate c; /**< Candidate */
+    double ep; /**< emission probability */
+    double cumu_prob; /**< accumulative log probability */
+    int prev; /**< index of the previous optimal node, -1 for none */
+  };
+  /**
+   * The candidates of a point in the window
+   */
+  struct SessionLayer {
+    int index; /**< index of the point in the stream */
+    double x; /**< x coordinate of the point */
+    double y; /**< y coordinate of the point */
+    std::vector<SessionNode> nodes; /**< candidates of the point */
+    /**
+     * log transition probability from node a of the previous layer to
+     * node b, stored at a * nodes.size() + b
+     */
+    std::vector<double> log_tp;
+  };
+  void append_point(double x, double y, SessionUpdate *update);
+  /**
+   * Calculate the transition probabilities from layer a to layer b
+   */
+  void update_tp(const SessionLayer &la, SessionLayer *lb) const;
+  /**
+   * Update the optimal previous nodes of layer b with the transition
+   * probabilities stored in it.
+   * @return true if any node of layer b is reachable
+   */
+  static bool update_layer(const SessionLayer &la, SessionLayer *lb);
+  static void start_layer(SessionLayer *layer);
+  /**
+   * Commit the first n layers in the window whose optimal nodes are
+   * given by path and drop them from the window. The last committed node
+   * becomes the anchor of the window, from which the remaining layers
+   * are updated again.
+   */
+  void commit(const std::vector<int> &path, int n, SessionUpdate *update);
+  /**
+   * Commit the layers shared by the optimal paths of all the reachable
+   * nodes of the last layer.
+   */
+  void commit_converged(SessionUpdate *update);
+  void commit_all(SessionUpdate *update);
+  void append_cpath(const Candidate &c, SessionUpdate *update) const;
+  /**
+   * Backtrack from a node of the last layer
+   * @return the node index in each layer of the window
+   */
+  std::vector<int> backtrack(int last_node) const;
+  int best_node(const SessionLayer &layer) const;
+  FastMapMatch &model_;
+  FastMapMatchConfig config_;
+  int max_window_;
+  int num_points_;
+  std::deque<SessionLayer> window_;
+  bool has_anchor_; /**< whether the current segment has a point
+                         committed */
+  SessionLayer anchor_; /**< the last committed node */
+};
+
+}
+}
+
+#endif //FMM_FMM_SESSION_HPP_
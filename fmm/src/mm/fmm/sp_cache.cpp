@@ -0,0 +1,83 @@
+//
+// Shortest paths searched on demand for the OD pairs missing in the UBODT.
+//
+
+#include "mm/fmm/sp_cache.hpp"
+#include "util/debug.hpp"
+
+#include <limits>
+#include <stdexcept>
+#include <boost/format.hpp>
+
+using namespace FMM;
+using namespace FMM::NETWORK;
+using namespace FMM::MM;
+
+ShortestPathCache::ShortestPathCache(const NetworkGraph &graph, double delta,
+                                     int capacity) :
+  graph_(graph), delta_(delta), capacity_(capacity) {
+  if (delta <= 0 || capacity <= 0) {
+    std::string message = (boost::format(
+      "Invalid shortest path cache delta %1% capacity %2%")
+      % delta % capacity).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+};
+
+unsigned long long ShortestPathCache::cal_key(NodeIndex source,
+                                              NodeIndex target) {
+  return ((unsigned long long) source << 32) | target;
+};
+
+double ShortestPathCache::query(NodeIndex source, NodeIndex target,
+                                std::vector<EdgeIndex> *path,
+                                bool *searched) {
+  unsigned long long key = cal_key(source, target);
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    auto iter = index_.find(key);
+    if (iter != index_.end()) {
+      entries_.splice(entries_.begin(), entries_, iter->second);
+      ++hits_;
+      if (path != nullptr) *path = iter->second->path;
+      if (searched != nullptr) *searched = false;
+      return iter->second->cost;
+    }
+    ++misses_;
+  }
+  double cost;
+  std::vector<EdgeIndex> edges = graph_.shortest_path_upperbound_dijkstra(
+    source, target, delta_, &cost);
+  SPDLOG_TRACE("Search path from {} to {} cost {}", source, target, cost);
+  if (path != nullptr) *path = edges;
+  if (searched != nullptr) *searched = true;
+  std::lock_guard<std::mutex> lock(mutex_);
+  // Another thread may have searched the same pair meanwhile
+  if (index_.find(key) == index_.end()) {
+    entries_.push_front(Entry{key, cost, std::move(edges)});
+    index_[key] = entries_.begin();
+    if (entries_.size() > capacity_) {
+      index_.erase(entries_.back().key);
+      entries_.pop_back();
+      ++evictions_;
+    }
+  }
+  return cost;
+};
+
+ShortestPathCacheStats ShortestPathCache::get_stats() const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return ShortestPathCacheStats{hits_, misses_, evictions_,
+                                (long long) entries_.size(), capacity_,
+                                delta_};
+};
+
+void ShortestPathCache::clear() {
+  std::lock_guard<std::mutex> lock(mutex_);
+  entries_.clear();
+  index_.clear();
+  hits_ = 0;
+  misses_ = 0;
+  evictions_ = 0;
+};
@@ -0,0 +1,105 @@
+/**
+ * Fast map matching.
+ *
+ * Shortest paths searched on demand for the OD pairs missing in the UBODT,
+ * which are kept in a least recently used cache.
+ *
+ * @author: Can Yang
+ * @version: 2020.01.31
+ */
+
+#ifndef FMM_SP_CACHE_HPP_
+#define FMM_SP_CACHE_HPP_
+
+#include "network/network_graph.hpp"
+
+#include <list>
+#include <mutex>
+#include <unordered_map>
+#include <vector>
+
+namespace FMM {
+namespace MM {
+
+/**
+ * Counters of a shortest path cache since it is created or cleared
+ */
+struct ShortestPathCacheStats {
+  long long hits; /**< queries answered by the cache */
+  long long misses; /**< queries searched on the graph */
+  long long evictions; /**< entries evicted as the cache is full */
+  long long size; /**< number of entries in the cache */
+  long long capacity; /**< maximum number of entries */
+  double delta; /**< upper bound of the searches */
+};
+
+/**
+ * A least recently used cache of the shortest paths between OD pairs of
+ * nodes, a pair missing in the cache is searched by Dijkstra with an upper
+ * bound of delta on the graph. The pairs not connected within delta are
+ * cached as well, so that they are not searched again.
+ *
+ * It is used by FastMapMatch as the fallback of the UBODT, whose delta can
+ * then be much smaller. The cache is shared by the threads of a model and
+ * is guarded by a mutex, the searches run outside of it.
+ */
+class ShortestPathCache {
+ public:
+  /**
+   * Create a cache
+   * @param graph road network graph, which should outlive the cache
+   * @param delta upper bound of the searches, in network unit
+   * @param capacity maximum number of OD pairs cached
+   */
+  ShortestPathCache(const NETWORK::NetworkGraph &graph, double delta,
+                    int capacity);
+  ShortestPathCache(const ShortestPathCache &) = delete;
+  ShortestPathCache &operator=(const ShortestPathCache &) = delete;
+  /**
+   * Get the shortest path from source to target
+   * @param source source node
+   * @param target target node
+   * @param path updated to be the edge indices of the path if it is not
+   * null, empty if the path is not found within delta
+   * @param searched set to true if the path is searched on the graph
+   * rather than found in the cache, if it is not null
+   * @return distance from source to target, infinity if it exceeds delta
+   */
+  double query(NETWORK::NodeIndex source, NETWORK::NodeIndex target,
+               std::vector<NETWORK::EdgeIndex> *path = nullptr,
+               bool *searched = nullptr);
+  /**
+   * Get the counters of the cache
+   */
+  ShortestPathCacheStats get_stats() const;
+  /**
+   * Remove all the entries and reset the counters
+   */
+  void clear();
+  inline double get_delta() const {
+    return delta_;
+  };
+ private:
+  struct Entry {
+    unsigned long long key;
+    double cost;
+    std::vector<NETWORK::EdgeIndex> path;
+  };
+  static unsigned long long cal_key(NETWORK::NodeIndex source,
+                                    NETWORK::NodeIndex target);
+  const NETWORK::NetworkGraph &graph_;
+  const double delta_;
+  const int capacity_;
+  // Entries from the most to the least recently used
+  std::list<Entry> entries_;
+  std::unordered_map<unsigned long long, std::list<Entry>::iterator> index_;
+  mutable std::mutex mutex_;
+  long long hits_ = 0;
+  long long misses_ = 0;
+  long long evictions_ = 0;
+};
+
+}
+}
+
+#endif //FMM_SP_CACHE_HPP_
@@ -3,9 +3,12 @@
 //
 
 #include "mm/fmm/ubodt.hpp"
+#include "mm/fmm/sp_cache.hpp"
 #include "util/util.hpp"
 
+#include <cstring>
 #include <fstream>
+#include <limits>
 #include <stdexcept>
 
 #ifdef BOOST_OS_WINDOWS
@@ -13,6 +16,8 @@
 #endif
 #include <boost/format.hpp>
 #include <boost/archive/binary_iarchive.hpp>
+#include <boost/interprocess/file_mapping.hpp>
+#include <boost/interprocess/mapped_region.hpp>
 
 using namespace FMM;
 using namespace FMM::CORE;
@@ -22,7 +27,7 @@ UBODT::UBODT(int buckets_arg, int multiplier_arg) :
     buckets(buckets_arg), multiplier(multiplier_arg) {
   SPDLOG_TRACE("Intialization UBODT with buckets {} multiplier {}",
                buckets, multiplier);
-  hashtable = (Record **) malloc(sizeof(Record *) * buckets);
+  hashtable = (RecordNode **) malloc(sizeof(RecordNode *) * buckets);
   for (int i = 0; i < buckets; i++) {
     hashtable[i] = nullptr;
   }
@@ -34,8 +39,8 @@ UBODT::~UBODT() {
   SPDLOG_TRACE("Clean UBODT");
   int i;
   for (i = 0; i < buckets; ++i) {
-    Record *head = hashtable[i];
-    Record *curr;
+    RecordNode *head = hashtable[i];
+    RecordNode *curr;
     while ((curr = head) != nullptr) {
       head = head->next;
       free(curr);
@@ -46,24 +51,35 @@ UBODT::~UBODT() {
   SPDLOG_TRACE("Clean UBODT finished");
 }
 
-Record *UBODT::look_up(NodeIndex source, NodeIndex target) const {
+const Record *UBODT::look_up(NodeIndex source, NodeIndex target) const {
+  if (flat_table != nullptr) {
+    // Linear probing until the OD pair or an empty slot is found
+    unsigned long long mask = flat_slots - 1;
+    unsigned long long h = cal_flat_slot(source, target, flat_slots);
+    while (flat_table[h].source != std::numeric_limits<NodeIndex>::max()) {
+      const Record &r = flat_table[h];
+      if (r.source == source && r.target == target) return &r;
+      h = (h + 1) & mask;
+    }
+    return nullptr;
+  }
   unsigned int h = cal_bucket_index(source, target);
-  Record *r = hashtable[h];
+  RecordNode *r = hashtable[h];
   while (r != nullptr) {
-    if (r->source == source && r->target == target) {
-      return r;
+    if (r->record.source == source && r->record.target == target) {
+      return &r->record;
     } else {
       r = r->next;
     }
   }
-  return r;
+  return nullptr;
 }
 
 std::vector<EdgeIndex> UBODT::look_sp_path(NodeIndex source,
                                            NodeIndex target) const {
   std::vector<EdgeIndex> edges;
   if (source == target) { return edges; }
-  Record *r = look_up(source, target);
+  const Record *r = look_up(source, target);
   // No transition exist from source to target
   if (r == nullptr) { return edges; }
   while (r->first_n != target) {
@@ -77,7 +93,8 @@ std::vector<EdgeIndex> UBODT::look_sp_path(NodeIndex source,
 C_Path UBODT::construct_complete_path(int traj_id, const TGOpath &path,
                                       const std::vector<Edge> &edges,
                                       std::vector<int> *indices,
-                                      double reverse_tolerance) const {
+                                      double reverse_tolerance,
+                                      ShortestPathCache *fallback) const {
   C_Path cpath;
   if (!indices->empty()) indices->clear();
   if (path.empty()) return cpath;
@@ -94,6 +111,10 @@ C_Path UBODT::construct_complete_path(int traj_id, const TGOpath &path,
         a->edge->length * reverse_tolerance)) {
       // segs stores edge index
       auto segs = look_sp_path(a->edge->target, b->edge->source);
+      if (segs.empty() && a->edge->target != b->edge->source &&
+          fallback != nullptr) {
+        fallback->query(a->edge->target, b->edge->source, &segs);
+      }
       // No transition exist in UBODT
       if (segs.empty() && a->edge->target != b->edge->source) {
         SPDLOG_DEBUG("Edges not found connecting a b");
@@ -137,15 +158,76 @@ unsigned int UBODT::cal_bucket_index(NodeIndex source, NodeIndex target) const {
 }
 
 
-void UBODT::insert(Record *r) {
+unsigned long long UBODT::cal_flat_slot(NodeIndex source, NodeIndex target,
+                                        unsigned long long slots) {
+  // Fibonacci hashing of the OD pair, slots is a power of 2
+  unsigned long long key =
+    ((unsigned long long) source << 32) | (unsigned long long) target;
+  return ((key * 11400714819323198485ull) >> 32) & (slots - 1);
+}
+
+void UBODT::insert(const Record &r) {
+  if (flat_table != nullptr) {
+    std::string message = "Insertion into a memory-mapped UBODT";
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
   //int h = (r->source*multiplier+r->target)%buckets ;
-  int h = cal_bucket_index(r->source, r->target);
-  r->next = hashtable[h];
-  hashtable[h] = r;
-  if (r->cost > delta) delta = r->cost;
+  int h = cal_bucket_index(r.source, r.target);
+  RecordNode *node = (RecordNode *) malloc(sizeof(RecordNode));
+  node->record = r;
+  node->next = hashtable[h];
+  hashtable[h] = node;
+  if (r.cost > delta) delta = r.cost;
   ++num_rows;
 }
 
+void UBODT::write_mmap_file(const std::string &filename) const {
+  SPDLOG_INFO("Write UBODT file (mmap format) to {}", filename);
+  // Keep the load factor of the open addressing table below 0.5
+  unsigned long long slots = 16;
+  while (slots < 2 * (unsigned long long) num_rows) slots *= 2;
+  Record empty{std::numeric_limits<NodeIndex>::max(),
+               std::numeric_limits<NodeIndex>::max(), 0, 0, 0, 0};
+  std::vector<Record> table(slots, empty);
+  auto add_record = [&](const Record &r) {
+    unsigned long long h = cal_flat_slot(r.source, r.target, slots);
+    while (table[h].source != std::numeric_limits<NodeIndex>::max()) {
+      h = (h + 1) & (slots - 1);
+    }
+    table[h] = r;
+  };
+  if (flat_table != nullptr) {
+    for (unsigned long long i = 0; i < flat_slots; ++i) {
+      if (flat_table[i].source != std::numeric_limits<NodeIndex>::max())
+        add_record(flat_table[i]);
+    }
+  } else {
+    for (int i = 0; i < buckets; ++i) {
+      for (RecordNode *r = hashtable[i]; r != nullptr; r = r->next)
+        add_record(r->record);
+    }
+  }
+  FlatUBODTHeader header;
+  memset(&header, 0, sizeof(header));
+  memcpy(header.magic, "FMMUBODT", 8);
+  header.version = FLAT_VERSION;
+  header.record_size = sizeof(Record);
+  header.slots = slots;
+  header.num_rows = num_rows;
+  header.delta = delta;
+  std::ofstream ofs(filename.c_str(), std::ios::binary);
+  ofs.write((const char *) &header, sizeof(header));
+  ofs.write((const char *) table.data(), sizeof(Record) * slots);
+  if (!ofs) {
+    std::string message = (boost::format("Failed to write UBODT file %1%")
+      % filename).str();
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
+  SPDLOG_INFO("Finish writing UBODT with rows {} slots {}", num_rows, slots);
+}
+
 long UBODT::estimate_ubodt_rows(const std::string &filename) {
   struct stat stat_buf;
   long rc = stat(filename.c_str(), &stat_buf);
@@ -190,6 +272,8 @@ std::shared_ptr<UBODT> UBODT::read_ubodt_file(const std::string &filename,
   auto start_time = UTIL::get_current_time();
   if (UTIL::check_file_extension(filename,"bin")){
     ubodt = read_ubodt_binary(filename,multiplier);
+  } else if (UTIL::check_file_extension(filename,"mmap")){
+    ubodt = read_ubodt_mmap(filename);
   } else if (UTIL::check_file_extension(filename,"csv,txt")) {
     ubodt = read_ubodt_csv(filename,multiplier);
   } else {
@@ -219,18 +303,17 @@ std::shared_ptr<UBODT> UBODT::read_ubodt_csv(const std::string &filename,
   }
   while (fgets(line, BUFFER_LINE, stream)) {
     ++NUM_ROWS;
-    Record *r = (Record *) malloc(sizeof(Record));
+    Record r;
     /* Parse line into a Record */
     sscanf(
         line, "%d;%d;%d;%d;%d;%lf",
-        &r->source,
-        &r->target,
-        &r->first_n,
-        &r->prev_n,
-        &r->next_e,
-        &r->cost
+        &r.source,
+        &r.target,
+        &r.first_n,
+        &r.prev_n,
+        &r.next_e,
+        &r.cost
     );
-    r->next = nullptr;
     table->insert(r);
     if (NUM_ROWS % progress_step == 0) {
       SPDLOG_INFO("Read rows {}", NUM_ROWS);
@@ -261,14 +344,13 @@ std::shared_ptr<UBODT> UBODT::read_ubodt_binary(const std::string &filename,
   boost::archive::binary_iarchive ia(ifs);
   while (ifs.tellg() < streamEnd) {
     ++NUM_ROWS;
-    Record *r = (Record *) malloc(sizeof(Record));
-    ia >> r->source;
-    ia >> r->target;
-    ia >> r->first_n;
-    ia >> r->prev_n;
-    ia >> r->next_e;
-    ia >> r->cost;
-    r->next = nullptr;
+    Record r;
+    ia >> r.source;
+    ia >> r.target;
+    ia >> r.first_n;
+    ia >> r.prev_n;
+    ia >> r.next_e;
+    ia >> r.cost;
     table->insert(r);
     if (NUM_ROWS % progress_step == 0) {
       SPDLOG_INFO("Read rows {}", NUM_ROWS);
@@ -283,3 +365,46 @@ std::shared_ptr<UBODT> UBODT::read_ubodt_binary(const std::string &filename,
   SPDLOG_INFO("Finish reading UBODT with rows {}", NUM_ROWS);
   return table;
 }
+
+std::shared_ptr<UBODT> UBODT::read_ubodt_mmap(const std::string &filename) {
+  SPDLOG_INFO("Reading UBODT file (mmap format) from {}", filename);
+  namespace bip = boost::interprocess;
+  std::shared_ptr<bip::mapped_region> region;
+  try {
+    bip::file_mapping mapping(filename.c_str(), bip::read_only);
+    region = std::make_shared<bip::mapped_region>(mapping, bip::read_only);
+  } catch (const bip::interprocess_exception &e) {
+    std::string message = (boost::format("Failed to map UBODT file %1%: %2%")
+      % filename % e.what()).str();
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
+  const char *data = (const char *) region->get_address();
+  size_t size = region->get_size();
+  FlatUBODTHeader header;
+  bool valid = size >= sizeof(header);
+  if (valid) {
+    memcpy(&header, data, sizeof(header));
+    valid = memcmp(header.magic, "FMMUBODT", 8) == 0 &&
+      header.version == FLAT_VERSION &&
+      header.record_size == sizeof(Record) &&
+      header.slots > 0 && (header.slots & (header.slots - 1)) == 0 &&
+      size == sizeof(header) + header.slots * sizeof(Record);
+  }
+  if (!valid) {
+    std::string message = (boost::format("Invalid UBODT mmap file %1%")
+      % filename).str();
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
+  // Lookups are random accesses into the table
+  region->advise(bip::mapped_region::advice_random);
+  std::shared_ptr<UBODT> table = std::make_shared<UBODT>(1, 1);
+  table->region = region;
+  table->flat_table = (const Record *) (data + sizeof(header));
+  table->flat_slots = header.slots;
+  table->num_rows = header.num_rows;
+  table->delta = header.delta;
+  SPDLOG_INFO("Finish reading UBODT with rows {}", table->num_rows);
+  return table;
+}
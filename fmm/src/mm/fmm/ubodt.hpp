@@ -14,9 +14,19 @@
 #include "mm/transition_graph.hpp"
 #include "util/debug.hpp"
 
+#include <memory>
+
+namespace boost {
+namespace interprocess {
+class mapped_region;
+}
+}
+
 namespace FMM {
 namespace MM {
 
+class ShortestPathCache;
+
 /**
  * %Record type of the upper bounded origin destination table
  */
@@ -27,7 +37,20 @@ struct Record {
   NETWORK::NodeIndex prev_n; /**< last node visited before target */
   NETWORK::EdgeIndex next_e; /**< next edge visited from source to target */
   double cost; /**< distance from source to target */
-  Record *next; /**< the next record stored in hashtable */
+};
+
+/**
+ * Header of a flat UBODT file, which is followed by an open addressing
+ * table of %Record with a size of slots.
+ */
+struct FlatUBODTHeader {
+  char magic[8]; /**< file signature FMMUBODT */
+  unsigned int version; /**< version of the file layout */
+  unsigned int record_size; /**< size of a record in bytes */
+  unsigned long long slots; /**< number of slots, a power of 2 */
+  unsigned long long num_rows; /**< number of records stored */
+  double delta; /**< upperbound of the UBODT */
+  char padding[24]; /**< padding the header to 64 bytes */
 };
 
 /**
@@ -52,7 +75,8 @@ class UBODT {
    * @return  A row in the ubodt if the od pair is found, otherwise nullptr
    * is returned.
    */
-  Record *look_up(NETWORK::NodeIndex source, NETWORK::NodeIndex target) const;
+  const Record *look_up(NETWORK::NodeIndex source,
+                        NETWORK::NodeIndex target) const;
 
   /**
    * Look up a shortest path (SP) containing edges from source to target.
@@ -71,6 +95,8 @@ class UBODT {
    * @param path an optimal path
    * @param edges a vector of edges
    * @param indices the index of each optimal edge in the complete path
+   * @param fallback the paths missing in the UBODT are searched in it if
+   * it is not null
    * @return a complete path (topologically connected).
    * If there is a large gap in the optimal
    * path implying complete path cannot be found in UBDOT,
@@ -79,7 +105,8 @@ class UBODT {
   C_Path construct_complete_path(int traj_id, const TGOpath &path,
                                  const std::vector<NETWORK::Edge> &edges,
                                  std::vector<int> *indices,
-                                 double reverse_tolerance) const;
+                                 double reverse_tolerance,
+                                 ShortestPathCache *fallback = nullptr) const;
   /**
    * Get the upperbound of the UBODT
    * @return upperbound value
@@ -98,11 +125,26 @@ class UBODT {
    *  Insert a record into the hash table
    * @param r a record to be inserted
    */
-  void insert(Record *r);
+  void insert(const Record &r);
 
-  inline long long get_num_rows(){
+  inline long long get_num_rows() const{
     return num_rows;
   };
+  /**
+   * Check if the UBODT is a flat table memory-mapped from a file
+   * @return true if the UBODT is read by read_ubodt_mmap
+   */
+  inline bool is_flat() const{
+    return flat_table != nullptr;
+  };
+  /**
+   * Write the UBODT to a flat file, which is an open addressing hash table
+   * of fixed-size records without pointers. The file can be memory-mapped
+   * by read_ubodt_mmap, so that processes reading the same file share
+   * one copy of the table in the page cache.
+   * @param filename output file name, with the extension mmap
+   */
+  void write_mmap_file(const std::string &filename) const;
 
   /**
    * Read UBODT from a file.
@@ -130,6 +172,13 @@ class UBODT {
    */
   static std::shared_ptr<UBODT> read_ubodt_binary(const std::string &filename,
                                                   int multiplier = 50000);
+  /**
+   * Read UBODT from a flat file written by write_mmap_file. The file is
+   * memory-mapped read-only rather than loaded into the memory.
+   * @param  filename   input file name
+   * @return  A shared pointer to the UBODT data.
+   */
+  static std::shared_ptr<UBODT> read_ubodt_mmap(const std::string &filename);
   /**
    * Estimate the number of rows in a file
    * @param  filename input file name
@@ -147,12 +196,29 @@ class UBODT {
                                               a bucket. */
   static const int BUFFER_LINE = 1024; /**< Number of characters to store in
                                             a line */
+  static const unsigned int FLAT_VERSION = 1; /**< Version of flat file */
  private:
+  /**
+   * A record stored in the chained hashtable
+   */
+  struct RecordNode {
+    Record record;
+    RecordNode *next;
+  };
+  /**
+   * Find the first slot to probe for an OD pair in the flat table
+   */
+  static unsigned long long cal_flat_slot(NETWORK::NodeIndex source,
+      NETWORK::NodeIndex target, unsigned long long slots);
   const long long multiplier;   // multiplier to get a unique ID
   const int buckets;   // number of buckets
   long long num_rows=0;   // multiplier to get a unique ID
   double delta = 0.0;
-  Record **hashtable;
+  RecordNode **hashtable;
+  // Flat table memory-mapped from a file
+  std::shared_ptr<boost::interprocess::mapped_region> region;
+  const Record *flat_table = nullptr;
+  unsigned long long flat_slots = 0;
 };
 }
 }
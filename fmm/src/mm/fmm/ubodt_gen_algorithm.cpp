@@ -145,8 +145,7 @@ void UBODTGenAlgorithm::write_result_csv(
            successor,
            prev_node,
            edge_index,
-           dmap[cur_node],
-           nullptr});
+           dmap[cur_node]});
     }
   }
 #pragma omp critical
@@ -194,8 +193,7 @@ void UBODTGenAlgorithm::write_result_binary(boost::archive::binary_oarchive &str
            successor,
            prev_node,
            edge_index,
-           dmap[cur_node],
-           nullptr});
+           dmap[cur_node]});
     }
   }
 #pragma omp critical
@@ -0,0 +1,218 @@
+//
+// Split and stitch trajectories matched piecewise.
+//
+
+#include "mm/mm_split.hpp"
+#include "util/debug.hpp"
+
+#include <algorithm>
+#include <cmath>
+#include <stdexcept>
+#include <boost/format.hpp>
+
+using namespace FMM;
+using namespace FMM::CORE;
+using namespace FMM::PYTHON;
+using namespace FMM::MM;
+
+SplitConfig::SplitConfig(double max_gap, double max_gap_time,
+                         int max_points) :
+  max_gap(max_gap), max_gap_time(max_gap_time), max_points(max_points) {
+};
+
+bool SplitConfig::validate() const {
+  if (max_gap < 0 || max_gap_time < 0 || max_points < 0 || max_points == 1) {
+    SPDLOG_CRITICAL(
+      "Invalid split parameter max gap {} max gap time {} max points {}",
+      max_gap, max_gap_time, max_points);
+    return false;
+  }
+  return true;
+};
+
+std::vector<std::pair<int, int>> FMM::MM::split_trajectory(
+  const double *x, const double *y, const double *ts, int n,
+  const SplitConfig &config) {
+  std::vector<std::pair<int, int>> ranges;
+  if (n <= 0) return ranges;
+  int start = 0;
+  for (int i = 1; i < n; ++i) {
+    double dx = x[i] - x[i - 1];
+    double dy = y[i] - y[i - 1];
+    bool gap = (config.max_gap > 0 &&
+                std::sqrt(dx * dx + dy * dy) > config.max_gap) ||
+      (ts != nullptr && config.max_gap_time > 0 &&
+       ts[i] - ts[i - 1] > config.max_gap_time);
+    if (gap) {
+      ranges.push_back({start, i});
+      start = i;
+    } else if (config.max_points > 1 && i - start + 1 > config.max_points) {
+      // The next segment starts in the overlap with this one
+      ranges.push_back({start, i});
+      start = i - std::max(1, config.max_points / 4);
+    }
+  }
+  ranges.push_back({start, n});
+  SPDLOG_DEBUG("Split {} points into {} segments", n, ranges.size());
+  return ranges;
+};
+
+PyMatchResult FMM::MM::stitch_results(
+  const std::vector<PyMatchResult> &parts,
+  const std::vector<std::pair<int, int>> &ranges,
+  const double *x, const double *y, const NETWORK::Network &network) {
+  return stitch_results(parts, ranges, x, y,
+    std::vector<const NETWORK::Network *>(parts.size(), &network));
+};
+
+PyMatchResult FMM::MM::stitch_results(
+  const std::vector<PyMatchResult> &parts,
+  const std::vector<std::pair<int, int>> &ranges,
+  const double *x, const double *y,
+  const std::vector<const NETWORK::Network *> &networks) {
+  int N = parts.size();
+  // The points [kept_from, kept_to) and the edges [cpath_from, cpath_to)
+  // of each segment which are kept in the output
+  std::vector<int> kept_from(N), kept_to(N), cpath_from(N, 0), cpath_to(N);
+  std::vector<bool> joined(N, false);
+  for (int k = 0; k < N; ++k) {
+    kept_from[k] = ranges[k].first;
+    kept_to[k] = ranges[k].second;
+    cpath_to[k] = parts[k].cpath.size();
+  }
+  for (int k = 0; k + 1 < N; ++k) {
+    int overlap_start = ranges[k + 1].first;
+    int overlap_end = ranges[k].second;
+    if (overlap_start >= overlap_end) continue;
+    const PyMatchResult &a = parts[k];
+    const PyMatchResult &b = parts[k + 1];
+    if (a.cpath.empty() || b.cpath.empty()) {
+      // The matched segment keeps the overlap
+      if (b.cpath.empty()) {
+        kept_from[k + 1] = overlap_end;
+      } else {
+        kept_to[k] = overlap_start;
+      }
+      continue;
+    }
+    int ia = ranges[k].first;
+    int ib = ranges[k + 1].first;
+    int middle = (overlap_start + overlap_end) / 2;
+    int join = -1;
+    for (int d = 0; join < 0 && d < overlap_end - overlap_start; ++d) {
+      for (int p : {middle - d, middle + d}) {
+        if (p >= overlap_start && p < overlap_end &&
+            a.opath[p - ia] == b.opath[p - ib]) {
+          join = p;
+          break;
+        }
+      }
+    }
+    if (join >= 0) {
+      kept_to[k] = join;
+      cpath_to[k] = a.indices[join - ia] + 1;
+      kept_from[k + 1] = join;
+      cpath_from[k + 1] = b.indices[join - ib];
+      joined[k + 1] = true;
+    } else {
+      kept_to[k] = middle;
+      cpath_to[k] = a.indices[middle - 1 - ia] + 1;
+      kept_from[k + 1] = middle;
+      cpath_from[k + 1] = b.indices[middle - ib];
+    }
+  }
+  PyMatchResult output;
+  output.id = 0;
+  // The network of each edge of the output cpath
+  std::vector<const NETWORK::Network *> cpath_networks;
+  // The first point and the first edge of the connected part of the path
+  int run_point = -1;
+  int run_edge = 0;
+  int last_point = -1;
+  auto append_geometry = [&]() {
+    if (run_point < 0) return;
+    CORE::LineString ends;
+    ends.add_point(x[run_point], y[run_point]);
+    ends.add_point(x[last_point], y[last_point]);
+    std::vector<const CORE::LineString *> edge_geoms;
+    for (int j = run_edge; j < output.cpath.size(); ++j) {
+      edge_geoms.push_back(&cpath_networks[j]->get_edge_geom(output.cpath[j]));
+    }
+    CORE::LineString mgeom = NETWORK::Network::edges_to_geometry(ends,
+                                                                 edge_geoms);
+    for (int j = 0; j < mgeom.get_num_points(); ++j) {
+      output.mgeom.add_point(mgeom.get_point(j));
+    }
+    run_point = -1;
+  };
+  for (int k = 0; k < N; ++k) {
+    const PyMatchResult &part = parts[k];
+    PySegment segment{kept_from[k], kept_to[k], (int) output.cpath.size(),
+                      (int) output.cpath.size(), 0, 0};
+    if (part.cpath.empty() || kept_from[k] >= kept_to[k]) {
+      output.segments.push_back(segment);
+      continue;
+    }
+    if (joined[k] && run_point >= 0) {
+      segment.cpath_start = output.cpath.size() - 1;
+      segment.connected = 1;
+      output.cpath.insert(output.cpath.end(),
+                          part.cpath.begin() + cpath_from[k] + 1,
+                          part.cpath.begin() + cpath_to[k]);
+      cpath_networks.resize(output.cpath.size(), networks[k]);
+    } else {
+      append_geometry();
+      run_point = kept_from[k];
+      run_edge = output.cpath.size();
+      output.cpath.insert(output.cpath.end(),
+                          part.cpath.begin() + cpath_from[k],
+                          part.cpath.begin() + cpath_to[k]);
+      cpath_networks.resize(output.cpath.size(), networks[k]);
+    }
+    int start = ranges[k].first;
+    for (int j = kept_from[k] - start; j < kept_to[k] - start; ++j) {
+      output.opath.push_back(part.opath[j]);
+      output.indices.push_back(
+        part.indices[j] - cpath_from[k] + segment.cpath_start);
+      PyCandidate c = part.candidates[j];
+      c.index = start + j;
+      output.candidates.push_back(c);
+      output.pgeom.add_point(part.pgeom.get_point(j));
+    }
+    last_point = kept_to[k] - 1;
+    segment.cpath_end = output.cpath.size();
+    segment.state = 1;
+    output.segments.push_back(segment);
+  }
+  append_geometry();
+  return output;
+};
+
+PyMatchResult FMM::MM::stitch_tiles(
+  const std::vector<PyMatchResult> &parts,
+  const std::vector<int> &starts, const std::vector<int> &ends,
+  const double *x, int nx, const double *y, int ny,
+  const std::vector<const NETWORK::Network *> &networks) {
+  int N = parts.size();
+  bool valid = nx == ny && starts.size() == N && ends.size() == N &&
+               networks.size() == N;
+  for (int k = 0; valid && k < N; ++k) {
+    valid = starts[k] >= 0 && starts[k] < ends[k] && ends[k] <= nx &&
+            networks[k] != nullptr &&
+            (k == 0 || (starts[k] > starts[k - 1] &&
+                        starts[k] <= ends[k - 1] && ends[k] > ends[k - 1])) &&
+            (parts[k].cpath.empty() ||
+             parts[k].opath.size() == ends[k] - starts[k]);
+  }
+  if (!valid) {
+    std::string message = (boost::format(
+      "Inconsistent segments of %1% results for %2% points") % N % nx).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  std::vector<std::pair<int, int>> ranges;
+  for (int k = 0; k < N; ++k) ranges.push_back({starts[k], ends[k]});
+  PyMatchResult output = stitch_results(parts, ranges, x, y, networks);
+  for (const PyMatchResult &part : parts) output.stats.add(part.stats);
+  return output;
+};
@@ -0,0 +1,136 @@
+/**
+ * Fast map matching.
+ *
+ * Split a long or gappy trajectory into segments, which are matched
+ * separately, and stitch the results of the segments back.
+ *
+ * @author: Can Yang
+ * @version: 2020.01.31
+ */
+
+#ifndef FMM_MM_SPLIT_HPP_
+#define FMM_MM_SPLIT_HPP_
+
+#include "network/network.hpp"
+#include "python/pyfmm.hpp"
+
+#include <utility>
+#include <vector>
+
+namespace FMM {
+namespace MM {
+
+/**
+ * Configuration of splitting a trajectory, a value of 0 disables the
+ * corresponding rule.
+ */
+struct SplitConfig {
+  /**
+   * Constructor of split configuration
+   * @param max_gap the maximum distance between two consecutive points of
+   * a segment, in map unit, e.g., the delta of the UBODT
+   * @param max_gap_time the maximum time between two consecutive points of
+   * a segment, in seconds, which is used only if timestamps are given
+   * @param max_points the maximum number of points of a segment, which
+   * should be 0 or at least 2
+   */
+  SplitConfig(double max_gap = 0, double max_gap_time = 0,
+              int max_points = 0);
+  double max_gap; /**< Maximum distance gap */
+  double max_gap_time; /**< Maximum time gap */
+  int max_points; /**< Maximum number of points */
+  /**
+   * Check if the configuration is valid or not
+   * @return true if valid
+   */
+  bool validate() const;
+};
+
+/**
+ * Split a trajectory into segments.
+ *
+ * A segment ends before a gap longer than max_gap or max_gap_time, which
+ * the matching can not bridge. A segment longer than max_points ends
+ * without a gap and overlaps the next segment by a quarter of max_points
+ * (at least one point), so that their paths can be joined in the overlap.
+ *
+ * @param x x coordinates
+ * @param y y coordinates
+ * @param ts timestamps, nullptr if not available
+ * @param n number of points
+ * @param config split configuration
+ * @return the range [start, end) of points of each segment
+ */
+std::vector<std::pair<int, int>> split_trajectory(
+  const double *x, const double *y, const double *ts, int n,
+  const SplitConfig &config);
+
+/**
+ * Stitch the results of the segments into the result of the trajectory.
+ *
+ * A segment is failed if its cpath is empty and its points are left out
+ * of the result. Two overlapping segments are joined at the point of the
+ * overlap closest to its middle that both of them match to the same edge,
+ * otherwise the complete path is broken in the middle of the overlap. The
+ * mgeom is built for each connected part of the complete path and jumps
+ * over the breaks.
+ *
+ * @param parts match results of the segments
+ * @param ranges ranges of the segments returned by split_trajectory
+ * @param x x coordinates of the trajectory
+ * @param y y coordinates of the trajectory
+ * @param network the network matched to
+ * @return match result of the trajectory, whose segments are set
+ */
+PYTHON::PyMatchResult stitch_results(
+  const std::vector<PYTHON::PyMatchResult> &parts,
+  const std::vector<std::pair<int, int>> &ranges,
+  const double *x, const double *y, const NETWORK::Network &network);
+
+/**
+ * Stitch the results of the segments matched on different networks that
+ * share the ids of the edges, e.g., the tiles of a large region, in the
+ * same way as the results matched on one network.
+ *
+ * @param parts match results of the segments
+ * @param ranges ranges of the segments
+ * @param x x coordinates of the trajectory
+ * @param y y coordinates of the trajectory
+ * @param networks the network each segment is matched to
+ * @return match result of the trajectory, whose segments are set
+ */
+PYTHON::PyMatchResult stitch_results(
+  const std::vector<PYTHON::PyMatchResult> &parts,
+  const std::vector<std::pair<int, int>> &ranges,
+  const double *x, const double *y,
+  const std::vector<const NETWORK::Network *> &networks);
+
+/**
+ * Stitch the results of the segments of a trajectory matched on different
+ * networks, which is called from Python with the segments of a trajectory
+ * matched on the tiles of a region.
+ *
+ * Segment k covers the points [starts[k], ends[k]) and the next segment
+ * may overlap it, its result has one entry per point or an empty cpath if
+ * it fails.
+ *
+ * @param parts match results of the segments
+ * @param starts first point of each segment
+ * @param ends one past the last point of each segment
+ * @param x x coordinates of the trajectory, x and nx
+ * @param y y coordinates of the trajectory, y and ny
+ * @param networks the network each segment is matched to
+ * @return match result of the trajectory, whose segments are set and whose
+ * stats are the sum of those of the segments
+ * @throw std::invalid_argument if the sizes or the ranges are inconsistent
+ */
+PYTHON::PyMatchResult stitch_tiles(
+  const std::vector<PYTHON::PyMatchResult> &parts,
+  const std::vector<int> &starts, const std::vector<int> &ends,
+  const double *x, int nx, const double *y, int ny,
+  const std::vector<const NETWORK::Network *> &networks);
+
+}
+}
+
+#endif //FMM_MM_SPLIT_HPP_
@@ -63,6 +63,56 @@ struct MatchedCandidate {
  */
 typedef std::vector<MatchedCandidate> MatchedCandidatePath;
 
+/**
+ * Seconds taken by the stages of matching a trajectory and counters of the
+ * work done, which are collected only if enabled in the model and are zero
+ * otherwise.
+ */
+struct MatchStats {
+  MatchStats() : parse(0), search(0), transition_graph(0), update(0),
+                 backtrack(0), complete_path(0), geometry(0), output(0),
+                 points(0), candidates(0), transitions(0), ubodt_hits(0),
+                 ubodt_misses(0), sp_searches(0), sp_cache_hits(0) {};
+  /**
+   * Add the seconds and counters of another match, e.g., of a segment of
+   * a trajectory matched piecewise.
+   */
+  void add(const MatchStats &other) {
+    parse += other.parse;
+    search += other.search;
+    transition_graph += other.transition_graph;
+    update += other.update;
+    backtrack += other.backtrack;
+    complete_path += other.complete_path;
+    geometry += other.geometry;
+    output += other.output;
+    points += other.points;
+    candidates += other.candidates;
+    transitions += other.transitions;
+    ubodt_hits += other.ubodt_hits;
+    ubodt_misses += other.ubodt_misses;
+    sp_searches += other.sp_searches;
+    sp_cache_hits += other.sp_cache_hits;
+  };
+  double parse; /**< parsing the input into a trajectory */
+  double search; /**< searching the candidates */
+  double transition_graph; /**< building the transition graph */
+  double update; /**< updating the probabilities of the transition graph */
+  double backtrack; /**< backtracking the optimal path */
+  double complete_path; /**< building the complete path */
+  double geometry; /**< building the geometry of the complete path */
+  double output; /**< building the result in the Python API format */
+  int points; /**< number of points */
+  int candidates; /**< number of candidates of all the points */
+  int transitions; /**< number of transitions between candidates evaluated */
+  int ubodt_hits; /**< UBODT lookups found, FMM only */
+  int ubodt_misses; /**< UBODT lookups not found, FMM only */
+  int sp_searches; /**< bounded shortest path searches of STMATCH or of the
+                        UBODT fallback of FMM */
+  int sp_cache_hits; /**< UBODT misses found in the fallback cache, FMM
+                          only */
+};
+
 /**
  * Map matched result representation
  */
@@ -79,6 +129,7 @@ struct MatchResult {
                      trajectory.  */
   std::vector<int> indices; /**< index of opath edge in cpath */
   CORE::LineString mgeom; /**< the geometry of the matched path */
+  MatchStats stats; /**< stage timings and counters of the match */
 };
 
 };
@@ -5,7 +5,10 @@
 #include "io/gps_reader.hpp"
 #include "io/mm_writer.hpp"
 
+#include <omp.h>
 #include <limits>
+#include <stdexcept>
+#include <boost/format.hpp>
 
 using namespace FMM;
 using namespace FMM::CORE;
@@ -93,16 +96,109 @@ bool STMATCHConfig::validate() const {
 
 PyMatchResult STMATCH::match_wkt(
   const std::string &wkt, const STMATCHConfig &config) {
+  UTIL::StageTimer timer;
   LineString line = wkt2linestring(wkt);
   std::vector<double> timestamps;
   Trajectory traj{0, line, timestamps};
+  double parse = timer.lap();
   MatchResult result = match_traj(traj, config);
+  timer.lap();
+  PyMatchResult output = to_py_match_result(result);
+  if (stats_enabled_) {
+    output.stats.parse = parse;
+    output.stats.output = timer.lap();
+  }
+  return output;
+};
+
+PyMatchResult STMATCH::match_coords(
+  const double *x, int nx, const double *y, int ny,
+  const double *ts, int nts, const STMATCHConfig &config) {
+  if (nx != ny || (nts != 0 && nts != nx)) {
+    std::string message = (boost::format(
+      "Inconsistent coordinate sizes x %1% y %2% timestamps %3%")
+      % nx % ny % nts).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  UTIL::StageTimer timer;
+  LineString line = coords2linestring(x, y, nx);
+  std::vector<double> timestamps(ts, ts + nts);
+  Trajectory traj{0, line, timestamps};
+  double parse = timer.lap();
+  MatchResult result = match_traj(traj, config);
+  timer.lap();
+  PyMatchResult output = to_py_match_result(result);
+  if (stats_enabled_) {
+    output.stats.parse = parse;
+    output.stats.output = timer.lap();
+  }
+  return output;
+};
+
+PyMatchResult STMATCH::match_split(
+  const double *x, int nx, const double *y, int ny,
+  const double *ts, int nts, const STMATCHConfig &config,
+  const SplitConfig &split_config, int n_threads) {
+  if (nx != ny || (nts != 0 && nts != nx)) {
+    std::string message = (boost::format(
+      "Inconsistent coordinate sizes x %1% y %2% timestamps %3%")
+      % nx % ny % nts).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  if (!split_config.validate()) {
+    throw std::invalid_argument("Invalid split configuration");
+  }
+  std::vector<std::pair<int, int>> ranges = split_trajectory(
+    x, y, nts == 0 ? nullptr : ts, nx, split_config);
+  int N = ranges.size();
+  if (n_threads <= 0) n_threads = omp_get_max_threads();
+  std::vector<PyMatchResult> parts(N);
+  #pragma omp parallel for num_threads(n_threads) schedule(dynamic)
+  for (int i = 0; i < N; ++i) {
+    int start = ranges[i].first;
+    int n = ranges[i].second - start;
+    try {
+      parts[i] = match_coords(x + start, n, y + start, n,
+                              nts == 0 ? ts : ts + start, nts == 0 ? 0 : n,
+                              config);
+    } catch (const std::exception &e) {
+      SPDLOG_WARN("Segment {} of trajectory not matched: {}", i, e.what());
+    }
+  }
+  PyMatchResult output = stitch_results(parts, ranges, x, y, network_);
+  for (const PyMatchResult &part : parts) output.stats.add(part.stats);
+  return output;
+};
+
+std::vector<PyMatchResult> STMATCH::match_batch(
+  const std::vector<std::string> &wkts, const STMATCHConfig &config,
+  int n_threads) {
+  int N = wkts.size();
+  if (n_threads <= 0) n_threads = omp_get_max_threads();
+  std::vector<PyMatchResult> results(N);
+  #pragma omp parallel for num_threads(n_threads) schedule(dynamic)
+  for (int i = 0; i < N; ++i) {
+    try {
+      results[i] = match_wkt(wkts[i], config);
+    } catch (const std::exception &e) {
+      SPDLOG_WARN("Trajectory {} in batch not matched: {}", i, e.what());
+      results[i].error = e.what();
+    }
+    results[i].id = i;
+  }
+  return results;
+};
+
+PyMatchResult STMATCH::to_py_match_result(const MatchResult &result) const {
   PyMatchResult output;
   output.id = result.id;
   output.opath = result.opath;
   output.cpath = result.cpath;
   output.mgeom = result.mgeom;
   output.indices = result.indices;
+  output.stats = result.stats;
   for (int i = 0; i < result.opt_candidate_path.size(); ++i) {
     const MatchedCandidate &mc = result.opt_candidate_path[i];
     output.candidates.push_back(
@@ -126,23 +222,38 @@ PyMatchResult STMATCH::match_wkt(
 MatchResult STMATCH::match_traj(const Trajectory &traj,
                                 const STMATCHConfig &config) {
   SPDLOG_DEBUG("Count of points in trajectory {}", traj.geom.get_num_points());
+  MatchStats stats;
+  MatchStats *stats_ptr = stats_enabled_ ? &stats : nullptr;
+  UTIL::StageTimer timer;
   SPDLOG_DEBUG("Search candidates");
   Traj_Candidates tc = network_.search_tr_cs_knn(
     traj.geom, config.k, config.radius);
   SPDLOG_DEBUG("Trajectory candidate {}", tc);
-  if (tc.empty()) return MatchResult{};
+  if (stats_enabled_) {
+    stats.search = timer.lap();
+    stats.points = traj.geom.get_num_points();
+    for (const Point_Candidates &pc : tc) stats.candidates += pc.size();
+  }
+  if (tc.empty()) {
+    MatchResult result{};
+    result.stats = stats;
+    return result;
+  }
   SPDLOG_DEBUG("Generate dummy graph");
   DummyGraph dg(tc, config.reverse_tolerance);
   SPDLOG_DEBUG("Generate composite_graph");
   CompositeGraph cg(graph_, dg);
   SPDLOG_DEBUG("Generate composite_graph");
   TransitionGraph tg(tc, config.gps_error);
+  if (stats_enabled_) stats.transition_graph = timer.lap();
   SPDLOG_DEBUG("Update cost in transition graph");
   // The network will be used internally to update transition graph
-  update_tg(&tg, cg, traj, config);
+  update_tg(&tg, cg, traj, config, stats_ptr);
+  if (stats_enabled_) stats.update = timer.lap();
   SPDLOG_DEBUG("Optimal path inference");
   TGOpath tg_opath = tg.backtrack();
   SPDLOG_DEBUG("Optimal path size {}", tg_opath.size());
+  if (stats_enabled_) stats.backtrack = timer.lap();
   MatchedCandidatePath matched_candidate_path(tg_opath.size());
   std::transform(tg_opath.begin(), tg_opath.end(),
                  matched_candidate_path.begin(),
@@ -159,13 +270,17 @@ MatchResult STMATCH::match_traj(const Trajectory &traj,
   });
   std::vector<int> indices;
   C_Path cpath = build_cpath(tg_opath, &indices, config.reverse_tolerance);
+  if (stats_enabled_) stats.complete_path = timer.lap();
   SPDLOG_DEBUG("Opath is {}", opath);
   SPDLOG_DEBUG("Indices is {}", indices);
   SPDLOG_DEBUG("Complete path is {}", cpath);
   LineString mgeom = network_.complete_path_to_geometry(
     traj.geom, cpath);
-  return MatchResult{
+  if (stats_enabled_) stats.geometry = timer.lap();
+  MatchResult result{
     traj.id, matched_candidate_path, opath, cpath, indices, mgeom};
+  result.stats = stats;
+  return result;
 }
 
 std::string STMATCH::match_gps_file(
@@ -257,7 +372,8 @@ std::string STMATCH::match_gps_file(
 void STMATCH::update_tg(TransitionGraph *tg,
                         const CompositeGraph &cg,
                         const Trajectory &traj,
-                        const STMATCHConfig &config) {
+                        const STMATCHConfig &config,
+                        MatchStats *stats) {
   SPDLOG_DEBUG("Update transition graph");
   std::vector<TGLayer> &layers = tg->get_layers();
   std::vector<double> eu_dists = ALGORITHM::cal_eu_dist(traj.geom);
@@ -272,7 +388,7 @@ void STMATCH::update_tg(TransitionGraph *tg,
       delta = config.factor * config.vmax * duration;
     }
     update_layer(i, &(layers[i]), &(layers[i + 1]),
-                 cg, eu_dists[i], delta);
+                 cg, eu_dists[i], delta, stats);
   }
   SPDLOG_DEBUG("Update transition graph done");
 }
@@ -280,9 +396,14 @@ void STMATCH::update_tg(TransitionGraph *tg,
 void STMATCH::update_layer(int level, TGLayer *la_ptr, TGLayer *lb_ptr,
                            const CompositeGraph &cg,
                            double eu_dist,
-                           double delta) {
+                           double delta,
+                           MatchStats *stats) {
   SPDLOG_DEBUG("Update layer {} starts", level);
   TGLayer &lb = *lb_ptr;
+  if (stats != nullptr) {
+    stats->transitions += la_ptr->size() * lb_ptr->size();
+    stats->sp_searches += la_ptr->size();
+  }
   for (auto iter_a = la_ptr->begin(); iter_a != la_ptr->end(); ++iter_a) {
     NodeIndex source = iter_a->c->index;
     // SPDLOG_TRACE("  Calculate distance from source {}", source);
@@ -13,6 +13,7 @@
 #include "network/network_graph.hpp"
 #include "mm/composite_graph.hpp"
 #include "mm/transition_graph.hpp"
+#include "mm/mm_split.hpp"
 #include "mm/mm_type.hpp"
 #include "python/pyfmm.hpp"
 #include "config/gps_config.hpp"
@@ -88,7 +89,22 @@ public:
    * Create a stmatch model from network and graph
    */
   STMATCH(const NETWORK::Network &network, const NETWORK::NetworkGraph &graph) :
-    network_(network), graph_(graph) {
+    network_(network), graph_(graph), stats_enabled_(false) {
+  };
+  /**
+   * Enable or disable the collection of the stage timings and counters
+   * (MatchStats) of the matches, which are zero if disabled.
+   * @param enabled true to collect the statistics
+   */
+  void set_stats_enabled(bool enabled) {
+    stats_enabled_ = enabled;
+  };
+  /**
+   * Check if the statistics of the matches are collected
+   * @return true if the statistics are collected
+   */
+  bool get_stats_enabled() const {
+    return stats_enabled_;
   };
   /**
    * Match a wkt linestring to the road network.
@@ -98,6 +114,61 @@ public:
    */
   PYTHON::PyMatchResult match_wkt(
     const std::string &wkt,const STMATCHConfig &config);
+  /**
+   * Match a trajectory stored in contiguous coordinate arrays to the road
+   * network, which avoids formatting and parsing a WKT string.
+   * @param x x coordinates of the points
+   * @param nx number of x coordinates
+   * @param y y coordinates of the points
+   * @param ny number of y coordinates, which should be equal to nx
+   * @param ts timestamps of the points
+   * @param nts number of timestamps, which should be 0 or equal to nx
+   * @param config Map matching configuration
+   * @return Map matching result in POD format used in Python API
+   */
+  PYTHON::PyMatchResult match_coords(
+    const double *x, int nx, const double *y, int ny,
+    const double *ts, int nts, const STMATCHConfig &config);
+  /**
+   * Match a long or gappy trajectory piecewise.
+   *
+   * The trajectory is split into segments by split_trajectory, which are
+   * matched in parallel by OpenMP threads and stitched back into one
+   * result by stitch_results, whose segments field gives the range of
+   * points and edges of each segment.
+   * @param x x coordinates of the points
+   * @param nx number of x coordinates
+   * @param y y coordinates of the points
+   * @param ny number of y coordinates, which should be equal to nx
+   * @param ts timestamps of the points
+   * @param nts number of timestamps, which should be 0 or equal to nx
+   * @param config Map matching configuration
+   * @param split_config Split configuration
+   * @param n_threads number of threads, if it is not positive,
+   * the default number of OpenMP threads is used.
+   * @return Map matching result in POD format used in Python API
+   */
+  PYTHON::PyMatchResult match_split(
+    const double *x, int nx, const double *y, int ny,
+    const double *ts, int nts, const STMATCHConfig &config,
+    const SplitConfig &split_config, int n_threads = 0);
+  /**
+   * Match a batch of wkt linestrings to the road network in parallel.
+   *
+   * The trajectories are distributed over OpenMP threads, which share the
+   * network and graph of this model. A trajectory failing to be matched,
+   * e.g., due to an invalid wkt, gets an empty result whose error tells why
+   * and does not affect the others.
+   * @param wkts WKT representations of the trajectories
+   * @param config Map matching configuration
+   * @param n_threads number of threads, if it is not positive,
+   * the default number of OpenMP threads is used.
+   * @return Map matching results in POD format used in Python API, the id
+   * of each result is the index of the trajectory in wkts.
+   */
+  std::vector<PYTHON::PyMatchResult> match_batch(
+    const std::vector<std::string> &wkts, const STMATCHConfig &config,
+    int n_threads = 0);
   /**
    * Match a trajectory to the road network
    * @param  traj   input trajector data
@@ -127,11 +198,14 @@ protected:
    * @param cg composition graph
    * @param traj raw trajectory
    * @param config map match configuration
+   * @param stats statistics where the transitions and the searches are
+   * counted if it is not null
    */
   void update_tg(TransitionGraph *tg,
                  const CompositeGraph &cg,
                  const CORE::Trajectory &traj,
-                 const STMATCHConfig &config);
+                 const STMATCHConfig &config,
+                 MatchStats *stats = nullptr);
   /**
    * Update probabilities between two layers a and b in the transition graph
    * @param level   the index of layer a
@@ -140,11 +214,14 @@ protected:
    * @param cg      Composition graph
    * @param eu_dist Euclidean distance between two observed point
    * @param delta   An upper bound to limit the search
+   * @param stats   statistics where the transitions and the searches are
+   * counted if it is not null
    */
   void update_layer(int level, TGLayer *la_ptr, TGLayer *lb_ptr,
                     const CompositeGraph &cg,
                     double eu_dist,
-                    double delta);
+                    double delta,
+                    MatchStats *stats = nullptr);
 
   /**
    * Return distances from source to all targets and with an upper bound of
@@ -173,9 +250,16 @@ protected:
    */
   C_Path build_cpath(const TGOpath &tg_opath, std::vector<int> *indices,
                      double reverse_tolerance=0);
+  /**
+   * Convert a map matching result into the POD format used in Python API
+   * @param result map matching result
+   * @return Map matching result in POD format used in Python API
+   */
+  PYTHON::PyMatchResult to_py_match_result(const MatchResult &result) const;
 private:
   const NETWORK::Network &network_;
   const NETWORK::NetworkGraph &graph_;
+  bool stats_enabled_;
 };// STMATCH
 }
 } // FMM
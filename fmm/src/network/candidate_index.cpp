@@ -0,0 +1,223 @@
+//
+// Uniform grid index of the edges near each cell for the candidate search.
+//
+
+#include "network/candidate_index.hpp"
+#include "network/network.hpp"
+#include "algorithm/geom_algorithm.hpp"
+#include "util/debug.hpp"
+
+#include <algorithm>
+#include <cmath>
+#include <cstring>
+#include <fstream>
+#include <limits>
+#include <stdexcept>
+#include <boost/format.hpp>
+#include <boost/geometry.hpp>
+
+using namespace FMM;
+using namespace FMM::CORE;
+using namespace FMM::NETWORK;
+
+std::shared_ptr<CandidateIndex> CandidateIndex::build(
+  const Network &network, double radius, double cell_size) {
+  if (radius <= 0) {
+    std::string message = (boost::format(
+      "Invalid candidate index radius %1%") % radius).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  if (cell_size <= 0) cell_size = radius / 2;
+  SPDLOG_INFO("Build candidate index radius {} cell size {}",
+              radius, cell_size);
+  std::shared_ptr<CandidateIndex> index(new CandidateIndex());
+  index->radius_ = radius;
+  index->cell_size_ = cell_size;
+  const std::vector<Edge> &edges = network.get_edges();
+  index->num_edges_ = edges.size();
+  index->offsets_.push_back(0);
+  if (edges.empty()) return index;
+  std::vector<Network::boost_box> boxes(edges.size());
+  double min_x = std::numeric_limits<double>::max();
+  double min_y = std::numeric_limits<double>::max();
+  double max_x = std::numeric_limits<double>::lowest();
+  double max_y = std::numeric_limits<double>::lowest();
+  for (std::size_t i = 0; i < edges.size(); ++i) {
+    double x1, y1, x2, y2;
+    ALGORITHM::boundingbox_geometry(edges[i].geom, &x1, &y1, &x2, &y2);
+    boxes[i] = Network::boost_box(Point(x1, y1), Point(x2, y2));
+    min_x = std::min(min_x, x1);
+    min_y = std::min(min_y, y1);
+    max_x = std::max(max_x, x2);
+    max_y = std::max(max_y, y2);
+  }
+  // A point outside of the grid is farther than the radius from any edge
+  index->origin_x_ = min_x - radius;
+  index->origin_y_ = min_y - radius;
+  double nx = std::floor((max_x + radius - index->origin_x_) / cell_size) + 1;
+  double ny = std::floor((max_y + radius - index->origin_y_) / cell_size) + 1;
+  if (nx * ny > (double) std::numeric_limits<unsigned int>::max()) {
+    std::string message = (boost::format(
+      "Candidate index cell size %1% is too small for the network extent")
+      % cell_size).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  index->nx_ = nx;
+  index->ny_ = ny;
+  // The cells are slightly enlarged so that a point rounded into a cell
+  // is always covered by it.
+  double margin = cell_size * 1e-9;
+  std::vector<std::pair<unsigned long long, EdgeIndex>> pairs;
+  for (std::size_t i = 0; i < edges.size(); ++i) {
+    const Point &lower = boxes[i].min_corner();
+    const Point &upper = boxes[i].max_corner();
+    long long ix1 = std::floor((boost::geometry::get<0>(lower) - radius -
+      index->origin_x_) / cell_size);
+    long long iy1 = std::floor((boost::geometry::get<1>(lower) - radius -
+      index->origin_y_) / cell_size);
+    long long ix2 = std::floor((boost::geometry::get<0>(upper) + radius -
+      index->origin_x_) / cell_size);
+    long long iy2 = std::floor((boost::geometry::get<1>(upper) + radius -
+      index->origin_y_) / cell_size);
+    ix1 = std::max(ix1, 0LL);
+    iy1 = std::max(iy1, 0LL);
+    ix2 = std::min(ix2, (long long) index->nx_ - 1);
+    iy2 = std::min(iy2, (long long) index->ny_ - 1);
+    for (long long iy = iy1; iy <= iy2; ++iy) {
+      for (long long ix = ix1; ix <= ix2; ++ix) {
+        double x = index->origin_x_ + ix * cell_size;
+        double y = index->origin_y_ + iy * cell_size;
+        Network::boost_box cell(Point(x - margin, y - margin),
+                                Point(x + cell_size + margin,
+                                      y + cell_size + margin));
+        if (boost::geometry::distance(
+              cell, edges[i].geom.get_geometry_const()) <= radius) {
+          pairs.push_back({iy * index->nx_ + ix, (EdgeIndex) i});
+        }
+      }
+    }
+  }
+  std::sort(pairs.begin(), pairs.end());
+  index->entries_.reserve(pairs.size());
+  for (std::size_t i = 0; i < pairs.size(); ++i) {
+    if (i == 0 || pairs[i].first != pairs[i - 1].first) {
+      if (i > 0) index->offsets_.push_back(i);
+      index->keys_.push_back(pairs[i].first);
+    }
+    index->entries_.push_back(pairs[i].second);
+  }
+  if (!pairs.empty()) index->offsets_.push_back(pairs.size());
+  index->build_cell_map();
+  SPDLOG_INFO("Finish building candidate index with cells {} entries {}",
+              index->keys_.size(), index->entries_.size());
+  return index;
+};
+
+std::shared_ptr<CandidateIndex> CandidateIndex::read(
+  const std::string &filename, const Network &network) {
+  SPDLOG_INFO("Read candidate index from file {}", filename);
+  std::ifstream ifs(filename.c_str(), std::ios::binary);
+  CandidateIndexHeader header;
+  ifs.read((char *) &header, sizeof(header));
+  if (!ifs || memcmp(header.magic, "FMMCANDX", 8) != 0 ||
+      header.version != VERSION) {
+    std::string message = (boost::format(
+      "Invalid candidate index %1%, regenerate it from the network")
+      % filename).str();
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
+  if (header.num_edges != network.get_edge_count()) {
+    std::string message = (boost::format(
+      "Candidate index %1% has %2% edges but the network has %3%, "
+      "regenerate it from the network")
+      % filename % header.num_edges % network.get_edge_count()).str();
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
+  std::shared_ptr<CandidateIndex> index(new CandidateIndex());
+  index->radius_ = header.radius;
+  index->cell_size_ = header.cell_size;
+  index->origin_x_ = header.origin_x;
+  index->origin_y_ = header.origin_y;
+  index->nx_ = header.nx;
+  index->ny_ = header.ny;
+  index->num_edges_ = header.num_edges;
+  index->keys_.resize(header.num_cells);
+  index->offsets_.resize(header.num_cells + 1);
+  ifs.read((char *) index->keys_.data(),
+           sizeof(unsigned long long) * index->keys_.size());
+  ifs.read((char *) index->offsets_.data(),
+           sizeof(unsigned long long) * index->offsets_.size());
+  if (ifs) {
+    index->entries_.resize(index->offsets_.back());
+    ifs.read((char *) index->entries_.data(),
+             sizeof(EdgeIndex) * index->entries_.size());
+  }
+  if (!ifs || std::any_of(
+        index->entries_.begin(), index->entries_.end(),
+        [&header](EdgeIndex e) { return e >= header.num_edges; })) {
+    std::string message = (boost::format("Candidate index %1% is truncated")
+      % filename).str();
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
+  index->build_cell_map();
+  SPDLOG_INFO("Read candidate index done with cells {} entries {}",
+              index->keys_.size(), index->entries_.size());
+  return index;
+};
+
+void CandidateIndex::write(const std::string &filename) const {
+  SPDLOG_INFO("Write candidate index to {}", filename);
+  CandidateIndexHeader header;
+  memset(&header, 0, sizeof(header));
+  memcpy(header.magic, "FMMCANDX", 8);
+  header.version = VERSION;
+  header.num_edges = num_edges_;
+  header.nx = nx_;
+  header.ny = ny_;
+  header.radius = radius_;
+  header.cell_size = cell_size_;
+  header.origin_x = origin_x_;
+  header.origin_y = origin_y_;
+  header.num_cells = keys_.size();
+  std::ofstream ofs(filename.c_str(), std::ios::binary);
+  ofs.write((const char *) &header, sizeof(header));
+  ofs.write((const char *) keys_.data(),
+            sizeof(unsigned long long) * keys_.size());
+  ofs.write((const char *) offsets_.data(),
+            sizeof(unsigned long long) * offsets_.size());
+  ofs.write((const char *) entries_.data(),
+            sizeof(EdgeIndex) * entries_.size());
+  if (!ofs) {
+    std::string message = (boost::format("Failed to write candidate index %1%")
+      % filename).str();
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
+};
+
+const EdgeIndex *CandidateIndex::look_up(double x, double y,
+                                         std::size_t *count) const {
+  *count = 0;
+  double fx = std::floor((x - origin_x_) / cell_size_);
+  double fy = std::floor((y - origin_y_) / cell_size_);
+  if (!(fx >= 0 && fx < nx_ && fy >= 0 && fy < ny_)) return nullptr;
+  auto iter = cell_map_.find((unsigned long long) fy * nx_ +
+                             (unsigned long long) fx);
+  if (iter == cell_map_.end()) return nullptr;
+  unsigned int i = iter->second;
+  *count = offsets_[i + 1] - offsets_[i];
+  return entries_.data() + offsets_[i];
+};
+
+void CandidateIndex::build_cell_map() {
+  cell_map_.clear();
+  cell_map_.reserve(keys_.size());
+  for (unsigned int i = 0; i < keys_.size(); ++i) {
+    cell_map_.insert({keys_[i], i});
+  }
+};
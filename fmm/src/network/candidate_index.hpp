@@ -0,0 +1,139 @@
+/**
+ * Fast map matching.
+ *
+ * Precomputed index of the edges near each cell of a uniform grid over the
+ * network, which replaces the Rtree query in the candidate search.
+ *
+ * @author: Can Yang
+ * @version: 2020.01.31
+ */
+
+#ifndef FMM_CANDIDATE_INDEX_HPP_
+#define FMM_CANDIDATE_INDEX_HPP_
+
+#include "network/type.hpp"
+
+#include <memory>
+#include <string>
+#include <unordered_map>
+#include <vector>
+
+namespace FMM {
+namespace NETWORK {
+
+class Network;
+
+/**
+ * Header of a candidate index file, which is followed by the keys of the
+ * cells, the offsets of their edges and the edge indices.
+ */
+struct CandidateIndexHeader {
+  char magic[8]; /**< file signature FMMCANDX */
+  unsigned int version; /**< version of the file layout */
+  unsigned int num_edges; /**< number of edges of the network */
+  unsigned int nx; /**< number of columns of the grid */
+  unsigned int ny; /**< number of rows of the grid */
+  double radius; /**< radius the index is built for */
+  double cell_size; /**< side length of a cell */
+  double origin_x; /**< x coordinate of the lower left corner */
+  double origin_y; /**< y coordinate of the lower left corner */
+  unsigned long long num_cells; /**< number of cells with any edge */
+};
+
+/**
+ * A uniform grid over the network where each cell stores the indices of
+ * the edges within a radius of any point in the cell, so the edges within
+ * the radius of a point are found by a hash probe of its cell followed by
+ * the projection to those edges. It gives exactly the candidates of the
+ * Rtree query for any search radius not larger than the one it is built
+ * for, and is used by Network::search_tr_cs_knn once it is set by
+ * Network::set_candidate_index.
+ *
+ * Only the cells with any edge are stored, the edge indices of all cells
+ * are kept in one array in the order of the cells.
+ */
+class CandidateIndex {
+ public:
+  /**
+   * Build the index of a network
+   * @param network road network
+   * @param radius the largest search radius served by the index
+   * @param cell_size side length of a cell, half of the radius if it
+   * is not positive
+   * @return the index
+   * @throw std::invalid_argument if the radius is not positive
+   */
+  static std::shared_ptr<CandidateIndex> build(const Network &network,
+                                               double radius,
+                                               double cell_size = 0);
+  /**
+   * Read an index from a file written by write
+   * @param filename index file
+   * @param network the network the index is built for
+   * @return the index
+   * @throw std::runtime_error if the file is invalid, truncated or built
+   * for another network
+   */
+  static std::shared_ptr<CandidateIndex> read(const std::string &filename,
+                                              const Network &network);
+  /**
+   * Write the index to a binary file
+   * @param filename index file
+   */
+  void write(const std::string &filename) const;
+  /**
+   * Get the edges within the radius of any point in the cell of a point
+   * @param x x coordinate of the point
+   * @param y y coordinate of the point
+   * @param count updated to be the number of edges
+   * @return pointer to the edge indices in ascending order, nullptr if
+   * there is none
+   */
+  const EdgeIndex *look_up(double x, double y, std::size_t *count) const;
+  inline double get_radius() const {
+    return radius_;
+  };
+  inline double get_cell_size() const {
+    return cell_size_;
+  };
+  /**
+   * Get the number of cells with any edge
+   */
+  inline long long get_num_cells() const {
+    return keys_.size();
+  };
+  /**
+   * Get the number of edge indices stored in all cells
+   */
+  inline long long get_num_entries() const {
+    return entries_.size();
+  };
+  /**
+   * Version of the index file layout
+   */
+  static const unsigned int VERSION = 1;
+ private:
+  CandidateIndex() = default;
+  /**
+   * Build the hash table of the cells from the keys
+   */
+  void build_cell_map();
+  double radius_ = 0;
+  double cell_size_ = 0;
+  double origin_x_ = 0;
+  double origin_y_ = 0;
+  unsigned int nx_ = 0;
+  unsigned int ny_ = 0;
+  unsigned int num_edges_ = 0;
+  // Key iy * nx + ix of a cell to its position in keys_
+  std::unordered_map<unsigned long long, unsigned int> cell_map_;
+  std::vector<unsigned long long> keys_;
+  // The edges of cell i are entries_[offsets_[i], offsets_[i+1])
+  std::vector<unsigned long long> offsets_;
+  std::vector<EdgeIndex> entries_;
+};
+
+}
+}
+
+#endif //FMM_CANDIDATE_INDEX_HPP_
@@ -7,6 +7,9 @@
 #include <math.h> // Calulating probability
 #include <algorithm> // Partial sort copy
 #include <stdexcept>
+#include <fstream>
+#include <cstring>
+#include <memory>
 
 // Data structures for Rtree
 #include <boost/geometry/index/rtree.hpp>
@@ -33,6 +36,8 @@ Network::Network(const std::string &filename,
                  const std::string &target_name) {
   if (FMM::UTIL::check_file_extension(filename, "shp")) {
     read_ogr_file(filename,id_name,source_name,target_name);
+  } else if (FMM::UTIL::check_file_extension(filename, "snap")) {
+    read_snapshot(filename);
   } else {
     std::string message = (boost::format("Network file not supported %1%") % filename).str();
     SPDLOG_CRITICAL(message);
@@ -40,6 +45,56 @@ Network::Network(const std::string &filename,
   }
 };
 
+Network *Network::from_arrays(const long long *ids, int nids,
+                              const long long *sources, int nsources,
+                              const long long *targets, int ntargets,
+                              const double *coords, int ncoords,
+                              const long long *offsets, int noffsets,
+                              int srid) {
+  if (nsources != nids || ntargets != nids || noffsets != nids + 1) {
+    std::string message = (boost::format(
+      "Inconsistent sizes of ids %1% sources %2% targets %3% offsets %4%, "
+      "offsets should have one more value than ids")
+      % nids % nsources % ntargets % noffsets).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  if (offsets[0] != 0 || 2 * offsets[nids] != ncoords) {
+    std::string message = (boost::format(
+      "Offsets should start at 0 and end at %1%, the number of points")
+      % (ncoords / 2)).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  std::unique_ptr<Network> network(new Network());
+  network->srid = srid;
+  network->edges.reserve(nids);
+  for (int i = 0; i < nids; ++i) {
+    if (offsets[i + 1] - offsets[i] < 2) {
+      std::string message = (boost::format(
+        "Edge %1% has less than 2 points") % ids[i]).str();
+      SPDLOG_CRITICAL(message);
+      throw std::invalid_argument(message);
+    }
+    if (network->edge_map.find(ids[i]) != network->edge_map.end()) {
+      std::string message = (boost::format(
+        "Edge id %1% is duplicated") % ids[i]).str();
+      SPDLOG_CRITICAL(message);
+      throw std::invalid_argument(message);
+    }
+    LineString geom;
+    for (long long j = offsets[i]; j < offsets[i + 1]; ++j) {
+      geom.add_point(coords[2 * j], coords[2 * j + 1]);
+    }
+    network->add_edge(ids[i], sources[i], targets[i], geom);
+  }
+  network->num_vertices = network->node_id_vec.size();
+  SPDLOG_INFO("Number of edges {} nodes {}", network->edges.size(),
+              network->num_vertices);
+  network->build_rtree_index();
+  return network.release();
+}
+
 void Network::add_edge(EdgeID edge_id, NodeID source, NodeID target,
                        const FMM::CORE::LineString &geom){
   NodeIndex s_idx, t_idx;
@@ -174,6 +229,123 @@ void Network::read_ogr_file(const std::string &filename,
   SPDLOG_INFO("Read network done.");
 }    // Network constructor
 
+void Network::save_snapshot(const std::string &filename) const {
+  SPDLOG_INFO("Write network snapshot to {}", filename);
+  unsigned long long num_edges = edges.size();
+  unsigned long long num_nodes = node_id_vec.size();
+  std::vector<EdgeID> ids(num_edges);
+  std::vector<NodeIndex> sources(num_edges), targets(num_edges);
+  std::vector<double> lengths(num_edges);
+  std::vector<unsigned long long> offsets(num_edges + 1, 0);
+  for (std::size_t i = 0; i < num_edges; ++i) {
+    ids[i] = edges[i].id;
+    sources[i] = edges[i].source;
+    targets[i] = edges[i].target;
+    lengths[i] = edges[i].length;
+    offsets[i + 1] = offsets[i] + edges[i].geom.get_num_points();
+  }
+  std::vector<double> coords(2 * offsets[num_edges]);
+  for (std::size_t i = 0; i < num_edges; ++i) {
+    const LineString &geom = edges[i].geom;
+    for (int j = 0; j < geom.get_num_points(); ++j) {
+      coords[2 * (offsets[i] + j)] = geom.get_x(j);
+      coords[2 * (offsets[i] + j) + 1] = geom.get_y(j);
+    }
+  }
+  std::vector<double> points(2 * num_nodes);
+  for (std::size_t i = 0; i < num_nodes; ++i) {
+    points[2 * i] = boost::geometry::get<0>(vertex_points[i]);
+    points[2 * i + 1] = boost::geometry::get<1>(vertex_points[i]);
+  }
+  NetworkSnapshotHeader header;
+  memset(&header, 0, sizeof(header));
+  memcpy(header.magic, "FMMNETSN", 8);
+  header.version = SNAPSHOT_VERSION;
+  header.srid = srid;
+  header.num_nodes = num_nodes;
+  header.num_edges = num_edges;
+  header.num_points = offsets[num_edges];
+  std::ofstream ofs(filename.c_str(), std::ios::binary);
+  ofs.write((const char *) &header, sizeof(header));
+  ofs.write((const char *) node_id_vec.data(), sizeof(NodeID) * num_nodes);
+  ofs.write((const char *) points.data(), sizeof(double) * points.size());
+  ofs.write((const char *) ids.data(), sizeof(EdgeID) * num_edges);
+  ofs.write((const char *) sources.data(), sizeof(NodeIndex) * num_edges);
+  ofs.write((const char *) targets.data(), sizeof(NodeIndex) * num_edges);
+  ofs.write((const char *) lengths.data(), sizeof(double) * num_edges);
+  ofs.write((const char *) offsets.data(),
+            sizeof(unsigned long long) * offsets.size());
+  ofs.write((const char *) coords.data(), sizeof(double) * coords.size());
+  if (!ofs) {
+    std::string message = (boost::format("Failed to write network snapshot %1%")
+      % filename).str();
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
+  SPDLOG_INFO("Finish writing network snapshot with edges {} nodes {}",
+              num_edges, num_nodes);
+}
+
+void Network::read_snapshot(const std::string &filename) {
+  SPDLOG_INFO("Read network snapshot from file {}", filename);
+  std::ifstream ifs(filename.c_str(), std::ios::binary);
+  NetworkSnapshotHeader header;
+  ifs.read((char *) &header, sizeof(header));
+  if (!ifs || memcmp(header.magic, "FMMNETSN", 8) != 0 ||
+      header.version != SNAPSHOT_VERSION) {
+    std::string message = (boost::format(
+      "Invalid network snapshot %1%, regenerate it from the shapefile")
+      % filename).str();
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
+  unsigned long long num_nodes = header.num_nodes;
+  unsigned long long num_edges = header.num_edges;
+  srid = header.srid;
+  node_id_vec.resize(num_nodes);
+  std::vector<double> points(2 * num_nodes);
+  std::vector<EdgeID> ids(num_edges);
+  std::vector<NodeIndex> sources(num_edges), targets(num_edges);
+  std::vector<double> lengths(num_edges);
+  std::vector<unsigned long long> offsets(num_edges + 1);
+  std::vector<double> coords(2 * header.num_points);
+  ifs.read((char *) node_id_vec.data(), sizeof(NodeID) * num_nodes);
+  ifs.read((char *) points.data(), sizeof(double) * points.size());
+  ifs.read((char *) ids.data(), sizeof(EdgeID) * num_edges);
+  ifs.read((char *) sources.data(), sizeof(NodeIndex) * num_edges);
+  ifs.read((char *) targets.data(), sizeof(NodeIndex) * num_edges);
+  ifs.read((char *) lengths.data(), sizeof(double) * num_edges);
+  ifs.read((char *) offsets.data(),
+           sizeof(unsigned long long) * offsets.size());
+  ifs.read((char *) coords.data(), sizeof(double) * coords.size());
+  if (!ifs || offsets[num_edges] != header.num_points) {
+    std::string message = (boost::format("Network snapshot %1% is truncated")
+      % filename).str();
+    SPDLOG_CRITICAL(message);
+    throw std::runtime_error(message);
+  }
+  node_map.reserve(num_nodes);
+  vertex_points.reserve(num_nodes);
+  for (NodeIndex i = 0; i < num_nodes; ++i) {
+    node_map.insert({node_id_vec[i], i});
+    vertex_points.push_back(Point(points[2 * i], points[2 * i + 1]));
+  }
+  edges.reserve(num_edges);
+  edge_map.reserve(num_edges);
+  for (EdgeIndex i = 0; i < num_edges; ++i) {
+    LineString geom;
+    for (unsigned long long j = offsets[i]; j < offsets[i + 1]; ++j) {
+      geom.add_point(coords[2 * j], coords[2 * j + 1]);
+    }
+    edges.push_back({i, ids[i], sources[i], targets[i], lengths[i], geom});
+    edge_map.insert({ids[i], i});
+  }
+  num_vertices = num_nodes;
+  SPDLOG_INFO("Number of edges {} nodes {}", edges.size(), num_vertices);
+  build_rtree_index();
+  SPDLOG_INFO("Read network snapshot done.");
+}
+
 int Network::get_node_count() const {
   return node_id_vec.size();
 }
@@ -221,17 +393,75 @@ void Network::build_rtree_index() {
   // Build an rtree for candidate search
   SPDLOG_DEBUG("Create boost rtree");
   // create some Items
+  std::vector<Item> items;
+  items.reserve(edges.size());
   for (std::size_t i = 0; i < edges.size(); ++i) {
     // create a boost_box
     Edge *edge = &edges[i];
     double x1, y1, x2, y2;
     ALGORITHM::boundingbox_geometry(edge->geom, &x1, &y1, &x2, &y2);
     boost_box b(Point(x1, y1), Point(x2, y2));
-    rtree.insert(std::make_pair(b, edge));
+    items.push_back(std::make_pair(b, edge));
   }
+  // The packing constructor bulk loads the items, which is much faster
+  // than inserting them one by one and gives a better balanced tree.
+  rtree = Rtree(items.begin(), items.end());
   SPDLOG_DEBUG("Create boost rtree done");
 }
 
+void Network::set_candidate_index(std::shared_ptr<CandidateIndex> index) {
+  if (index != nullptr) {
+    SPDLOG_INFO("Search candidates within {} by the candidate index",
+                index->get_radius());
+  }
+  candidate_index = index;
+}
+
+std::shared_ptr<CandidateIndex> Network::get_candidate_index() const {
+  return candidate_index;
+}
+
+std::vector<EdgeIndex> Network::get_edges_in_box(double min_x, double min_y,
+                                                  double max_x,
+                                                  double max_y) const {
+  boost_box b(Point(min_x, min_y), Point(max_x, max_y));
+  std::vector<EdgeIndex> indices;
+  rtree.query(boost::geometry::index::intersects(b),
+              boost::make_function_output_iterator([&indices](const Item &item) {
+                indices.push_back(item.second->index);
+              }));
+  std::sort(indices.begin(), indices.end());
+  return indices;
+}
+
+Network *Network::extract(const std::vector<EdgeIndex> &indices) const {
+  std::vector<EdgeIndex> sorted(indices);
+  std::sort(sorted.begin(), sorted.end());
+  sorted.erase(std::unique(sorted.begin(), sorted.end()), sorted.end());
+  if (!sorted.empty() && sorted.back() >= edges.size()) {
+    std::string message = (boost::format(
+      "Edge index %1% is out of range of %2% edges")
+      % sorted.back() % edges.size()).str();
+    SPDLOG_CRITICAL(message);
+    throw std::invalid_argument(message);
+  }
+  std::unique_ptr<Network> network(new Network());
+  network->srid = srid;
+  network->edges.reserve(sorted.size());
+  for (EdgeIndex index : sorted) {
+    const Edge &edge = edges[index];
+    network->add_edge(edge.id, node_id_vec[edge.source],
+                      node_id_vec[edge.target], edge.geom);
+    // The costs of the paths are the same as in this network
+    network->edges.back().length = edge.length;
+  }
+  network->num_vertices = network->node_id_vec.size();
+  SPDLOG_INFO("Extract edges {} nodes {}", network->edges.size(),
+              network->num_vertices);
+  network->build_rtree_index();
+  return network.release();
+}
+
 Traj_Candidates Network::search_tr_cs_knn(Trajectory &trajectory, std::size_t k,
                                           double radius) const {
   return search_tr_cs_knn(trajectory.geom, k, radius);
@@ -242,24 +472,15 @@ Traj_Candidates Network::search_tr_cs_knn(const LineString &geom, std::size_t k,
   int NumberPoints = geom.get_num_points();
   Traj_Candidates tr_cs(NumberPoints);
   unsigned int current_candidate_index = num_vertices;
+  bool use_index = candidate_index != nullptr &&
+                   radius <= candidate_index->get_radius();
   for (int i = 0; i < NumberPoints; ++i) {
     // SPDLOG_DEBUG("Search candidates for point index {}",i);
     // Construct a bounding boost_box
     double px = geom.get_x(i);
     double py = geom.get_y(i);
     Point_Candidates pcs;
-    boost_box b(Point(geom.get_x(i) - radius, geom.get_y(i) - radius),
-                Point(geom.get_x(i) + radius, geom.get_y(i) + radius));
-    std::vector<Item> temp;
-    // Rtree can only detect intersect with a the bounding box of
-    // the geometry stored.
-    rtree.query(boost::geometry::index::intersects(b),
-                std::back_inserter(temp));
-    int Nitems = temp.size();
-    for (unsigned int j = 0; j < Nitems; ++j) {
-      // Check for detailed intersection
-      // The two edges are all in OGR_linestring
-      Edge *edge = temp[j].second;
+    auto add_candidate = [&](const Edge *edge) {
       double offset;
       double dist;
       double closest_x, closest_y;
@@ -267,13 +488,34 @@ Traj_Candidates Network::search_tr_cs_knn(const LineString &geom, std::size_t k,
                                     &dist, &offset, &closest_x, &closest_y);
       if (dist <= radius) {
         // index, offset, dist, edge, pseudo id, point
+        // The edge is not modified by the candidate
         Candidate c = {0,
                        offset,
                        dist,
-                       edge,
+                       const_cast<Edge *>(edge),
                        Point(closest_x, closest_y)};
         pcs.push_back(c);
       }
+    };
+    if (use_index) {
+      // The edges within the index radius of the cell
+      std::size_t count;
+      const EdgeIndex *cell = candidate_index->look_up(px, py, &count);
+      for (std::size_t j = 0; j < count; ++j) {
+        add_candidate(&edges[cell[j]]);
+      }
+    } else {
+      boost_box b(Point(geom.get_x(i) - radius, geom.get_y(i) - radius),
+                  Point(geom.get_x(i) + radius, geom.get_y(i) + radius));
+      std::vector<Item> temp;
+      // Rtree can only detect intersect with a the bounding box of
+      // the geometry stored.
+      rtree.query(boost::geometry::index::intersects(b),
+                  std::back_inserter(temp));
+      for (const Item &item : temp) {
+        // Check for detailed intersection
+        add_candidate(item.second);
+      }
     }
     SPDLOG_DEBUG("Candidate count point {}: {} (filter to k)",i,pcs.size());
     if (pcs.empty()) {
@@ -305,16 +547,26 @@ const LineString &Network::get_edge_geom(EdgeID edge_id) const {
 
 LineString Network::complete_path_to_geometry(
   const LineString &traj, const C_Path &complete_path) const {
+  std::vector<const LineString *> edge_geoms;
+  edge_geoms.reserve(complete_path.size());
+  for (EdgeID edge_id : complete_path) {
+    edge_geoms.push_back(&get_edge_geom(edge_id));
+  }
+  return edges_to_geometry(traj, edge_geoms);
+}
+
+LineString Network::edges_to_geometry(
+  const LineString &traj, const std::vector<const LineString *> &edge_geoms) {
   // if (complete_path->empty()) return nullptr;
   LineString line;
-  if (complete_path.empty()) return line;
+  if (edge_geoms.empty()) return line;
   int Npts = traj.get_num_points();
-  int NCsegs = complete_path.size();
+  int NCsegs = edge_geoms.size();
   if (NCsegs == 1) {
     double dist;
     double firstoffset;
     double lastoffset;
-    const LineString &firstseg = get_edge_geom(complete_path[0]);
+    const LineString &firstseg = *edge_geoms[0];
     ALGORITHM::linear_referencing(traj.get_x(0), traj.get_y(0), firstseg,
                                   &dist, &firstoffset);
     ALGORITHM::linear_referencing(traj.get_x(Npts - 1), traj.get_y(Npts - 1),
@@ -323,8 +575,8 @@ LineString Network::complete_path_to_geometry(
                                                           lastoffset);
     append_segs_to_line(&line, firstlineseg, 0);
   } else {
-    const LineString &firstseg = get_edge_geom(complete_path[0]);
-    const LineString &lastseg = get_edge_geom(complete_path[NCsegs - 1]);
+    const LineString &firstseg = *edge_geoms[0];
+    const LineString &lastseg = *edge_geoms[NCsegs - 1];
     double dist;
     double firstoffset;
     double lastoffset;
@@ -337,8 +589,7 @@ LineString Network::complete_path_to_geometry(
     append_segs_to_line(&line, firstlineseg, 0);
     if (NCsegs > 2) {
       for (int i = 1; i < NCsegs - 1; ++i) {
-        const LineString &middleseg = get_edge_geom(complete_path[i]);
-        append_segs_to_line(&line, middleseg, 1);
+        append_segs_to_line(&line, *edge_geoms[i], 1);
       }
     }
     append_segs_to_line(&line, lastlineseg, 1);
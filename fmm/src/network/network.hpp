@@ -14,6 +14,7 @@
 #include "config/network_config.hpp"
 #include "core/gps.hpp"
 #include "mm/mm_type.hpp"
+#include "network/candidate_index.hpp"
 #include <ogrsf_frmts.h> // C++ API for GDAL
 #include <iostream>
 #include <math.h> // Calulating probability
@@ -31,6 +32,21 @@ namespace FMM {
  * Classes related with network and graph
  */
 namespace NETWORK {
+/**
+ * Header of a network snapshot file, which is followed by the arrays of
+ * node ids, vertex points, edge ids, sources, targets, lengths, point
+ * offsets and coordinates of the edges.
+ */
+struct NetworkSnapshotHeader {
+  char magic[8]; /**< file signature FMMNETSN */
+  unsigned int version; /**< version of the file layout */
+  int srid; /**< spatial reference id */
+  unsigned long long num_nodes; /**< number of nodes */
+  unsigned long long num_edges; /**< number of edges */
+  unsigned long long num_points; /**< number of points of all edges */
+  char padding[24]; /**< padding the header to 64 bytes */
+};
+
 /**
  * Road network class
  */
@@ -53,6 +69,7 @@ public:
    *  Constructor of Network
    *
    *  @param filename: the path to a network file in ESRI shapefile format
+   *  or a snapshot file with extension snap written by save_snapshot
    *  @param id_name: the name of the id field
    *  @param source_name: the name of the source field
    *  @param target_name: the name of the target field
@@ -66,6 +83,29 @@ public:
         );
   Network(const CONFIG::NetworkConfig &config):Network(
     config.file,config.id,config.source,config.target){};
+  /**
+   * Build a network from in-memory arrays, e.g., the edges of an osmnx
+   * graph, without reading any file.
+   *
+   * The points of edge i are the coordinates x0,y0,x1,y1,... in
+   * coords[2*offsets[i], 2*offsets[i+1]).
+   *
+   * @param ids edge ids, ids and nids
+   * @param sources source node ids, sources and nsources
+   * @param targets target node ids, targets and ntargets
+   * @param coords flat coordinates of all edges, coords and ncoords
+   * @param offsets point offsets of the edges, with nids + 1 values
+   * @param srid spatial reference id
+   * @return a network owned by the caller
+   * @throw std::invalid_argument if the array sizes are inconsistent,
+   * an edge has less than 2 points or an edge id is duplicated
+   */
+  static Network *from_arrays(const long long *ids, int nids,
+                              const long long *sources, int nsources,
+                              const long long *targets, int ntargets,
+                              const double *coords, int ncoords,
+                              const long long *offsets, int noffsets,
+                              int srid = 4326);
   /**
    * Get number of nodes in the network
    * @return number of nodes
@@ -83,6 +123,26 @@ public:
    * @return a constant reference to the edges
    */
   const std::vector<Edge> &get_edges() const;
+  /**
+   * Get the edges whose bounding boxes intersect a box
+   * @param min_x minimum x of the box
+   * @param min_y minimum y of the box
+   * @param max_x maximum x of the box
+   * @param max_y maximum y of the box
+   * @return edge indices in ascending order
+   */
+  std::vector<EdgeIndex> get_edges_in_box(double min_x, double min_y,
+                                          double max_x, double max_y) const;
+  /**
+   * Extract a part of the network, e.g., a tile of a large region. The
+   * edges keep their ids, nodes, lengths and geometries and are indexed in
+   * the ascending order of their indices in this network.
+   *
+   * @param indices edge indices of the part, duplicates are ignored
+   * @return a network owned by the caller
+   * @throw std::invalid_argument if an edge index is out of range
+   */
+  Network *extract(const std::vector<EdgeIndex> &indices) const;
   /**
    * Get edge ID from index
    * @param index index of edge
@@ -141,6 +201,20 @@ public:
   FMM::MM::Traj_Candidates search_tr_cs_knn(const FMM::CORE::LineString &geom,
                                             std::size_t k,
                                             double radius) const;
+  /**
+   * Set the index of the candidate search, which replaces the Rtree query
+   * for any search radius not larger than the radius of the index.
+   * The candidates found are the same.
+   *
+   * @param index candidate index built for this network, nullptr to
+   * search the Rtree again
+   */
+  void set_candidate_index(std::shared_ptr<CandidateIndex> index);
+  /**
+   * Get the index of the candidate search
+   * @return the index, nullptr if it is not set
+   */
+  std::shared_ptr<CandidateIndex> get_candidate_index() const;
   /**
    * Get edge geometry
    * @param edge_id edge id
@@ -156,6 +230,16 @@ public:
   FMM::CORE::LineString complete_path_to_geometry(
     const FMM::CORE::LineString &traj,
     const MM::C_Path &complete_path) const;
+  /**
+   * Extract the geometry of a complete path given by the geometries of its
+   * edges, whose two end segment will be clipped according to the input
+   * trajectory, e.g., for a path made of the edges of several networks
+   * @param traj input trajectory
+   * @param edge_geoms geometries of the edges of the complete path
+   */
+  static FMM::CORE::LineString edges_to_geometry(
+    const FMM::CORE::LineString &traj,
+    const std::vector<const FMM::CORE::LineString *> &edge_geoms);
   /**
    * Get all node geometry
    * @return a vector of points
@@ -189,7 +273,28 @@ public:
   static bool candidate_compare(const MM::Candidate &a, const MM::Candidate &b);
   void add_edge(EdgeID edge_id, NodeID source, NodeID target,
     const FMM::CORE::LineString &geom);
+  /**
+   * Save the network into a binary snapshot file, which is loaded by
+   * the constructor with a few sequential reads instead of parsing
+   * the shapefile.
+   *
+   * @param filename the snapshot file, with extension snap
+   */
+  void save_snapshot(const std::string &filename) const;
+  /**
+   * Version of the snapshot file layout
+   */
+  static const unsigned int SNAPSHOT_VERSION = 1;
 private:
+  /**
+   * Empty network filled by from_arrays
+   */
+  Network() : srid(4326), num_vertices(0) {};
+  /**
+   * Read the network from a snapshot file
+   * @param filename snapshot file written by save_snapshot
+   */
+  void read_snapshot(const std::string &filename);
   void read_ogr_file(const std::string &filename,
                      const std::string &id_name,
                      const std::string &source_name,
@@ -206,7 +311,8 @@ private:
                                   const FMM::CORE::LineString &segs,
                                   int offset = 0);
   /**
-   * Build rtree for the network
+   * Build rtree for the network, which is bulk loaded with the packing
+   * algorithm
    */
   void build_rtree_index();
   int srid;   // Spatial reference id
@@ -217,6 +323,7 @@ private:
   NodeIndexMap node_map;
   EdgeIndexMap edge_map;
   std::vector<FMM::CORE::Point> vertex_points;
+  std::shared_ptr<CandidateIndex> candidate_index;
 }; // Network
 } // NETWORK
 } // FMM
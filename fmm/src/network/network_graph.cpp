@@ -8,6 +8,8 @@
 #include <algorithm>
 #include <unordered_map>
 #include <queue>
+#include <stdexcept>
+#include <boost/format.hpp>
 
 using namespace FMM;
 using namespace FMM::CORE;
@@ -231,6 +233,115 @@ int NetworkGraph::get_edge_index(
   return result;
 };
 
+std::vector<EdgeIndex> NetworkGraph::shortest_path_upperbound_dijkstra(
+  NodeIndex source, NodeIndex target, double delta, double *cost) const {
+  *cost = std::numeric_limits<double>::infinity();
+  if (source == target) {
+    *cost = 0;
+    return {};
+  }
+  if (source >= num_vertices || target >= num_vertices) return {};
+  Heap Q;
+  PredecessorMap pmap;
+  DistanceMap dmap;
+  // Initialization
+  Q.push(source, 0);
+  pmap.insert({source, source});
+  dmap.insert({source, 0});
+  OutEdgeIterator out_i, out_end;
+  double temp_dist = 0;
+  bool reached = false;
+  // Dijkstra search
+  while (!Q.empty()) {
+    HeapNode node = Q.top();
+    Q.pop();
+    NodeIndex u = node.index;
+    if (node.value > delta) break;
+    if (u == target) {
+      reached = true;
+      break;
+    }
+    for (boost::tie(out_i, out_end) = boost::out_edges(u, g);
+         out_i != out_end; ++out_i) {
+      EdgeDescriptor e = *out_i;
+      NodeIndex v = boost::target(e, g);
+      temp_dist = node.value + g[e].length;
+      auto iter = dmap.find(v);
+      if (iter != dmap.end()) {
+        // dmap contains node v
+        if (iter->second > temp_dist) {
+          // a smaller distance is found for v
+          pmap[v] = u;
+          dmap[v] = temp_dist;
+          Q.decrease_key(v, temp_dist);
+        }
+      } else if (temp_dist <= delta) {
+        Q.push(v, temp_dist);
+        pmap.insert({v, u});
+        dmap.insert({v, temp_dist});
+      }
+    }
+  }
+  if (!reached) return {};
+  *cost = dmap[target];
+  return back_track(source, target, pmap, dmap);
+}
+
+std::vector<EdgeIndex> NetworkGraph::get_edges_within_dist(
+  const std::vector<EdgeIndex> &edges, double delta) const {
+  const std::vector<Edge> &all_edges = network.get_edges();
+  std::vector<bool> selected(all_edges.size(), false);
+  Heap Q;
+  DistanceMap dmap;
+  // Initialization with all the nodes of the edges at distance 0
+  for (EdgeIndex index : edges) {
+    if (index >= all_edges.size()) {
+      std::string message = (boost::format(
+        "Edge index %1% is out of range of %2% edges")
+        % index % all_edges.size()).str();
+      SPDLOG_CRITICAL(message);
+      throw std::invalid_argument(message);
+    }
+    selected[index] = true;
+    for (NodeIndex u : {all_edges[index].source, all_edges[index].target}) {
+      if (dmap.find(u) == dmap.end()) {
+        Q.push(u, 0);
+        dmap.insert({u, 0});
+      }
+    }
+  }
+  OutEdgeIterator out_i, out_end;
+  // Dijkstra search, an edge is selected if it ends within delta
+  while (!Q.empty()) {
+    HeapNode node = Q.top();
+    Q.pop();
+    NodeIndex u = node.index;
+    for (boost::tie(out_i, out_end) = boost::out_edges(u, g);
+         out_i != out_end; ++out_i) {
+      EdgeDescriptor e = *out_i;
+      double temp_dist = node.value + g[e].length;
+      if (temp_dist > delta) continue;
+      selected[g[e].index] = true;
+      NodeIndex v = boost::target(e, g);
+      auto iter = dmap.find(v);
+      if (iter == dmap.end()) {
+        Q.push(v, temp_dist);
+        dmap.insert({v, temp_dist});
+      } else if (iter->second > temp_dist) {
+        iter->second = temp_dist;
+        Q.decrease_key(v, temp_dist);
+      }
+    }
+  }
+  std::vector<EdgeIndex> result;
+  for (EdgeIndex i = 0; i < selected.size(); ++i) {
+    if (selected[i]) result.push_back(i);
+  }
+  SPDLOG_DEBUG("Edges within {} of {} edges: {}", delta, edges.size(),
+               result.size());
+  return result;
+};
+
 void NetworkGraph::single_source_upperbound_dijkstra(NodeIndex s,
                                                      double delta,
                                                      PredecessorMap *pmap,
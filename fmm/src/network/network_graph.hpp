@@ -85,6 +85,32 @@ public:
                                          double delta,
                                          PredecessorMap *pmap,
                                          DistanceMap *dmap) const;
+  /**
+   * Dijkstra Shortest path query from source to target with an upper bound,
+   * the search stops once the target is reached or the distance exceeds
+   * delta.
+   * @param source source node
+   * @param target target node
+   * @param delta upper bound of the distance
+   * @param cost updated to be the distance of the path found, infinity if
+   * the target is not reached within delta
+   * @return a vector of edge index representing the path from source to
+   * target, empty if it is not found or source equals target
+   */
+  std::vector<EdgeIndex> shortest_path_upperbound_dijkstra(
+    NodeIndex source, NodeIndex target, double delta, double *cost) const;
+  /**
+   * Get the edges on the paths no longer than delta starting from the nodes
+   * of some edges, by Dijkstra from all of those nodes. A part of the
+   * network made of these edges holds the shortest paths within delta
+   * from any of the nodes, e.g., for a UBODT generated on a tile.
+   * @param edges edge indices whose nodes are the sources
+   * @param delta upper bound of the paths
+   * @return edge indices in ascending order, including the given edges
+   * @throw std::invalid_argument if an edge index is out of range
+   */
+  std::vector<EdgeIndex> get_edges_within_dist(
+    const std::vector<EdgeIndex> &edges, double delta) const;
   /**
    *  Find the edge index given a pair of nodes and its cost,
    *  if not found, return -1
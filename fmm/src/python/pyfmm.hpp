@@ -12,6 +12,8 @@
 
 #include "mm/mm_type.hpp"
 
+#include <string>
+
 namespace FMM{
 /**
  * Data type for Python API
@@ -33,6 +35,20 @@ struct PyCandidate{
   double spdist; /**< shortest path distance from previous matched candidate */
 };
 
+/**
+ * POD segment type used in Python API, a trajectory matched piecewise is
+ * split into segments, each of them is matched separately.
+ */
+struct PySegment {
+  int start; /**< Index of the first point of the segment */
+  int end; /**< Index after the last point of the segment */
+  int cpath_start; /**< Index of the first edge of the segment in cpath */
+  int cpath_end; /**< Index after the last edge of the segment in cpath */
+  int state; /**< 1 if the segment is matched, 0 otherwise */
+  int connected; /**< 1 if the path of the segment continues the path of
+                      the previous segment, 0 if it is broken */
+};
+
 /**
  * POD Match result type used in Python API
  */
@@ -44,6 +60,11 @@ struct PyMatchResult {
   std::vector<int> indices; /**< index of matched edge in the cpath */
   CORE::LineString mgeom; /**< Geometry of the matched path */
   CORE::LineString pgeom; /**< Point position matched for each GPS point */
+  std::vector<PySegment> segments; /**< Segments of a trajectory matched
+                                        piecewise, empty otherwise */
+  MM::MatchStats stats; /**< Stage timings and counters of the match */
+  std::string error; /**< Why a trajectory of a batch is not matched if its
+                          input is invalid, empty otherwise */
 };
 }; // PYTHON
 }; // FMM
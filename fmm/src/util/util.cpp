@@ -86,6 +86,17 @@ double get_duration(const TimePoint &t1,const TimePoint &t2){
       std::chrono::milliseconds>(t2 - t1).count() / 1000.;
 };
 
+StageTimer::StageTimer() : last_(std::chrono::steady_clock::now()) {
+};
+
+double StageTimer::lap() {
+  std::chrono::steady_clock::time_point now =
+    std::chrono::steady_clock::now();
+  double seconds = std::chrono::duration<double>(now - last_).count();
+  last_ = now;
+  return seconds;
+};
+
 // Print a timestamp
 void print_time(
     const TimePoint &timestamp) {
@@ -108,6 +108,23 @@ void print_time(
  */
 double get_duration(const TimePoint &t1,const TimePoint &t2);
 
+/**
+ * A stopwatch timing the stages of a procedure one after another with a
+ * monotonic clock of sub millisecond resolution
+ */
+class StageTimer {
+ public:
+  StageTimer();
+  /**
+   * Get the seconds since the last lap (or the construction) and start the
+   * next lap
+   * @return duration in seconds
+   */
+  double lap();
+ private:
+  std::chrono::steady_clock::time_point last_;
+};
+
 /**
  * Check if file exist or not
  * @param  filename file name
@@ -4,6 +4,7 @@
 #include "util/debug.hpp"
 #include "network/network.hpp"
 #include "mm/fmm/fmm_algorithm.hpp"
+#include "mm/fmm/fmm_session.hpp"
 #include "mm/transition_graph.hpp"
 #include "core/gps.hpp"
 #include "io/gps_reader.hpp"
@@ -33,4 +34,165 @@ TEST_CASE( "fmm is tested", "[fmm]" ) {
     REQUIRE_THAT(result.cpath,Catch::Equals<int>({2,5,13,14,23}));
     REQUIRE(expected_mgeom==result.mgeom);
   }
+  SECTION( "ubodt_mmap_test" ) {
+    const Trajectory &trajectory = trajectories[0];
+    auto ubodt_csv = UBODT::read_ubodt_csv("../data/ubodt.txt",multiplier);
+    ubodt_csv->write_mmap_file("ubodt_test.mmap");
+    auto ubodt = UBODT::read_ubodt_file("ubodt_test.mmap");
+    REQUIRE(ubodt->is_flat());
+    REQUIRE(ubodt->get_num_rows()==ubodt_csv->get_num_rows());
+    REQUIRE(ubodt->get_delta()==ubodt_csv->get_delta());
+    REQUIRE(ubodt->look_up(2,2)==nullptr);
+    FastMapMatch model(network,graph,ubodt);
+    FastMapMatch model_csv(network,graph,ubodt_csv);
+    FastMapMatchConfig config{4,0.4,0.5};
+    MatchResult result = model.match_traj(trajectory,config);
+    MatchResult expected = model_csv.match_traj(trajectory,config);
+    REQUIRE(result.cpath==expected.cpath);
+    REQUIRE(result.mgeom==expected.mgeom);
+    std::remove("ubodt_test.mmap");
+  }
+  SECTION( "split_test" ) {
+    double x[10] = {0, 1, 2, 3, 4, 9, 10, 11, 12, 13};
+    double y[10] = {0, 0, 0, 0, 0, 0, 0, 0, 0, 0};
+    double ts[10] = {0, 1, 2, 3, 4, 5, 6, 60, 61, 62};
+    std::vector<std::pair<int, int>> ranges =
+      split_trajectory(x, y, nullptr, 10, SplitConfig(2, 0, 0));
+    REQUIRE(ranges == std::vector<std::pair<int, int>>({{0, 5}, {5, 10}}));
+    ranges = split_trajectory(x, y, ts, 10, SplitConfig(0, 30, 0));
+    REQUIRE(ranges == std::vector<std::pair<int, int>>({{0, 7}, {7, 10}}));
+    ranges = split_trajectory(x, y, nullptr, 10, SplitConfig(0, 0, 4));
+    REQUIRE(ranges ==
+            std::vector<std::pair<int, int>>({{0, 4}, {3, 7}, {6, 10}}));
+    REQUIRE(!SplitConfig(0, 0, 1).validate());
+    const Trajectory &trajectory = trajectories[0];
+    auto ubodt = UBODT::read_ubodt_csv("../data/ubodt.txt",multiplier);
+    FastMapMatch model(network,graph,ubodt);
+    FastMapMatchConfig config{4,0.4,0.5};
+    std::vector<double> tx, ty;
+    for (int i = 0; i < trajectory.geom.get_num_points(); ++i) {
+      tx.push_back(trajectory.geom.get_x(i));
+      ty.push_back(trajectory.geom.get_y(i));
+    }
+    int n = tx.size();
+    PYTHON::PyMatchResult result = model.match_split(
+      tx.data(), n, ty.data(), n, nullptr, 0, config, SplitConfig(), 2);
+    REQUIRE(result.cpath == C_Path({2,5,13,14,23}));
+    REQUIRE(result.segments.size() == 1);
+    REQUIRE(result.segments[0].state == 1);
+    REQUIRE(result.segments[0].end == n);
+  }
+  SECTION( "match_batch_test" ) {
+    auto ubodt = UBODT::read_ubodt_csv("../data/ubodt.txt",multiplier);
+    FastMapMatch model(network,graph,ubodt);
+    FastMapMatchConfig config{4,0.4,0.5};
+    std::vector<std::string> wkts;
+    for (const Trajectory &trajectory : trajectories) {
+      wkts.push_back(trajectory.geom.export_wkt());
+    }
+    wkts.push_back("LINESTRING(1 1, 2");
+    std::vector<PYTHON::PyMatchResult> results =
+      model.match_batch(wkts, config, 2);
+    REQUIRE(results.size() == wkts.size());
+    for (int i = 0; i + 1 < wkts.size(); ++i) {
+      PYTHON::PyMatchResult expected = model.match_wkt(wkts[i], config);
+      REQUIRE(results[i].id == i);
+      REQUIRE(results[i].cpath == expected.cpath);
+      REQUIRE(results[i].opath == expected.opath);
+      REQUIRE(results[i].mgeom == expected.mgeom);
+      REQUIRE(results[i].error.empty());
+    }
+    const PYTHON::PyMatchResult &malformed = results.back();
+    REQUIRE(malformed.cpath.empty());
+    REQUIRE(!malformed.error.empty());
+    REQUIRE_THROWS(model.match_wkt(wkts.back(), config));
+  }
+  SECTION( "session_test" ) {
+    const Trajectory &trajectory = trajectories[0];
+    auto ubodt = UBODT::read_ubodt_csv("../data/ubodt.txt",multiplier);
+    FastMapMatch model(network,graph,ubodt);
+    FastMapMatchConfig config{4,0.4,0.5};
+    int n = trajectory.geom.get_num_points();
+    MatchResult expected = model.match_traj(trajectory,config);
+    // Concatenate the updates of a session, the segments are shifted to
+    // the positions in the complete path.
+    SessionUpdate total;
+    auto append = [&total](const SessionUpdate &update) {
+      for (int s : update.segments) {
+        total.segments.push_back(total.cpath.size() + s);
+      }
+      total.indices.insert(total.indices.end(),
+                           update.indices.begin(), update.indices.end());
+      total.opath.insert(total.opath.end(),
+                         update.opath.begin(), update.opath.end());
+      total.cpath.insert(total.cpath.end(),
+                         update.cpath.begin(), update.cpath.end());
+      total.skipped.insert(total.skipped.end(),
+                           update.skipped.begin(), update.skipped.end());
+    };
+    std::vector<int> indices(n);
+    for (int i = 0; i < n; ++i) indices[i] = i;
+    SECTION( "large_window" ) {
+      // The window never fills up, so the session commits the same path
+      // as matching the whole trajectory.
+      FastMapMatchSession session(model, config, n + 1);
+      for (int i = 0; i < n; ++i) {
+        append(session.add_point(trajectory.geom.get_x(i),
+                                 trajectory.geom.get_y(i)));
+      }
+      append(session.flush());
+      REQUIRE(session.get_window_size() == 0);
+      REQUIRE(total.indices == indices);
+      REQUIRE(total.opath == expected.opath);
+      REQUIRE(total.cpath == expected.cpath);
+      REQUIRE(total.segments == std::vector<int>({0}));
+      REQUIRE(total.skipped.empty());
+    }
+    SECTION( "max_window" ) {
+      // The oldest point is committed once the window exceeds max_window.
+      FastMapMatchSession session(model, config, 1);
+      for (int i = 0; i < n; ++i) {
+        append(session.add_point(trajectory.geom.get_x(i),
+                                 trajectory.geom.get_y(i)));
+        REQUIRE(session.get_window_size() <= 1);
+        REQUIRE(total.indices.size() + session.get_window_size() == i + 1);
+      }
+      append(session.flush());
+      REQUIRE(session.get_num_points() == n);
+      REQUIRE(total.indices == indices);
+      REQUIRE(total.opath.size() == n);
+      REQUIRE(total.segments == std::vector<int>({0}));
+    }
+    SECTION( "disconnected" ) {
+      // Edge 27 is not connected with the edges of the trajectory.
+      FastMapMatchSession session(model, config, n + 1);
+      for (int i = 0; i < n; ++i) {
+        append(session.add_point(trajectory.geom.get_x(i),
+                                 trajectory.geom.get_y(i)));
+      }
+      append(session.add_point(1.2, 3.5));
+      append(session.add_point(1.6, 3.5));
+      append(session.flush());
+      REQUIRE(total.indices.size() == n + 2);
+      REQUIRE(total.opath[n] == 27);
+      REQUIRE(total.opath[n + 1] == 27);
+      REQUIRE(total.cpath == C_Path({2,5,13,14,23,27}));
+      REQUIRE(total.segments == std::vector<int>({0, 5}));
+    }
+    SECTION( "skipped" ) {
+      // A point far from the network has no candidate and is ignored.
+      FastMapMatchSession session(model, config, n + 1);
+      for (int i = 0; i < n; ++i) {
+        append(session.add_point(trajectory.geom.get_x(i),
+                                 trajectory.geom.get_y(i)));
+      }
+      append(session.add_point(10, 10));
+      append(session.flush());
+      REQUIRE(session.get_num_points() == n + 1);
+      REQUIRE(total.skipped == std::vector<int>({n}));
+      REQUIRE(total.indices == indices);
+      REQUIRE(total.cpath == expected.cpath);
+    }
+    REQUIRE_THROWS(FastMapMatchSession(model, config, 0));
+  }
 }
@@ -3,6 +3,8 @@
 #include "util/debug.hpp"
 #include "network/network_graph.hpp"
 #include "network/bidirectional_network_graph.hpp"
+#include <algorithm>
+#include <memory>
 
 using namespace FMM;
 using namespace FMM::CORE;
@@ -30,6 +32,21 @@ TEST_CASE( "Network graph is tested", "[network_graph]" ) {
     REQUIRE(dmap.find(network.get_node_index(3))==dmap.end());
   }
 
+  SECTION( "shortest_path_upperbound_dijkstra" ) {
+    NodeIndex source = network.get_node_index(2);
+    NodeIndex target = network.get_node_index(4);
+    double cost = 0;
+    std::vector<EdgeIndex> path = ng.shortest_path_upperbound_dijkstra(
+      source, target, 5.1, &cost);
+    REQUIRE(cost==5.0);
+    REQUIRE_THAT(path,Catch::Equals<EdgeIndex>(
+      ng.shortest_path_dijkstra(source,target)));
+    path = ng.shortest_path_upperbound_dijkstra(
+      source, network.get_node_index(3), 5.1, &cost);
+    REQUIRE(path.empty());
+    REQUIRE(cost==std::numeric_limits<double>::infinity());
+  }
+
   SECTION( "get_edge_index" ) {
     REQUIRE(network.get_edge_id(ng.get_edge_index(
       network.get_node_index(11),network.get_node_index(12),1
@@ -39,6 +56,24 @@ TEST_CASE( "Network graph is tested", "[network_graph]" ) {
     ) == -1);
   }
 
+  SECTION( "get_edges_within_dist" ) {
+    EdgeIndex e_idx = network.get_edge_index(2);
+    std::vector<EdgeIndex> edges = ng.get_edges_within_dist({e_idx}, 3);
+    REQUIRE(std::is_sorted(edges.begin(), edges.end()));
+    REQUIRE(std::find(edges.begin(), edges.end(), e_idx) != edges.end());
+    REQUIRE(ng.get_edges_within_dist({e_idx}, 0).size()==1);
+    REQUIRE(edges.size() <= ng.get_edges_within_dist({e_idx}, 5).size());
+    std::unique_ptr<Network> tile(network.extract(edges));
+    REQUIRE(tile->get_edge_count()==edges.size());
+    for (EdgeIndex i : edges) {
+      const Edge &edge = network.get_edges()[i];
+      REQUIRE(tile->get_edge_geom(edge.id)==edge.geom);
+      REQUIRE(tile->get_node_id(tile->get_edge(edge.id).source)==
+              network.get_node_id(edge.source));
+    }
+    REQUIRE_THROWS(ng.get_edges_within_dist({10000}, 1));
+  }
+
   SECTION( "bidirectional_dijkstra" ) {
     NodeID source_id = 2;
     NodeID target_id = 3;
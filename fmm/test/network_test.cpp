@@ -3,6 +3,8 @@
 #include "util/debug.hpp"
 #include "network/network.hpp"
 #include "algorithm/geom_algorithm.hpp"
+#include <cstdio>
+#include <memory>
 
 using namespace FMM;
 using namespace FMM::CORE;
@@ -48,4 +50,72 @@ TEST_CASE( "Network is tested", "[network]" ) {
     trcs = network.search_tr_cs_knn(line,3,0.05);
     REQUIRE(trcs.size()==0);
   }
+
+  SECTION( "snapshot_test" ) {
+    network.save_snapshot("network_test.snap");
+    Network snapshot("network_test.snap");
+    REQUIRE(snapshot.get_node_count()==network.get_node_count());
+    REQUIRE(snapshot.get_edge_count()==network.get_edge_count());
+    for (const Edge &edge : network.get_edges()) {
+      const Edge &loaded = snapshot.get_edge(edge.id);
+      REQUIRE(loaded.index==edge.index);
+      REQUIRE(loaded.source==edge.source);
+      REQUIRE(loaded.target==edge.target);
+      REQUIRE(loaded.geom==edge.geom);
+    }
+    LineString line = wkt2linestring("LineString(2.1 1.9,2.1 2.8)");
+    Traj_Candidates trcs = snapshot.search_tr_cs_knn(line,3,0.15);
+    REQUIRE(trcs.size()==2);
+    REQUIRE(trcs[0].size()==3);
+    REQUIRE(trcs[1].size()==2);
+    std::remove("network_test.snap");
+  }
+
+  SECTION( "candidate_index_test" ) {
+    LineString line = wkt2linestring("LineString(2.1 1.9,2.1 2.8)");
+    Traj_Candidates expected = network.search_tr_cs_knn(line,3,0.15);
+    std::shared_ptr<CandidateIndex> index = CandidateIndex::build(network,0.2);
+    index->write("network_test.idx");
+    network.set_candidate_index(
+      CandidateIndex::read("network_test.idx",network));
+    Traj_Candidates trcs = network.search_tr_cs_knn(line,3,0.15);
+    REQUIRE(trcs.size()==expected.size());
+    // Candidates of the same distance may be found in another order
+    auto sorted = [](const Point_Candidates &pcs) {
+      std::vector<std::pair<double, EdgeID>> items;
+      for (const Candidate &c : pcs) items.push_back({c.dist, c.edge->id});
+      std::sort(items.begin(), items.end());
+      return items;
+    };
+    for (int i = 0; i < trcs.size(); ++i) {
+      REQUIRE(sorted(trcs[i])==sorted(expected[i]));
+    }
+    REQUIRE(network.search_tr_cs_knn(line,3,0.05).size()==0);
+    std::size_t count;
+    REQUIRE(index->look_up(100,100,&count)==nullptr);
+    REQUIRE(count==0);
+    network.set_candidate_index(nullptr);
+    std::remove("network_test.idx");
+  }
+
+  SECTION( "from_arrays_test" ) {
+    long long ids[] = {1, 2};
+    long long sources[] = {10, 11};
+    long long targets[] = {11, 12};
+    double coords[] = {0, 0, 1, 0, 1, 0, 1, 0.5, 1, 1};
+    long long offsets[] = {0, 2, 5};
+    std::unique_ptr<Network> arrays(Network::from_arrays(
+      ids, 2, sources, 2, targets, 2, coords, 10, offsets, 3));
+    REQUIRE(arrays->get_node_count()==3);
+    REQUIRE(arrays->get_edge_count()==2);
+    REQUIRE(arrays->get_edge_geom(2)==wkt2linestring("LineString(1 0,1 0.5,1 1)"));
+    REQUIRE(arrays->get_node_id(arrays->get_edge(2).source)==11);
+    Traj_Candidates trcs = arrays->search_tr_cs_knn(
+      wkt2linestring("LineString(0.5 0.01,1.01 0.6)"),2,0.05);
+    REQUIRE(trcs.size()==2);
+    REQUIRE(trcs[1][0].edge->id==2);
+    long long bad_offsets[] = {0, 1, 5};
+    REQUIRE_THROWS(Network::from_arrays(
+      ids, 2, sources, 2, targets, 2, coords, 10, bad_offsets, 3));
+  }
 }